@@ -1,13 +1,21 @@
 # External modules
-import openai, os, asyncio
+import os, asyncio
+from typing import AsyncIterator
 from vector_database import _DIM
 from random import random
 
 # Internal modules
-from utility import batch_iterator, Result
+from utility import Result
+from batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from scheduler import SCHEDULER
+from openai_client import OpenAIClient, OPENAI_BASE_URL
+from rate_limiter import RateLimiter, Priority
+from tokenizer import TOKENIZER, tokens_from_string
 from debug import LogHanglerInterface, LogNothing, LogType
 
-openai.api_key = os.environ["API_KEY_OPENAI"]
+API_KEY_OPENAI = os.environ["API_KEY_OPENAI"]
+BASE_URL_OPENAI = os.environ.get("BASE_URL_OPENAI", OPENAI_BASE_URL)
 EMBEDDING_MAX_TOKENS     = 8191
 EMBEDDING_MAX_BATCH_SIZE = 1000
 # EMBEDDING_MAX_TOKEN_SIZE = 7800         # 100 tokens ~= 75 words, hence  tokens = 1.33333333333333333333333 * words
@@ -16,21 +24,90 @@ TPM = 150000
 
 MAX_TOKENS = 4096
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_WAIT = 0.005            # In seconds, how long requests from different channels are collected into one batch
 
+EMBEDDING_CACHE_DIRECTORY = "embedding-cache"
+EMBEDDING_CACHE_CAPACITY  = 20000       # Vectors kept on disk, 1536 float32 each (~6 KB)
 
-async def embed_strings(strings: list[str], log: LogHanglerInterface=LogNothing()) -> Result[list[list[float]]]:
+CHAT_MODEL = "gpt-3.5-turbo"
+CHAT_RESPONSE_TOKENS = 500              # Tokens reserved for a response when rate limiting, the prompt is counted
+
+RATE_LIMITER: RateLimiter = RateLimiter(RPM, TPM)
+
+_OPENAI_CLIENT    : OpenAIClient     | None = None
+_EMBEDDING_BATCHER: EmbeddingBatcher | None = None
+_EMBEDDING_CACHE  : EmbeddingCache   | None = None
+
+
+def get_openai_client() -> OpenAIClient:
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        _OPENAI_CLIENT = OpenAIClient(API_KEY_OPENAI, BASE_URL_OPENAI)
+    return _OPENAI_CLIENT
+
+
+async def close() -> None:
+    if _OPENAI_CLIENT is not None:
+        await _OPENAI_CLIENT.close()
+
+
+async def _create_embeddings(strings: list[str]) -> tuple[list[list[float]], int]:
+    async with SCHEDULER.openai_call():
+        response = await get_openai_client().embeddings(strings, EMBEDDING_MODEL)
+    embeddings: list[list[float]] = [embeddingObj["embedding"] for embeddingObj in response["data"]]     # type: ignore
+    return embeddings, response["usage"]["total_tokens"]                                                # type: ignore
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _EMBEDDING_BATCHER
+    if _EMBEDDING_BATCHER is None:
+        _EMBEDDING_BATCHER = EmbeddingBatcher(
+            _create_embeddings, 
+            max_batch_size   = EMBEDDING_MAX_BATCH_SIZE, 
+            max_batch_tokens = TPM, 
+            rate_limiter     = RATE_LIMITER,
+            max_wait         = EMBEDDING_BATCH_WAIT,
+            token_counter    = tokens_from_string)
+    return _EMBEDDING_BATCHER
+
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _EMBEDDING_CACHE
+    if _EMBEDDING_CACHE is None:
+        _EMBEDDING_CACHE = EmbeddingCache(EMBEDDING_CACHE_DIRECTORY, _DIM, EMBEDDING_CACHE_CAPACITY)
+    return _EMBEDDING_CACHE
+
+
+
+def get_cached_embeddings(strings: list[str]) -> list[list[float] | None]:
+    '''Embeddings of the strings which are cached, None for the others. Doesn't count towards the cache's hit rate'''
+    return get_embedding_cache().get_many(EMBEDDING_MODEL, strings, count=False)
+
+
+
+async def embed_strings(strings: list[str], log: LogHanglerInterface=LogNothing(), priority: Priority=Priority.EMBEDDING) -> Result[list[list[float]]]:
     embeddings: list[list[float]] = []
     tokens: int = 0
 
     try:
-        for batch in batch_iterator(strings, EMBEDDING_MAX_BATCH_SIZE):
-            response = await asyncio.get_event_loop().run_in_executor(None, lambda _ : openai.Embedding.create(model="text-embedding-ada-002", input = batch), "param")
-            tokens += response["usage"]["total_tokens"]     # type: ignore
-
-            for embeddingObj in response["data"]:           # type: ignore
-                embeddings.append(embeddingObj["embedding"])     
+        # Only strings which aren't cached are sent, each of them once
+        cache: EmbeddingCache = get_embedding_cache()
+        cached: list[list[float] | None] = cache.get_many(EMBEDDING_MODEL, strings)
+        missing: list[str] = list(dict.fromkeys(string for string, embedding in zip(strings, cached) if embedding is None))
+        if len(missing):
+            missing_embeddings, tokens = await get_embedding_batcher().embed(missing, priority)
+            cache.put_many(EMBEDDING_MODEL, missing, missing_embeddings)
+            found: dict[str, list[float]] = dict(zip(missing, missing_embeddings))
+            cached = [embedding if embedding is not None else found[string] for string, embedding in zip(strings, cached)]
+        embeddings = cached     # type: ignore
 
         log.log(LogType.INFO, f"EMBEDDING TOKENS: {tokens}")
+        log.log(LogType.DEBUG, (f"EMBEDDING CACHE:\n"
+                                f"hits     : {len(strings) - len(missing)}/{len(strings)}\n"
+                                f"hit rate : {cache.stats.hit_rate():.2f}\n"
+                                f"evictions: {cache.stats.evictions}"))
         return Result.ok(embeddings)
     except Exception as e:
         log.log(LogType.ERROR, f"Failed to generate embedding(s)!\nerror: {e}")
@@ -39,12 +116,19 @@ async def embed_strings(strings: list[str], log: LogHanglerInterface=LogNothing(
     # return [[random()*2-1 for i in range(_DIM)] for j in range(len(strings)) ]
 
 
+async def _wait_for_chat_rate_limit(message: str, log: LogHanglerInterface=LogNothing()) -> None:
+    waited: float = await RATE_LIMITER.acquire(await TOKENIZER.count_tokens(message) + CHAT_RESPONSE_TOKENS, Priority.CHAT)
+    if waited > 0:
+        log.log(LogType.INFO, (f"RATE LIMITED:\n"
+                               f"waited : {waited:.2f}s\n"
+                               f"queued : {RATE_LIMITER.queue_depth()}"))
+
+
 async def openai_generate_response(message : str, log: LogHanglerInterface=LogNothing()) -> Result[str]:
     try:
-        response = await asyncio.get_event_loop().run_in_executor(None, lambda _ : openai.ChatCompletion.create(
-            model       =   "gpt-3.5-turbo",
-            messages    =   [{"role": "user", "content": message}],
-            temperature =   0.5), "param")
+        await _wait_for_chat_rate_limit(message, log)
+        async with SCHEDULER.openai_call():
+            response = await get_openai_client().chat_completion([{"role": "user", "content": message}], CHAT_MODEL, temperature=0.5)
         
         prompt_tokens       = response['usage']['prompt_tokens']        # type: ignore
         completion_tokens   = response['usage']['completion_tokens']    # type: ignore
@@ -58,6 +142,28 @@ async def openai_generate_response(message : str, log: LogHanglerInterface=LogNo
     # return "Cool!"
 
 
+async def openai_stream_response(message : str, log: LogHanglerInterface=LogNothing()) -> AsyncIterator[str]:
+    '''Yields the lines of the response as soon as each of them is complete'''
+    buffer: str = ""
+    lines : int = 0
+    try:
+        await _wait_for_chat_rate_limit(message, log)
+        async with SCHEDULER.openai_call():
+            async for content in get_openai_client().chat_completion_stream([{"role": "user", "content": message}], CHAT_MODEL, temperature=0.5):
+                buffer += content
+                *complete, buffer = buffer.split('\n')
+                for line in complete:
+                    lines += 1
+                    yield line
+        if buffer != "":
+            lines += 1
+            yield buffer
+        log.log(LogType.INFO, f"RESPONSE STREAMED:\nlines: {lines}")
+    except Exception as e:
+        log.log(LogType.ERROR, f"Failed to stream response!\nerror: {e}")
+        raise
+
+
 if __name__ == "__main__":
     async def main():
         response = (await openai_generate_response("Hello, World!")).unwrap_or("FAILED TO UNWRAP")
@@ -0,0 +1,173 @@
+# External modules
+import asyncio, json, os
+from dataclasses import dataclass
+from typing import AsyncIterator, Any
+import discord
+from discord import Message as DiscordMessage
+
+# Internal modules
+import ai
+from structure import Message
+from rate_limiter import Priority
+from memory import ComplexMemory
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+BACKFILL_LIMIT       : int = 20000                          # Messages of history archived for a new channel
+BACKFILL_BATCH_SIZE  : int = ai.EMBEDDING_MAX_BATCH_SIZE    # Messages embedded and inserted at once
+BACKFILL_CONCURRENCY : int = 2                              # Batches being embedded at the same time
+BACKFILL_QUEUE_SIZE  : int = 2                              # Batches fetched ahead of the embedders
+
+
+
+def parse_discord_message(message: DiscordMessage) -> Message:
+    return Message(
+        message.id,
+        str(message.created_at),
+        message.author.name if str(message.author.discriminator) == '0' else f"{message.author.name}#{message.author.discriminator}",
+        message.content)
+
+
+async def history_batches(channel: Any, before_id: int | None, limit: int, batch_size: int) -> AsyncIterator[list[Message]]:
+    '''Streams a channel's history from newest to oldest, in batches, starting before the given message'''
+    before = discord.Object(id=before_id) if before_id is not None else None
+    batch: list[Message] = []
+    async for message in channel.history(limit=limit, before=before, oldest_first=False):
+        batch.append(parse_discord_message(message))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch): yield batch
+
+
+
+@dataclass
+class BackfillCheckpoint:
+    before_id: int | None       # History older than this message hasn't been archived yet
+    archived : int = 0
+    done     : bool = False
+
+    def from_json(self, json: dict) -> None:
+        self.before_id = json["before_id"]
+        self.archived = json["archived"]
+        self.done = json["done"]
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "before_id": self.before_id,
+            "archived": self.archived,
+            "done": self.done
+        }
+
+
+
+@dataclass
+class _Batch:
+    number  : int
+    messages: list[Message]
+
+
+
+class HistoryBackfill:
+    '''
+    Archives a channel's history into long-term memory in the background.
+    History is streamed, embedded in full batches by a few workers and inserted in order.
+    Progress is checkpointed after every batch so an interrupted backfill continues where it stopped.
+    '''
+    channel_id: int
+    channel   : Any
+    memory    : ComplexMemory
+    checkpoint: BackfillCheckpoint
+    limit     : int
+
+    @staticmethod
+    def get_checkpoint_file_path(channel_id: int) -> str:
+        return f"channel-memory/backfill_{channel_id}.json"
+
+
+    @staticmethod
+    def load_checkpoint(channel_id: int) -> BackfillCheckpoint | None:
+        file_path: str = HistoryBackfill.get_checkpoint_file_path(channel_id)
+        if not os.path.isfile(file_path): return None
+        checkpoint: BackfillCheckpoint = BackfillCheckpoint(None)
+        with open(file_path, encoding="utf-8") as file:
+            checkpoint.from_json(json.load(file))
+        return checkpoint
+
+
+    @staticmethod
+    def is_unfinished(channel_id: int) -> bool:
+        checkpoint: BackfillCheckpoint | None = HistoryBackfill.load_checkpoint(channel_id)
+        return checkpoint is not None and not checkpoint.done
+
+
+    def __init__(self, channel: Any, memory: ComplexMemory, before_id: int | None, limit: int=BACKFILL_LIMIT) -> None:
+        self.channel_id = int(channel.id)
+        self.channel = channel
+        self.memory = memory
+        self.limit = limit
+        checkpoint: BackfillCheckpoint | None = HistoryBackfill.load_checkpoint(self.channel_id)
+        self.resumed = checkpoint is not None
+        self.checkpoint = checkpoint if checkpoint is not None else BackfillCheckpoint(before_id)
+
+
+    def _save_checkpoint(self) -> None:
+        file_path: str = HistoryBackfill.get_checkpoint_file_path(self.channel_id)
+        with open(file_path + ".tmp", 'w', encoding="utf-8") as file:
+            json.dump(self.checkpoint.to_json(), file)
+        os.replace(file_path + ".tmp", file_path)
+
+
+    async def run(self, log: LogHanglerInterface=LogNothing()) -> None:
+        if self.checkpoint.done: return
+        self._save_checkpoint()
+        log.log(LogType.INFO, (f"Backfill {'resumed' if self.resumed else 'started'}\n"
+                               f"channel : {self.channel_id}\n"
+                               f"before  : {self.checkpoint.before_id}\n"
+                               f"archived: {self.checkpoint.archived}/{self.limit}"))
+
+        queue: asyncio.Queue[_Batch | None] = asyncio.Queue(maxsize=BACKFILL_QUEUE_SIZE)
+        inserted: dict[int, asyncio.Event] = {}
+        inserted[-1] = asyncio.Event()
+        inserted[-1].set()
+
+        async def produce():
+            number: int = 0
+            async for messages in history_batches(self.channel, self.checkpoint.before_id, self.limit - self.checkpoint.archived, BACKFILL_BATCH_SIZE):
+                inserted[number] = asyncio.Event()
+                await queue.put(_Batch(number, messages))        # Waits while embedders are behind
+                number += 1
+            for _ in range(BACKFILL_CONCURRENCY): await queue.put(None)
+
+        async def consume():
+            while (batch := await queue.get()) is not None:
+                # The first batch after resuming may have been inserted before the interruption,
+                # it's inserted again into the vector store and skipped by the archive
+                reinserted: bool = batch.number == 0 and self.resumed
+                if reinserted:
+                    await self.memory.LTM.remove_messages([message.id for message in batch.messages], log=log.sub())
+
+                embeddings: list[list[float]] = (await ai.embed_strings([message.content if message.content != "" else "[attachment]" for message in batch.messages], log=log.sub(), priority=Priority.BACKFILL)).unwrap()
+
+                # Insert in order, so the checkpoint only ever covers archived history
+                await inserted[batch.number - 1].wait()
+                batch.messages.reverse()
+                embeddings.reverse()
+                await self.memory.add_messages_to_long_term_memory(batch.messages, embeddings, skip_archived=reinserted, log=log.sub())
+                self.checkpoint.before_id = batch.messages[0].id
+                self.checkpoint.archived += len(batch.messages)
+                self._save_checkpoint()
+                inserted[batch.number].set()
+                log.log(LogType.INFO, f"Backfilled {self.checkpoint.archived}/{self.limit} message(s) - {self.channel_id}")
+
+        tasks: list[asyncio.Task] = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(BACKFILL_CONCURRENCY)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            for task in tasks: task.cancel()
+            log.log(LogType.ERROR, f"Backfill interrupted - {self.channel_id}\nerror: {e}\narchived: {self.checkpoint.archived}")
+            return
+
+        self.checkpoint.done = True
+        self._save_checkpoint()
+        log.log(LogType.OK, f"Backfill done - {self.channel_id}\narchived: {self.checkpoint.archived}")
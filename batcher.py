@@ -0,0 +1,147 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Awaitable
+
+from rate_limiter import RateLimiter, Priority
+
+
+# Sends a batch of strings, returns their embeddings and the amount of tokens used
+EmbedFunction = Callable[[list[str]], Awaitable[tuple[list[list[float]], int]]]
+
+
+def estimate_tokens(string: str) -> int:
+    return len(string) // 4 + 1
+
+
+
+@dataclass
+class _EmbeddingRequest:
+    strings : list[str]
+    tokens  : int
+    future  : asyncio.Future
+    priority: Priority
+
+
+
+@dataclass
+class BatcherStats:
+    requests: int = 0
+    batches : int = 0
+    strings : int = 0
+    tokens  : int = 0
+    rate_limited_seconds: float = 0
+
+    def average_batch_size(self) -> float:
+        return self.strings / self.batches if self.batches else 0
+
+
+
+class EmbeddingBatcher:
+    '''
+    Collects embedding requests from every channel for a short while (or until a batch is full)
+    and sends them as a single call, results are handed back to each caller.
+    Batches are sent through the rate limiter shared with other calls, with the priority of their most urgent request.
+    '''
+    embed_function  : EmbedFunction
+    max_batch_size  : int
+    max_batch_tokens: int
+    max_wait        : float         # In seconds
+    rate_limiter    : RateLimiter
+    stats           : BatcherStats
+
+    def __init__(self,
+                 embed_function: EmbedFunction,
+                 max_batch_size: int,
+                 max_batch_tokens: int,
+                 rate_limiter: RateLimiter,
+                 max_wait: float=0.005,
+                 token_counter: Callable[[str], int]=estimate_tokens) -> None:
+        self.embed_function = embed_function
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.token_counter = token_counter
+        self.rate_limiter = rate_limiter
+        self.stats = BatcherStats()
+        self._pending: deque[_EmbeddingRequest] = deque()
+        self._pending_tokens: int = 0
+        self._pending_strings: int = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+
+    async def embed(self, strings: list[str], priority: Priority=Priority.EMBEDDING) -> tuple[list[list[float]], int]:
+        '''Returns the embeddings of the given strings and the amount of tokens used for them'''
+        if not len(strings): return [], 0
+        loop = asyncio.get_running_loop()
+
+        # Requests larger than a batch are split into several
+        requests: list[_EmbeddingRequest] = []
+        for i in range(0, len(strings), self.max_batch_size):
+            chunk: list[str] = strings[i:i+self.max_batch_size]
+            requests.append(_EmbeddingRequest(chunk, sum(self.token_counter(string) for string in chunk), loop.create_future(), priority))
+
+        for request in requests:
+            self._pending.append(request)
+            self._pending_tokens  += request.tokens
+            self._pending_strings += len(request.strings)
+        self.stats.requests += 1
+
+        if self._pending_strings >= self.max_batch_size or self._pending_tokens >= self.max_batch_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        results: list[tuple[list[list[float]], int]] = await asyncio.gather(*[request.future for request in requests])
+        embeddings: list[list[float]] = [embedding for result in results for embedding in result[0]]
+        return embeddings, sum(result[1] for result in results)
+
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while len(self._pending):
+            batch: list[_EmbeddingRequest] = []
+            size  : int = 0
+            tokens: int = 0
+            while len(self._pending):
+                request: _EmbeddingRequest = self._pending[0]
+                if len(batch) and (size + len(request.strings) > self.max_batch_size or tokens + request.tokens > self.max_batch_tokens):
+                    break
+                batch.append(self._pending.popleft())
+                size   += len(request.strings)
+                tokens += request.tokens
+            self._pending_strings -= size
+            self._pending_tokens  -= tokens
+            task: asyncio.Task = asyncio.get_running_loop().create_task(self._send(batch, tokens))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+    async def _send(self, batch: list[_EmbeddingRequest], tokens: int) -> None:
+        self.stats.rate_limited_seconds += await self.rate_limiter.acquire(tokens, min(request.priority for request in batch))
+
+        strings: list[str] = [string for request in batch for string in request.strings]
+        try:
+            embeddings, used_tokens = await self.embed_function(strings)
+            if len(embeddings) != len(strings):
+                raise ValueError(f"Expected {len(strings)} embeddings, got {len(embeddings)}")
+        except Exception as e:
+            for request in batch:
+                if not request.future.done(): request.future.set_exception(e)
+            return
+
+        self.stats.batches += 1
+        self.stats.strings += len(strings)
+        self.stats.tokens  += used_tokens
+
+        # Hand results back, tokens are shared by each request's estimated size
+        start: int = 0
+        for request in batch:
+            share: int = round(used_tokens * request.tokens / tokens) if tokens else 0
+            if not request.future.done():
+                request.future.set_result((embeddings[start:start+len(request.strings)], share))
+            start += len(request.strings)
@@ -0,0 +1,83 @@
+'''
+Latency of expanding long-term memory hits with the messages around them, per reply.
+Compares fetching every hit one after another (as before) with ContextStore, which only expands the hits
+put into the prompt, serves them from the archive or cached windows and fetches the rest concurrently.
+
+The history source is fake, every fetch takes --latency seconds:
+    python -m benchmark.bench_context [--replies 200] [--latency 0.15] [--archived 0.5]
+'''
+import asyncio, argparse, random, time
+
+from structure import Message
+from context import ContextStore
+from benchmark.bench_prompt import fake_history
+
+
+HITS_PER_REPLY = 10
+WINDOW         = 20
+
+
+class FakeHistorySource:
+    def __init__(self, history: list[Message], latency: float) -> None:
+        self.history = history
+        self.latency = latency
+        self.calls = 0
+
+    async def __call__(self, channel_id: int, message: Message, limit: int) -> list[Message]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.history[max(message.id - limit // 2, 0):message.id + limit - limit // 2]
+
+
+class FakeMemory:
+    '''Only part of the history is archived locally, like a channel whose backfill hasn't reached it yet'''
+    def __init__(self, history: list[Message], archived: float) -> None:
+        self.channel_id = 1
+        self.history = history
+        self.archived_from = int(len(history) * (1 - archived))
+
+    async def get_messages_around(self, message_id: int, amount: int, log=None) -> list[Message]:
+        if message_id < self.archived_from: return []
+        return self.history[max(message_id - amount // 2, self.archived_from):message_id + amount - amount // 2]
+
+
+def search_results(history: list[Message], replies: int) -> list[list[Message]]:
+    '''Searches keep finding the same memorable messages'''
+    weights: list[float] = [1 / (rank + 1) for rank in range(len(history))]
+    random.shuffle(weights)
+    return [random.choices(history, weights, k=HITS_PER_REPLY) for _ in range(replies)]
+
+
+async def main(replies: int, latency: float, archived: float) -> None:
+    history: list[Message] = fake_history(5000)
+    results: list[list[Message]] = search_results(history, replies)
+
+    # Previous behaviour: every hit fetched sequentially, only the first 3 used
+    source = FakeHistorySource(history, latency)
+    start: float = time.perf_counter()
+    for hits in results:
+        [await source(1, message, WINDOW) for message in hits]
+    previous: float = time.perf_counter() - start
+    previous_calls: int = source.calls
+
+    source = FakeHistorySource(history, latency)
+    store = ContextStore(source, window=WINDOW)
+    memory = FakeMemory(history, archived)
+    start = time.perf_counter()
+    for hits in results:
+        await store.expand(memory, hits[:3])    # type: ignore
+    current: float = time.perf_counter() - start
+
+    print(f"replies: {replies}, fetch latency: {latency * 1000:.0f} ms, archived: {archived * 100:.0f}%")
+    print(f"sequential, every hit : {previous / replies * 1000:.1f} ms/reply, {previous_calls} fetches")
+    print(f"context store         : {current / replies * 1000:.1f} ms/reply, {source.calls} fetches")
+    print(store.stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replies", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--archived", type=float, default=0.5)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.replies, arguments.latency, arguments.archived))
@@ -0,0 +1,94 @@
+'''
+Recall and latency of the local vector store (exhaustive and IVF indexed search) against Milvus.
+Recall@limit is measured against the exact neighbours, computed up front with NumPy.
+
+Local store only, in a temporary directory:
+    python -m benchmark.bench_local_vector_database [--rows 20000] [--queries 200]
+With a local Milvus running on localhost:19530:
+    python -m benchmark.bench_local_vector_database --milvus
+'''
+import asyncio, argparse, tempfile, time
+import numpy as np
+
+import vector_database
+from interface import VectorStoreInterface
+from local_vector_database import LocalVectorStore
+from vector_database import CollectionType, _DIM
+from structure import Message, DatabaseEntry
+
+
+CHANNEL = 1
+
+
+def clustered_vectors(rows: int, dim: int, clusters: int, seed: int=0) -> np.ndarray:
+    '''Embeddings of a chat are far from uniform, topics form clusters'''
+    random = np.random.default_rng(seed)
+    centers: np.ndarray = random.standard_normal((clusters, dim)).astype(np.float32)
+    vectors: np.ndarray = centers[random.integers(0, clusters, rows)] + 0.5 * random.standard_normal((rows, dim)).astype(np.float32)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, limit: int) -> list[set[int]]:
+    distances: np.ndarray = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    return [set(row.tolist()) for row in np.argsort(distances, axis=1)[:, :limit]]
+
+
+async def fill(store: VectorStoreInterface, vectors: np.ndarray) -> None:
+    await store.create_channel_memory_if_new(CHANNEL)
+    entries: list[DatabaseEntry] = [DatabaseEntry(Message(id, "2021-01-01 00:00:00.000000", "Bob", "Hello"), vector.tolist()) for id, vector in enumerate(vectors)]
+    for start in range(0, len(entries), 5000):
+        await store.add_entries(CHANNEL, entries[start:start + 5000])
+    await store.create_index()
+
+
+async def measure(name: str, store: VectorStoreInterface, queries: np.ndarray, truth: list[set[int]], limit: int) -> None:
+    await store.search_hits(CHANNEL, [queries[0].tolist()], limit=limit)   # Opens or loads the partition
+    latencies: list[float] = []
+    recall: float = 0
+    for query, expected in zip(queries, truth):
+        start: float = time.perf_counter()
+        hits = (await store.search_hits(CHANNEL, [query.tolist()], limit=limit)).unwrap()[0]
+        latencies.append(time.perf_counter() - start)
+        recall += len(set(hit.message.id for hit in hits) & expected) / limit
+    print(f"{name:<16} recall@{limit}: {recall / len(queries):.3f}   "
+          f"p50: {np.percentile(latencies, 50) * 1000:7.2f} ms   p99: {np.percentile(latencies, 99) * 1000:7.2f} ms")
+
+
+async def run(rows: int, queries_amount: int, limit: int, clusters: int, milvus: bool) -> None:
+    vectors: np.ndarray = clustered_vectors(rows, _DIM, clusters)
+    queries: np.ndarray = clustered_vectors(queries_amount, _DIM, clusters, seed=1)     # Same centers, other points
+    truth  : list[set[int]] = exact_neighbours(vectors, queries, limit)
+    print(f"rows: {rows}, dim: {_DIM}, queries: {queries_amount}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        exact = LocalVectorStore(f"{directory}/exact", index_min_rows=rows + 1)
+        await fill(exact, vectors)
+        await measure("local exact", exact, queries, truth, limit)
+        await exact.close()
+
+        indexed = LocalVectorStore(f"{directory}/indexed", index_min_rows=0)
+        start: float = time.perf_counter()
+        await fill(indexed, vectors)
+        print(f"local IVF insert + build: {time.perf_counter() - start:.1f}s")
+        await measure("local IVF", indexed, queries, truth, limit)
+        await indexed.close()
+
+    if milvus:
+        await vector_database.connect_to_database()
+        await vector_database.DROP_ALL_MEMORY(CollectionType.TESTING)
+        connection = await vector_database.create_connection_to_collection(CollectionType.TESTING)
+        await fill(connection, vectors)
+        await measure("milvus IVF_FLAT", connection, queries, truth, limit)
+        await vector_database.DROP_ALL_MEMORY(CollectionType.TESTING)
+        await vector_database.disconnect_from_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--milvus", action="store_true")
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.rows, arguments.queries, arguments.limit, arguments.clusters, arguments.milvus))
@@ -0,0 +1,53 @@
+'''
+Cost of LogJsonFile.log for the caller, with the previous transport (read the whole JSON log, append, rewrite it)
+and with the LogPipe (queue drained by a background thread appending to a newline delimited file).
+
+Run from the repository root:
+    python -m benchmark.bench_logging [--logs 5000]
+'''
+import argparse, json, os, tempfile, time
+
+import debug
+from debug import LogJsonFile, LogPipe, LogType
+
+
+def log_previous(file_path: str, lines: list[str]) -> None:
+    with open(file_path, encoding='utf-8') as file:
+        json_data: list = json.load(file)
+    json_data.extend(lines)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        json.dump(json_data, file, ensure_ascii=False)
+
+
+def main(logs: int) -> None:
+    message: str = "Added message(s) to memory!\nmessage: (2021-01-01 00:00:00) <1234> Bob: Hello, World!"
+    directory: str = tempfile.mkdtemp()
+
+    # Previous transport, the same lines without the formatting
+    file_path: str = os.path.join(directory, "logs.json")
+    with open(file_path, 'w', encoding='utf-8') as file: json.dump([], file)
+    start: float = time.perf_counter()
+    for _ in range(logs):
+        log_previous(file_path, message.split('\n'))
+    previous: float = time.perf_counter() - start
+
+    # LogPipe
+    debug.LOG_PIPE = LogPipe(os.path.join(directory, "logs.jsonl"))
+    log = LogJsonFile(LogType.DEBUG, "benchmark")
+    start = time.perf_counter()
+    for _ in range(logs):
+        log.log(LogType.INFO, message)
+    queued: float = time.perf_counter() - start
+    debug.LOG_PIPE.flush()
+    written: float = time.perf_counter() - start
+
+    print(f"logs            : {logs}")
+    print(f"rewrite JSON    : {previous / logs * 1e6:.0f} us/log ({previous:.2f}s)")
+    print(f"log pipe, caller: {queued / logs * 1e6:.0f} us/log ({queued:.2f}s)")
+    print(f"log pipe, total : {written / logs * 1e6:.0f} us/log ({written:.2f}s), {debug.LOG_PIPE.lines_written} lines in {debug.LOG_PIPE.writes} writes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logs", type=int, default=5000)
+    main(parser.parse_args().logs)
@@ -0,0 +1,58 @@
+'''
+Write amplification of MemoryJson: append-only log vs the previous format, which rewrote the whole 
+channel-memory/<id>.json file on every add_messages and remove_oldest_messages.
+
+Run from the repository root:
+    python -m benchmark.bench_memory_storage [--messages 5000] [--window 100]
+'''
+import asyncio, argparse, json, os, tempfile, time
+
+from memory import MemoryJson
+from benchmark.bench_prompt import fake_history
+
+
+async def main(amount: int, window: int) -> None:
+    cwd: str = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.mkdir("channel-memory")
+        try:
+            stm: MemoryJson = await MemoryJson.create(-1)
+            ltm: MemoryJson = await MemoryJson.create(-1, "ltm")
+            payload: int = 0
+            legacy : int = 0
+            start: float = time.perf_counter()
+            for message in fake_history(amount):
+                await stm.add_messages([message])
+                legacy  += len(json.dumps(stm.memory.to_json(), ensure_ascii=False).encode("utf-8"))
+                payload += len(json.dumps(message.object_to_list(), ensure_ascii=False).encode("utf-8"))
+                if len(stm.memory.messages) > window:
+                    overflow = stm.memory.messages[:1]
+                    await stm.remove_oldest_messages(1)
+                    legacy += len(json.dumps(stm.memory.to_json(), ensure_ascii=False).encode("utf-8"))
+                    await ltm.add_messages(overflow)
+                    legacy += len(json.dumps(ltm.memory.to_json(), ensure_ascii=False).encode("utf-8"))
+            elapsed: float = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await MemoryJson.create(-1)
+            await MemoryJson.create(-1, "ltm")
+            recovery: float = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    written: int = stm.log_file.bytes_written + ltm.log_file.bytes_written
+    print(f"messages            : {amount} (stm window {window})")
+    print(f"message payload     : {payload / 1e6:.2f} MB")
+    print(f"legacy json written : {legacy / 1e6:.2f} MB ({legacy / payload:.1f}x)")
+    print(f"append log written  : {written / 1e6:.2f} MB ({written / payload:.1f}x)")
+    print(f"append log time     : {elapsed:.2f}s")
+    print(f"recovery time       : {recovery * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--window"  , type=int, default=100)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.messages, arguments.window))
@@ -0,0 +1,54 @@
+'''
+Memory footprint of a channel's messages as a list of dataclass instances (as ShortTermMemory kept them before)
+vs the columnar MessageStore, measured with tracemalloc, along with the time to load them from their JSON form.
+
+Run from the repository root:
+    python -m benchmark.bench_message_store [--messages 20000] [--channels 20]
+'''
+import argparse, json, time, tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Any
+
+from structure import MessageStore, format_timestamp
+from benchmark.bench_prompt import fake_history
+
+
+@dataclass
+class LegacyMessage:
+    id     : int
+    date   : str
+    author : str
+    content: str
+
+
+def measure(build: Callable[[], Any]) -> tuple[int, float, Any]:
+    tracemalloc.start()
+    start: float = time.perf_counter()
+    result: Any = build()
+    seconds: float = time.perf_counter() - start
+    size: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, seconds, result
+
+
+def main(amount: int, channels: int) -> None:
+    # Loaded from JSON, as a channel's memory would be
+    serialized: str = json.dumps([[message.id + 10**17, format_timestamp(message.timestamp), message.author, message.content] for message in fake_history(amount)])
+
+    legacy_size, legacy_seconds, _ = measure(lambda: [[LegacyMessage(*message) for message in json.loads(serialized)] for _ in range(channels)])
+    store_size , store_seconds , stores = measure(lambda: [MessageStore.from_lists(json.loads(serialized)) for _ in range(channels)])
+    assert stores[0].to_lists() == json.loads(serialized)
+
+    total: int = amount * channels
+    print(f"messages    : {amount} x {channels} channels")
+    print(f"dataclasses : {legacy_size / 2**20:.1f} MiB ({legacy_size / total:.0f} bytes/message), loaded in {legacy_seconds:.2f}s")
+    print(f"MessageStore: {store_size / 2**20:.1f} MiB ({store_size / total:.0f} bytes/message), loaded in {store_seconds:.2f}s")
+    print(f"saved       : {1 - store_size / legacy_size:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--channels", type=int, default=20)
+    arguments = parser.parse_args()
+    main(arguments.messages, arguments.channels)
@@ -0,0 +1,61 @@
+'''
+Replays a channel history through the short-term memory window the same way ComplexMemory.add_messages 
+and prompt_crafter do, with and without the per-message token cache.
+
+Run from the repository root:
+    python -m benchmark.bench_prompt [--messages 20000]
+'''
+import asyncio, argparse, random, time
+from datetime import datetime, timedelta
+
+from structure import Message
+from prompt import DefaultTextModel
+
+
+STM_LIMIT  = 1500
+PROMPT_STM = 1400
+
+
+def fake_history(amount: int) -> list[Message]:
+    words: list[str] = ["lol", "ok", "yeah", "what", "no way", "did you see that", "tomorrow?", ":)", "sure", "haha"]
+    time: datetime = datetime(2021, 1, 1)
+    messages: list[Message] = []
+    for i in range(amount):
+        content: str = ' '.join(random.choice(words) for _ in range(random.randint(1, 12)))
+        messages.append(Message(i, str(time), "Bob" if random.random() > 0.5 else "Mike", content))
+        time += timedelta(minutes=random.random()*10)
+    return messages
+
+
+async def replay(history: list[Message], cached: bool) -> float:
+    stm: list[Message] = []
+    shared: DefaultTextModel = DefaultTextModel()
+    start: float = time.perf_counter()
+    for message in history:
+        model: DefaultTextModel = shared if cached else DefaultTextModel()
+        stm.append(message)
+        # Skim of excess STM
+        conversation = await model.conversation_crafter_newest_to_oldest(stm, STM_LIMIT)
+        removed: list[Message] = stm[:len(stm) - len(conversation.messages)]
+        model.forget_messages(removed)
+        stm = stm[len(removed):]
+        # Reply
+        model = shared if cached else DefaultTextModel()
+        await model.conversation_crafter_newest_to_oldest(stm, PROMPT_STM)
+    return time.perf_counter() - start
+
+
+async def main(amount: int) -> None:
+    history: list[Message] = fake_history(amount)
+    cached  : float = await replay(history, True)
+    uncached: float = await replay(history, False)
+    print(f"messages : {amount}")
+    print(f"cached   : {cached:.2f}s ({cached / amount * 1e6:.0f} us/message)")
+    print(f"uncached : {uncached:.2f}s ({uncached / amount * 1e6:.0f} us/message)")
+    print(f"speedup  : {uncached / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    asyncio.run(main(parser.parse_args().messages))
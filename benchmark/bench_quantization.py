@@ -0,0 +1,49 @@
+'''
+Memory and recall of the quantized storage modes of the local vector store.
+With a re-rank factor of 1 only the first pass decides which rows are returned, higher factors re-rank
+that many times more candidates with the float32 vectors from disk.
+
+    python -m benchmark.bench_quantization [--rows 20000] [--queries 200] [--rerank 1 4]
+'''
+import asyncio, argparse, tempfile, time
+import numpy as np
+
+from local_vector_database import LocalVectorStore, Quantization
+from vector_database import _DIM
+from benchmark.bench_local_vector_database import CHANNEL, clustered_vectors, exact_neighbours, fill
+
+
+async def run(rows: int, queries_amount: int, limit: int, clusters: int, reranks: list[int]) -> None:
+    vectors: np.ndarray = clustered_vectors(rows, _DIM, clusters)
+    queries: np.ndarray = clustered_vectors(queries_amount, _DIM, clusters, seed=1)
+    truth  : list[set[int]] = exact_neighbours(vectors, queries, limit)
+    print(f"rows: {rows}, dim: {_DIM}, queries: {queries_amount}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for quantization in Quantization:
+            for rerank in (reranks if quantization != Quantization.NONE else [1]):
+                store = LocalVectorStore(f"{directory}/{quantization.value}_{rerank}", quantization=quantization, rerank=rerank, index_min_rows=rows + 1)
+                await fill(store, vectors)
+                await store.search_hits(CHANNEL, [queries[0].tolist()], limit=limit)
+
+                latencies: list[float] = []
+                recall: float = 0
+                for query, expected in zip(queries, truth):
+                    start: float = time.perf_counter()
+                    hits = (await store.search_hits(CHANNEL, [query.tolist()], limit=limit)).unwrap()[0]
+                    latencies.append(time.perf_counter() - start)
+                    recall += len(set(hit.message.id for hit in hits) & expected) / limit
+                print(f"{quantization.value:<8} re-rank x{rerank:<3} resident: {store.resident_bytes() / 2**20:7.1f} MiB   "
+                      f"recall@{limit}: {recall / len(queries):.3f}   p50: {np.percentile(latencies, 50) * 1000:6.2f} ms")
+                await store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 4])
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.rows, arguments.queries, arguments.limit, arguments.clusters, arguments.rerank))
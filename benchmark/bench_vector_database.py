@@ -0,0 +1,138 @@
+'''
+Search latency of MilvusConnection with partitions kept loaded (PartitionResidency) vs loading and releasing
+the collection around every search, as was done before.
+
+Uses an in-process stand-in for the Milvus collection by default, where loading a partition costs time per row:
+    python -m benchmark.bench_vector_database [--channels 50] [--searches 2000]
+With a local Milvus running on localhost:19530:
+    python -m benchmark.bench_vector_database --milvus
+'''
+import asyncio, argparse, random, time
+
+import vector_database
+from vector_database import MilvusConnection, ConnectionInfo, CollectionType, _DIM
+from structure import Message, DatabaseEntry
+
+
+LOAD_SECONDS_PER_ROW = 0.000002
+LOAD_SECONDS_BASE    = 0.02
+SEARCH_SECONDS       = 0.002
+
+
+class FakePartition:
+    def __init__(self, collection: 'FakeCollection', name: str) -> None:
+        self.collection = collection
+        self.name = name
+
+    @property
+    def num_entities(self) -> int:
+        return self.collection.rows.get(self.name, 0)
+
+    def load(self) -> None:
+        time.sleep(LOAD_SECONDS_BASE + LOAD_SECONDS_PER_ROW * self.num_entities)
+        self.collection.loaded.add(self.name)
+
+    def release(self) -> None:
+        self.collection.loaded.discard(self.name)
+
+
+class FakeCollection:
+    def __init__(self, rows: dict[str, int]) -> None:
+        self.rows = rows
+        self.loaded: set[str] = set()
+
+    def partition(self, name: str) -> FakePartition:
+        return FakePartition(self, name)
+
+    def load(self, partition_names: list[str]) -> None:
+        for name in partition_names: self.partition(name).load()
+
+    def release(self) -> None:
+        self.loaded.clear()
+
+    def search(self, partition_names: list[str], **kwargs) -> list:
+        assert all(name in self.loaded for name in partition_names)
+        time.sleep(SEARCH_SECONDS)
+        return [[]]
+
+
+def connection_info() -> ConnectionInfo:
+    return ConnectionInfo("localhost", 19530, "fake", _DIM, 5, 40, 2500, 1000)
+
+
+def zipf_channels(channels: int, searches: int) -> list[int]:
+    '''A few channels are hot, most are rarely talked in'''
+    weights: list[float] = [1 / (rank + 1) for rank in range(channels)]
+    return random.choices(range(1, channels + 1), weights, k=searches)
+
+
+async def run_fake(channels: int, searches: int, budget_rows: int) -> None:
+    rows: dict[str, int] = {MilvusConnection.get_partion_name(channel): random.randint(1000, 20000) for channel in range(1, channels + 1)}
+    order: list[int] = zipf_channels(channels, searches)
+
+    # Previous behaviour: load, search, release everything
+    collection = FakeCollection(rows)
+    start: float = time.perf_counter()
+    for channel in order:
+        name: str = MilvusConnection.get_partion_name(channel)
+        collection.load([name])
+        collection.search(partition_names=[name])
+        collection.release()
+    previous: float = time.perf_counter() - start
+
+    # Partition residency
+    collection = FakeCollection(rows)
+    connection = MilvusConnection(collection, connection_info(), memory_budget=budget_rows * (_DIM * 4 + vector_database._ROW_SCALAR_BYTES))  # type: ignore
+    start = time.perf_counter()
+    for channel in order:
+        await connection.search(channel, [[0.0] * _DIM])
+    resident: float = time.perf_counter() - start
+
+    stats = connection.residency.stats
+    print(f"channels : {channels}, searches: {searches}, budget: {budget_rows} rows")
+    print(f"load + release per search : {previous / searches * 1000:.2f} ms/search")
+    print(f"partition residency       : {resident / searches * 1000:.2f} ms/search")
+    print(f"hits: {stats.hits}, loads: {stats.loads}, evictions: {stats.evictions}, load time: {stats.load_seconds:.2f}s")
+
+
+async def run_milvus(channels: int, searches: int) -> None:
+    await vector_database.connect_to_database()
+    await vector_database.DROP_ALL_MEMORY(CollectionType.TESTING)
+    connection: MilvusConnection = await vector_database.create_connection_to_collection(CollectionType.TESTING)
+    for channel in range(1, channels + 1):
+        await connection.create_channel_memory_if_new(channel)
+        entries = [DatabaseEntry(Message(channel * 100000 + i, "2021-01-01 00:00:00.000000", "Bob", "Hello"), [random.random() * 2 - 1 for _ in range(_DIM)]) for i in range(500)]
+        await connection.add_entries(channel, entries)
+    await connection.create_index()
+
+    order: list[int] = zipf_channels(channels, searches)
+    collection = connection._collection
+    start: float = time.perf_counter()
+    for channel in order:
+        name: str = MilvusConnection.get_partion_name(channel)
+        collection.load([name])
+        collection.search(data=[[0.0] * _DIM], anns_field="embedding", param={"metric_type": "L2", "params": {"nprobe": 10}}, limit=10, partition_names=[name])
+        collection.release()
+    previous: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for channel in order:
+        await connection.search(channel, [[0.0] * _DIM])
+    resident: float = time.perf_counter() - start
+
+    print(f"load + release per search : {previous / searches * 1000:.2f} ms/search")
+    print(f"partition residency       : {resident / searches * 1000:.2f} ms/search")
+    print(connection.residency.stats)
+    await vector_database.DROP_ALL_MEMORY(CollectionType.TESTING)
+    await vector_database.disconnect_from_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--searches", type=int, default=2000)
+    parser.add_argument("--budget-rows", type=int, default=200000)
+    parser.add_argument("--milvus", action="store_true")
+    arguments = parser.parse_args()
+    if arguments.milvus: asyncio.run(run_milvus(arguments.channels, arguments.searches))
+    else               : asyncio.run(run_fake(arguments.channels, arguments.searches, arguments.budget_rows))
@@ -8,6 +8,13 @@ LOG: LogHanglerInterface = None     #type: ignore
 
 bot: commands.Bot = None    # type: ignore
 STATUS = 0
+STATUS_CHANGED: asyncio.Event = asyncio.Event()
+
+
+def _set_status(status: int) -> None:
+    global STATUS
+    STATUS = status
+    STATUS_CHANGED.set()
 
 async def reload():
     if STATUS != 1: return
@@ -17,13 +24,12 @@ async def reload():
 
 
 async def _start():
-    global STATUS
     with open("private.json") as file:
         try: 
             await bot.start(json.load(file)["token"])
         except:
             if STATUS != 1: LOG.log(LogType.ERROR, "Failed to connect to discord account. Check that your token is up-to-date.")
-            STATUS = -1
+            _set_status(-1)
 
 
 async def start(log: LogHanglerInterface=LogNothing()):
@@ -33,15 +39,14 @@ async def start(log: LogHanglerInterface=LogNothing()):
     
     @bot.event
     async def on_ready():
-        global STATUS
-        STATUS = 1
+        _set_status(1)
         await bot.load_extension("cog")       # type:ignore
         LOG.log(LogType.OK, f"LOGGED IN TO ACCOUNT:\nuser: {bot.user.name}\nid  : {bot.user.id}")     #type:ignore
 
     # Start bot
+    STATUS_CHANGED.clear()
     asyncio.create_task(_start())
-    while STATUS == 0:
-        await asyncio.sleep(0.5)
+    await STATUS_CHANGED.wait()
     if STATUS == -1: raise Exception("Failed to connect to discord account. Check that your token is up-to-date.")
 
 
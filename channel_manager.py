@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from conversation import ComplexMemoryConversation
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+CONVERSATION_CAPACITY     : int = 64               # Conversations kept loaded at most
+CONVERSATION_MEMORY_BUDGET: int = 256 * 2**20      # Bytes of loaded messages kept at most, across all conversations
+
+
+@dataclass
+class ChannelManagerStats:
+    hits         : int = 0
+    loads        : int = 0
+    reactivations: int = 0      # Loads of channels which were evicted before
+    evictions    : int = 0
+    unloads      : int = 0      # Archives of idle conversations unloaded to stay within the memory budget
+
+
+
+class ChannelManager:
+    '''
+    Conversations of the channels talked in recently, least recently used first.
+    Once there are more than max_channels of them, or their loaded messages take more than memory_budget bytes,
+    the least recently used idle conversations are dropped. Their memory is already on disk, and evicted channels
+    are remembered so they can be reactivated without catching up on the channel's history.
+    The budget is checked again whenever a conversation loads messages on demand (its archive), and messages
+    loaded on demand by idle conversations are unloaded before any conversation is dropped.
+    '''
+    max_channels : int
+    memory_budget: int
+    stats        : ChannelManagerStats
+
+    def __init__(self, max_channels: int=CONVERSATION_CAPACITY, memory_budget: int=CONVERSATION_MEMORY_BUDGET, keep: Callable[[int], bool]=lambda _: False) -> None:
+        if max_channels <= 0:
+            raise ValueError("Capacity cannot be less than 1")
+        self.max_channels = max_channels
+        self.memory_budget = memory_budget
+        self.keep = keep    # Channels which mustn't be evicted at the moment, besides the busy ones
+        self.stats = ChannelManagerStats()
+        self._conversations: OrderedDict[int, ComplexMemoryConversation] = OrderedDict()
+        self._evicted: set[int] = set()
+
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self._conversations
+
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+
+    def get(self, channel_id: int) -> ComplexMemoryConversation | None:
+        conversation: ComplexMemoryConversation | None = self._conversations.get(channel_id)
+        if conversation is None: return None
+        self._conversations.move_to_end(channel_id)
+        self.stats.hits += 1
+        return conversation
+
+
+    def was_evicted(self, channel_id: int) -> bool:
+        return channel_id in self._evicted
+
+
+    def put(self, channel_id: int, conversation: ComplexMemoryConversation, log: LogHanglerInterface=LogNothing()) -> None:
+        conversation.memory.on_load = lambda: self._evict(log=log)
+        self._conversations[channel_id] = conversation
+        self._conversations.move_to_end(channel_id)
+        self.stats.loads += 1
+        if channel_id in self._evicted:
+            self._evicted.discard(channel_id)
+            self.stats.reactivations += 1
+        self._evict(log=log)
+
+
+    def remove(self, channel_id: int) -> None:
+        conversation: ComplexMemoryConversation | None = self._conversations.pop(channel_id, None)
+        if conversation is not None: conversation.memory.on_load = lambda: None
+        self._evicted.discard(channel_id)
+
+
+    def resident_bytes(self) -> int:
+        return sum(conversation.memory.resident_bytes() for conversation in self._conversations.values())
+
+
+    def _is_idle(self, channel_id: int, conversation: ComplexMemoryConversation) -> bool:
+        return (not conversation.is_processing and not conversation.is_saving_message
+                and not len(conversation.unread_message_queue) and not self.keep(channel_id))
+
+
+    def _evict(self, log: LogHanglerInterface=LogNothing()) -> None:
+        if not len(self._conversations): return
+        resident: int = self.resident_bytes()
+        for channel_id, conversation in self._conversations.items():
+            if resident <= self.memory_budget: break
+            if not self._is_idle(channel_id, conversation): continue
+            released: int = conversation.memory.unload()
+            if not released: continue
+            resident -= released
+            self.stats.unloads += 1
+            log.log(LogType.INFO, f"Unloaded archive of idle conversation - {channel_id}\nloaded: {len(self._conversations)}, {resident / 2**20:.1f} MiB")
+
+        newest: int = next(reversed(self._conversations))
+        for channel_id, conversation in list(self._conversations.items()):
+            if len(self._conversations) <= self.max_channels and resident <= self.memory_budget: break
+            if channel_id == newest or not self._is_idle(channel_id, conversation): continue
+            resident -= conversation.memory.resident_bytes()
+            conversation.memory.on_load = lambda: None
+            del self._conversations[channel_id]
+            self._evicted.add(channel_id)
+            self.stats.evictions += 1
+            log.log(LogType.INFO, f"Unloaded idle conversation - {channel_id}\nloaded: {len(self._conversations)}, {resident / 2**20:.1f} MiB")
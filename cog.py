@@ -1,12 +1,15 @@
-import discord, json, datetime, asyncio, traceback, re
+import discord, json, datetime, asyncio, traceback, re, os
 from discord import Message as DiscordMessage
 from discord.ext import commands
 
 import configuration, ai
 from interface import ConversationInterface
-from structure import Message, channelConfiguration
+from structure import Message, channelConfiguration, parse_timestamp
 from conversation import ComplexMemoryConversation
 from memory import ComplexMemory
+from channel_manager import ChannelManager
+from scheduler import ChannelActor
+from backfill import HistoryBackfill, parse_discord_message
 from delay import NaturalDelay
 from vector_database import CollectionType
 from debug import LogType, LogJsonFile, LogHanglerInterface
@@ -18,9 +21,9 @@ class MainCog(commands.Cog):
         self.bot = bot
         self.id = id
         self.extra_info = False
-        self.conversations: dict[str, ConversationInterface] = {}
-        self.locks: dict[str, bool] = {}
-        self.messages: dict[str, list[DiscordMessage]] = {}
+        self.conversations = ChannelManager(keep=lambda channel_id: str(channel_id) in self.backfills or self.is_actor_busy(channel_id))
+        self.actors: dict[int, ChannelActor[DiscordMessage]] = {}
+        self.backfills: dict[str, asyncio.Task] = {}
         self.log = log
         self.writing_seconds_per_char = 18/84 / 5
 
@@ -70,11 +73,7 @@ class MainCog(commands.Cog):
 
         messages = [message async for message in channel.history(limit=limit, oldest_first=False)]
         messages.reverse()
-        parsed_messages = [ Message(
-            message.id, 
-            str(message.created_at), 
-            message.author.name if str(message.author.discriminator) == '0' else f"{message.author.name}#{message.author.discriminator}", 
-            message.content) for message in messages ]
+        parsed_messages = [parse_discord_message(message) for message in messages]
 
         return parsed_messages
 
@@ -83,8 +82,7 @@ class MainCog(commands.Cog):
         channel = bot.get_channel(int(channel_id))
 
         if type(date) != datetime.datetime:
-            if len(date) == 19: date += ".000000"
-            date = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')
+            date = datetime.datetime.fromtimestamp(parse_timestamp(date) / 1_000_000, datetime.timezone.utc)
 
         messages = [message async for message in channel.history(limit=limit, around=date, oldest_first=True)]
 
@@ -101,118 +99,147 @@ class MainCog(commands.Cog):
         if left > right: messages = messages[ diff:]
         else           : messages = messages[:-diff]
 
-        parsed_messages = [ Message(
-            message.id, 
-            str(message.created_at), 
-            message.author.name if str(message.author.discriminator) == '0' else f"{message.author.name}#{message.author.discriminator}", 
-            message.content) for message in messages ]
+        parsed_messages = [parse_discord_message(message) for message in messages]
 
         return parsed_messages
 
+
+    def is_actor_busy(self, channel_id: int) -> bool:
+        actor = self.actors.get(channel_id)
+        return actor is not None and actor.is_busy()
+
+
+    def start_backfill(self, channel_id: int, memory: ComplexMemory, before_id: int | None) -> None:
+        '''Archives older history into long-term memory in the background, the channel can be answered meanwhile'''
+        if str(channel_id) in self.backfills: return
+        backfill = HistoryBackfill(bot.get_channel(channel_id), memory, before_id)
+        task = asyncio.create_task(backfill.run(log=self.log.sub(str(channel_id))))
+        self.backfills[str(channel_id)] = task
+        task.add_done_callback(lambda _: self.backfills.pop(str(channel_id), None))
+
     
+    def get_actor(self, channel_id: int) -> ChannelActor[DiscordMessage]:
+        actor = self.actors.get(channel_id)
+        if actor is None:
+            actor = ChannelActor(channel_id, lambda messages: self.handle_messages(channel_id, messages), log=self.log.sub(str(channel_id)))
+            self.actors[channel_id] = actor
+        return actor
+
+
     async def send_message(self, discordMessage: DiscordMessage):
-        try:
-            channel_id = int(discordMessage.channel.id)
-
-            if configuration.is_channel_real(channel_id) and configuration.is_blacklist_channel(channel_id):
-                if str(channel_id) in self.conversations:
-                    del self.conversations[str(channel_id)]
-                return
-
-            if not str(channel_id) in self.locks:
-                self.locks[str(channel_id)] = False
-            if not str(channel_id) in self.messages:
-                self.messages[str(channel_id)] = []
+        channel_id = int(discordMessage.channel.id)
+
+        if configuration.is_channel_real(channel_id) and configuration.is_blacklist_channel(channel_id):
+            self.conversations.remove(channel_id)
+            actor = self.actors.pop(channel_id, None)
+            if actor is not None: await actor.close()
+            return
+
+        self.get_actor(channel_id).post(discordMessage)
+
+
+    async def handle_messages(self, channel_id: int, discordMessages: list[DiscordMessage]):
+        '''Handles the messages which arrived in a channel since it was last handled, called by the channel's actor only'''
+        discordMessage = discordMessages[-1]
+
+        if not configuration.is_channel_real(channel_id):
+            self.log.log(LogType.INFO, f"ADDING NEW CHANNEL TO CONFIG - {channel_id}")
+            history = await self.get_history(channel_id)
+
+            for i in range(1, 21):
+                if len(history) < i:
+                    break
+                if history[-i].id == discordMessages[0].id:
+                    self.log.log(LogType.INFO, f"Removed duplicate message history - {channel_id}\nmessages: {[str(message) for message in history[-i:]]}")
+                    history = history[:-i]
+                    break
+
+            with open("outputs/new-channel-added.json", 'w', encoding='utf-8') as file:
+                json.dump([message.object_to_list() for message in history], file, ensure_ascii=False)
+
+            # Only the recent history is added right away, older history is backfilled
+            memory = await ComplexMemory.create(channel_id, 1500, CollectionType.MAIN, log=self.log.sub(str(channel_id)))
+            await memory.clear_long_term_memory()
+            await memory.clear_short_term_memory()
+            if os.path.isfile(HistoryBackfill.get_checkpoint_file_path(channel_id)):
+                os.remove(HistoryBackfill.get_checkpoint_file_path(channel_id))
+            await memory.add_messages(history, log=self.log.sub(str(channel_id)))
+
+            self.conversations.put(channel_id, ComplexMemoryConversation(channel_id, memory, NaturalDelay(), log=self.log.sub(str(channel_id))), log=self.log.sub(str(channel_id)))
+            configuration.add_channel(channel_id, channelConfiguration(discordMessage.author.name))
+            self.start_backfill(channel_id, memory, history[0].id if len(history) else discordMessage.id)
+            self.log.log(LogType.OK, "Succesfully added new channel into configuration!")
+            
+
+        if not channel_id in self.conversations and self.conversations.was_evicted(channel_id):
+            # Every message of the channel since it was unloaded is still to be added, history is up to date
+            self.log.log(LogType.INFO, f"REACTIVATING CHANNEL - {channel_id}")
+            memory = await ComplexMemory.create(channel_id, 1500, CollectionType.MAIN, log=self.log.sub(str(channel_id)))
+            self.conversations.put(channel_id, ComplexMemoryConversation(channel_id, memory, NaturalDelay(), log=self.log.sub(str(channel_id))), log=self.log.sub(str(channel_id)))
+
+        if not channel_id in self.conversations:
+            self.log.log(LogType.INFO, f"ADDING CHANNEL - {channel_id}")
+            history = await self.get_history(channel_id)
+
+            for i in range(1, 21):
+                if len(history) < i:
+                    break
+                if history[-i].id == discordMessages[0].id:
+                    self.log.log(LogType.INFO, f"Removed duplicate message history - {channel_id}\nmessages: {[str(message) for message in history[-i:]]}")
+                    history = history[:-i]
+                    break
+
+            memory = await ComplexMemory.create(channel_id, 1500, CollectionType.MAIN, log=self.log.sub(str(channel_id)))
+            stm = await memory.get_short_term_memory(log=self.log.sub(str(channel_id)))
+
+            if len(stm):
+                for i in range(1, 201):
+                    if len(history) < i:
+                        break
+                    if history[-i].id == stm[-1].id:
+                        history = history[len(history)-i+1:]
+                        self.log.log(LogType.INFO, f"Removed already saved message history - {channel_id}\nnew messages: {[str(message) for message in history]}")
+                        break
+
+            with open("outputs/channel-added.json", 'w', encoding='utf-8') as file:
+                json.dump([message.object_to_list() for message in history], file, ensure_ascii=False)
+
+            await memory.add_messages(history, log=self.log.sub(str(channel_id)))            
+            self.conversations.put(channel_id, ComplexMemoryConversation(channel_id, memory, NaturalDelay(), log=self.log.sub(str(channel_id))), log=self.log.sub(str(channel_id)))
+            if HistoryBackfill.is_unfinished(channel_id):
+                self.start_backfill(channel_id, memory, None)
+            self.log.log(LogType.OK, "Succesfully added channel into bot's conversation list!")
+
+        # Respond
+        async def respond(string: str):
+            # Writing delay
+            # await asyncio.sleep(0.5) 
+            writing_delay: float = self.writing_seconds_per_char*len(string.strip())
+            self.log.log(LogType.INFO, f"Writing... ({writing_delay}) - {discordMessage.channel.id}")
+            async with discordMessage.channel.typing():
+                await asyncio.sleep(writing_delay)                                          # Writing delay
+            await discordMessage.channel.send(string)
+            self.log.log(LogType.OK, f"Responded! - {discordMessage.channel.id}")
             
-            self.messages[str(channel_id)].append(discordMessage)
-
-            if not self.locks[str(channel_id)]:
-                self.locks[str(channel_id)] = True
-
-                if not configuration.is_channel_real(channel_id):
-                    self.log.log(LogType.INFO, f"ADDING NEW CHANNEL TO CONFIG - {channel_id}")
-                    history = await self.get_history(channel_id, limit=20000)
-
-                    for i in range(1, 21):
-                        if len(history) < i:
-                            break
-                        if history[-i].id == self.messages[str(channel_id)][0].id:
-                            self.log.log(LogType.INFO, f"Removed duplicate message history - {channel_id}\nmessages: {[str(message) for message in history[-i:]]}")
-                            history = history[:-i]
-                            break
-
-                    with open("outputs/new-channel-added.json", 'w', encoding='utf-8') as file:
-                        json.dump([message.object_to_list() for message in history], file, ensure_ascii=False)
-
-                    memory = await ComplexMemory.create(channel_id, 1500, CollectionType.MAIN, log=self.log.sub(str(channel_id)))
-                    await memory.clear_long_term_memory()
-                    await memory.clear_short_term_memory()
-                    await memory.add_messages(history, log=self.log.sub(str(channel_id)))
-
-                    self.conversations[str(channel_id)] = ComplexMemoryConversation(channel_id, memory, NaturalDelay(), log=self.log.sub(str(channel_id)))
-                    configuration.add_channel(channel_id, channelConfiguration(discordMessage.author.name))
-                    self.log.log(LogType.OK, "Succesfully added new channel into configuration!")
-                    
-
-                if not str(channel_id) in self.conversations:
-                    self.log.log(LogType.INFO, f"ADDING CHANNEL - {channel_id}")
-                    history = await self.get_history(channel_id)
-
-                    for i in range(1, 21):
-                        if len(history) < i:
-                            break
-                        if history[-i].id == self.messages[str(channel_id)][0].id:
-                            self.log.log(LogType.INFO, f"Removed duplicate message history - {channel_id}\nmessages: {[str(message) for message in history[-i:]]}")
-                            history = history[:-i]
-                            break
-
-                    memory = await ComplexMemory.create(channel_id, 1500, CollectionType.MAIN, log=self.log.sub(str(channel_id)))
-                    stm = await memory.get_short_term_memory(log=self.log.sub(str(channel_id)))
-
-                    if len(stm):
-                        for i in range(1, 201):
-                            if len(history) < i:
-                                break
-                            if history[-i].id == stm[-1].id:
-                                history = history[len(history)-i+1:]
-                                self.log.log(LogType.INFO, f"Removed already saved message history - {channel_id}\nnew messages: {[str(message) for message in history]}")
-                                break
-
-                    with open("outputs/channel-added.json", 'w', encoding='utf-8') as file:
-                        json.dump([message.object_to_list() for message in history], file, ensure_ascii=False)
-
-                    await memory.add_messages(history, log=self.log.sub(str(channel_id)))            
-                    self.conversations[str(channel_id)] = ComplexMemoryConversation(channel_id, memory, NaturalDelay(), log=self.log.sub(str(channel_id)))
-                    self.log.log(LogType.OK, "Succesfully added channel into bot's conversation list!")
-
-                # Respond
-                async def respond(string: str):
-                    # Writing delay
-                    # await asyncio.sleep(0.5) 
-                    writing_delay: float = self.writing_seconds_per_char*len(string.strip())
-                    self.log.log(LogType.INFO, f"Writing... ({writing_delay}) - {discordMessage.channel.id}")
-                    async with discordMessage.channel.typing():
-                        await asyncio.sleep(writing_delay)                                          # Writing delay
-                    await discordMessage.channel.send(string)
-                    self.log.log(LogType.OK, f"Responded! - {discordMessage.channel.id}")
-                    
-                    create_json_file_if_not_exist(f"bot responses/{discordMessage.channel.id}.json", [])
-                    with open(f"bot responses/{discordMessage.channel.id}.json", encoding='utf-8') as r_file:
-                        data = json.load(r_file)
-                        data.append(string)
-                    with open(f"bot responses/{discordMessage.channel.id}.json", 'w', encoding='utf-8') as w_file:
-                        json.dump(data, w_file, ensure_ascii=False)
-
-                for message in self.messages[str(channel_id)]:
-                    authorId = message.author.id
-                    message = Message(message.id, str(message.created_at), message.author.name, message.content)
-                    asyncio.create_task(self.conversations[str(channel_id)].add_message(message, self.id == authorId, log=self.log.sub(str(channel_id))))
-                self.messages[str(channel_id)].clear()
-                asyncio.create_task(self.conversations[str(channel_id)].communicate(respond, log=self.log.sub(str(channel_id))))
-                
-                self.locks[str(channel_id)] = False
-        except Exception as e:
-            self.log.log(LogType.ERROR, f"{str(e)}\n{traceback.format_exc()}")
+            create_json_file_if_not_exist(f"bot responses/{discordMessage.channel.id}.json", [])
+            with open(f"bot responses/{discordMessage.channel.id}.json", encoding='utf-8') as r_file:
+                data = json.load(r_file)
+                data.append(string)
+            with open(f"bot responses/{discordMessage.channel.id}.json", 'w', encoding='utf-8') as w_file:
+                json.dump(data, w_file, ensure_ascii=False)
+
+        conversation = self.conversations.get(channel_id)
+        for message in discordMessages:
+            conversation.queue_message(Message(message.id, str(message.created_at), message.author.name, message.content),     # type: ignore
+                                       self.id == message.author.id, log=self.log.sub(str(channel_id)))
+        # Saving to memory runs in the background, the next messages and the response don't wait for it
+        actor = self.actors.get(channel_id)
+        if actor is None:
+            await conversation.save_messages(log=self.log.sub(str(channel_id)))     # type: ignore
+            return
+        actor.start_task(conversation.save_messages(log=self.log.sub(str(channel_id))))     # type: ignore
+        if not conversation.is_processing:     # type: ignore
+            actor.start_task(conversation.communicate(respond, log=self.log.sub(str(channel_id))))     # type: ignore
 
 
     @commands.Cog.listener()
@@ -0,0 +1,83 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, Awaitable
+
+from interface import MemoryInterface
+from structure import Message
+from utility import LRUCache
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+# Fetches up to limit messages around the given one from the channel, oldest first
+HistorySource = Callable[[int, Message, int], Awaitable[list[Message]]]
+
+
+@dataclass
+class ContextStats:
+    local  : int = 0    # Windows served from the channel's own memory
+    cached : int = 0    # Windows served from previously fetched windows
+    fetched: int = 0    # Windows fetched from the history source
+    failed : int = 0
+
+
+
+class ContextStore:
+    '''
+    Serves "messages around X" for long-term memory hits.
+    Windows come from the channel's memory when the message is stored there, otherwise from a cache of
+    previously fetched windows, and only as a last resort from the history source (Discord).
+    Fetches run concurrently, capped at max_concurrency, and identical fetches in flight are shared.
+    '''
+    history_source : HistorySource
+    window         : int
+    max_concurrency: int
+    stats          : ContextStats
+
+    def __init__(self, history_source: HistorySource, window: int=20, capacity: int=512, max_concurrency: int=3) -> None:
+        self.history_source = history_source
+        self.window = window
+        self.max_concurrency = max_concurrency
+        self.stats = ContextStats()
+        self._windows: LRUCache[tuple[int, int], list[Message]] = LRUCache(capacity)
+        self._in_flight: dict[tuple[int, int], asyncio.Task] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+
+
+    async def _fetch(self, channel_id: int, message: Message) -> list[Message]:
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            messages: list[Message] = await self.history_source(channel_id, message, self.window)
+        self._windows.put((channel_id, message.id), messages)
+        self.stats.fetched += 1
+        return messages
+
+
+    async def get_messages_around(self, memory: MemoryInterface, message: Message, log: LogHanglerInterface=LogNothing()) -> list[Message]:
+        messages: list[Message] = await memory.get_messages_around(message.id, self.window, log=log.sub())
+        if len(messages):
+            self.stats.local += 1
+            return messages
+
+        key: tuple[int, int] = (memory.channel_id, message.id)
+        cached: list[Message] | None = self._windows.get(key)
+        if cached is not None:
+            self.stats.cached += 1
+            return cached
+
+        if key not in self._in_flight:
+            task: asyncio.Task = asyncio.create_task(self._fetch(memory.channel_id, message))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        try:
+            return await asyncio.shield(self._in_flight[key])
+        except Exception as e:
+            self.stats.failed += 1
+            log.log(LogType.WARNING, f"Failed to get messages around {message.id}, using the message alone\nerror: {e}")
+            return [message]
+
+
+    async def expand(self, memory: MemoryInterface, messages: list[Message], log: LogHanglerInterface=LogNothing()) -> list[list[Message]]:
+        '''The window around each of the given messages, in the same order'''
+        windows: list[list[Message]] = await asyncio.gather(*[self.get_messages_around(memory, message, log=log) for message in messages])
+        log.log(LogType.DEBUG, f"Context windows\nrequested: {len(messages)}\nstats    : {self.stats}")
+        return windows
@@ -1,22 +1,67 @@
 # External modules
-import asyncio, threading, multiprocessing, re, json
+import asyncio, threading, multiprocessing, re, json, hashlib, time
 from typing import Callable, Any
+from dataclasses import dataclass
 from colorama import Fore
 
 # Internal modules
 import prompt, ai, bot
 from interface import ConversationInterface, MemoryInterface, DelayInterface
-from structure import Message
-from utility import Result, CustomThread
+from structure import Message, SearchHit
+from context import ContextStore
+from retrieval import HybridRetriever, RetrievalGate
+from scheduler import SCHEDULER
+from utility import Result, CustomThread, TTLCache, LRUCache
 from debug import LogHanglerInterface, LogNothing, LogType
 
 
-async def get_messages_around_MAGIC(channel_id: int, message: Message) -> list[Message]:
+def create_search_queries(messages: list[Message], window: int=1, max_queries: int=8) -> list[str]:
+    '''
+    Texts to search long-term memory with: sliding windows over the newest messages, 
+    plus all of them joined when there is more than one window.
+    '''
+    contents: list[str] = [message.content.strip() for message in messages if message.content.strip() != ""]
+    queries: list[str] = ['\n'.join(contents[i:i+window]) for i in range(max(len(contents) - window + 1, 0))]
+    if len(queries) > 1: queries.append('\n'.join(contents))
+    return queries[-max_queries:]
+
+
+def clean_response_line(line: str, username: str) -> str:
+    '''Strips dates, times, tags and the bot's own name which the model sometimes copies from the prompt'''
+    line = line.strip()
+    line = re.sub(r'\d{4}-\d{2}-\d{2}|\d{2}:\d{2}:\d{2}', '', line)
+    line = re.sub(r'\(\s*\)', '', line)
+    line = re.sub(r'\w+#\d+', '', line)
+    line = re.sub(username, '', line, flags=re.IGNORECASE)
+    line = line.replace(":", '')
+    return line.strip()
+
+
+async def get_messages_around_MAGIC(channel_id: int, message: Message, limit: int=20) -> list[Message]:
     if bot.STATUS == 1:
-        return await bot.get_history_around(channel_id, message.date)
+        return await bot.get_history_around(channel_id, message.created_at, limit)
     return [message]
 
 
+@dataclass
+class GenerationStats:
+    used     : int = 0      # Responses sent
+    wasted   : int = 0      # Responses generated, then thrown away as new messages arrived
+    cancelled: int = 0      # Generations cancelled while in flight as new messages arrived
+    cached   : int = 0      # Responses replayed from the session cache instead of generated again
+
+
+GENERATION_STATS: GenerationStats = GenerationStats()     # Across every conversation
+
+RESPONSE_CACHE_CAPACITY: int = 16       # Responses and searches cached during a communicate session
+RESPONSE_CACHE_TTL     : float = 120    # In seconds
+
+LTM_CONTEXT_WINDOWS: int = 3        # Long-term memory hits expanded with the messages around them and put into the prompt
+CONTEXT_STORE: ContextStore = ContextStore(get_messages_around_MAGIC)
+RETRIEVER    : HybridRetriever = HybridRetriever(LTM_CONTEXT_WINDOWS)
+RETRIEVAL_GATE: RetrievalGate = RetrievalGate(ai.get_cached_embeddings, lambda strings : ai.embed_strings(strings))
+
+
 
 class ComplexMemoryConversation(ConversationInterface):
     memory: MemoryInterface
@@ -24,10 +69,25 @@ class ComplexMemoryConversation(ConversationInterface):
 
     reading_seconds_per_char: float = 18/377   # In seconds
     writing_seconds_per_char: float = 18/84    # In seconds
+    speculative: bool = True                   # Draft the response during the delays instead of after them
+    streaming  : bool = True                   # Deliver the response line by line as it's generated
 
     def __init__(self, channel_id: int, memory: MemoryInterface, delay: DelayInterface, log: LogHanglerInterface=LogNothing()) -> None:
         self.memory = memory
         self.delay = delay
+        self.generation_stats = GenerationStats()
+        self._draft     : asyncio.Task | None = None     # Response being drafted to the unread messages
+        self._draft_lines: asyncio.Queue[str | None] = asyncio.Queue()
+        self._draft_answered: list[Message] = []        # The unread messages the draft responds to
+        self._generating: asyncio.Task | None = None     # The draft, while its response is being generated
+        self._generated : asyncio.Task | None = None     # The draft, once its response is generated (not replayed nor failed)
+        self._log: LogHanglerInterface = log
+        self._saving: bool = False      # A save_messages call is running
+        # Keyed by state_version and the content of the request, so any change to the unread messages or memory misses
+        self.response_cache: TTLCache[tuple, Any] = TTLCache(RESPONSE_CACHE_CAPACITY, RESPONSE_CACHE_TTL)
+        self.state_version: int = 0     # Incremented whenever a message is added
+        # Crafts the long-term memory windows, their token counts are kept apart from short-term memory's
+        self.ltm_text_model: prompt.DefaultTextModel = prompt.DefaultTextModel(LRUCache(prompt.LTM_TOKEN_CACHE_CAPACITY))
         super().__init__(channel_id)
 
 
@@ -36,67 +96,133 @@ class ComplexMemoryConversation(ConversationInterface):
 
     
     async def add_message(self, message: Message, reset_unread_queue: int, log: LogHanglerInterface=LogNothing()) -> None:
+        self.queue_message(message, reset_unread_queue, log=log)
+        await self.save_messages(log=log)
+
+
+    def queue_message(self, message: Message, reset_unread_queue: int, log: LogHanglerInterface=LogNothing()) -> None:
+        '''Adds the message to the unread messages right away, it's saved to memory by save_messages'''
         log.log(LogType.DEBUG, "Unread message queue before:\n[{}]".format('\n'.join([str(message) for message in self.unread_message_queue])))
         
         # Add or clean unread message queue
         if reset_unread_queue: self.unread_message_queue = []
         else                 : self.unread_message_queue.append(message)
+        self.message_arrived.set()
+        self.state_version += 1
 
         self.unsaved_message_queue.append(message)
-        if not self.is_saving_message:
-            self.is_saving_message = True
+        self.is_saving_message = True
+        self.messages_saved.clear()
+        # The draft of the response doesn't answer this message, the next one waits for it to be saved
+        if self._draft is not None: self._redraft(self._log)
+        log.log(LogType.DEBUG, "Unread message queue after:\n[{}]".format('\n'.join([str(message) for message in self.unread_message_queue])))
+
+
+    async def save_messages(self, log: LogHanglerInterface=LogNothing()) -> None:
+        '''Saves the queued messages to memory. If they're already being saved, that save picks them up instead'''
+        if self._saving: return
+        self._saving = True
+        try:
             while len(self.unsaved_message_queue) != 0:
                 unsaved_messages = self.unsaved_message_queue.copy()
                 self.unsaved_message_queue.clear()
                 await self.memory.add_messages(unsaved_messages, log=log.sub())
-                log.log(LogType.INFO, f"Added message(s) to memory!\nmessage: {str(message)}")
+                log.log(LogType.INFO, f"Added message(s) to memory!\nmessages: {len(unsaved_messages)}")
+        finally:
+            self._saving = False
             self.is_saving_message = False
-        log.log(LogType.DEBUG, "Unread message queue after:\n[{}]".format('\n'.join([str(message) for message in self.unread_message_queue])))
-
-
-    async def communicate(self, callback=Callable[[str], Any], log: LogHanglerInterface=LogNothing()):
-        log.log(LogType.INFO, "Communicating...")
-        response: str = "Hello, World!\nHow are you today, cus I feel good!\n\n\nEverything just written was a test message."
-        if not self.is_processing and len(self.unread_message_queue) != 0:
-            self.is_processing = True 
-            reading_attempts : int = 0
-            response_attempts: int = 0
-            ltm_task = asyncio.create_task(self.memory.search_long_term_memory('\n'.join([message.content for message in self.unread_message_queue]), log.sub()))
-            ltm_task_tried = False
-
-            # Sleeping delay
-            delay: float = self.delay.ping()
-            log.log(LogType.INFO, f"Sleeping... ({delay})")
-            if delay > 0: await asyncio.sleep(delay)                                        # Bot start computing delay
-
-            while len(self.unread_message_queue) != 0 and reading_attempts < 5 and response_attempts < 3:
-                current_amount_of_unread_messages: int = len(self.unread_message_queue)
-
-                if ltm_task_tried:
-                    ltm_task = asyncio.create_task(self.memory.search_long_term_memory('\n'.join([message.content for message in self.unread_message_queue]), log.sub()))
-                ltm_task_tried = True
-
-                # Wait for all messages to be in memory
-                while self.is_saving_message:
-                    await asyncio.sleep(0.1)
-
-                # Reading delay
-                reading_delay: float = self.reading_seconds_per_char*sum([len(message.content.strip()) for message in self.unread_message_queue])
-                log.log(LogType.INFO, f"Reading... ({reading_delay})")
-                await asyncio.sleep(reading_delay)                                          # Readig delay
-                reading_attempts += 1
-                if len(self.unread_message_queue) == 0: break
-
-                # Redo if message amount has changed
-                if current_amount_of_unread_messages != len(self.unread_message_queue):
-                    log.log(LogType.INFO, "New message(s) added. Rereading...") 
-                    continue
-
-                # Response
-                log.log(LogType.INFO, "Generating response...")
-
-                #? RESPONSE --------------------------------------------------------------------------------------------
-
+            self.messages_saved.set()
+
+
+    def _reading_delay(self) -> float:
+        return self.reading_seconds_per_char*sum([len(message.content.strip()) for message in self.unread_message_queue])
+
+
+    async def _read(self, log: LogHanglerInterface=LogNothing()) -> None:
+        '''
+        Waits for the reading delay of the unread messages. A message arriving meanwhile extends the deadline 
+        by its own reading time instead of starting the whole delay over.
+        '''
+        loop = asyncio.get_running_loop()
+        start: float = loop.time()
+        log.log(LogType.INFO, f"Reading... ({self._reading_delay()})")
+        while len(self.unread_message_queue) != 0:
+            self.message_arrived.clear()
+            remaining: float = start + self._reading_delay() - loop.time()
+            if remaining <= 0: return
+            try:
+                await asyncio.wait_for(self.message_arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+            log.log(LogType.INFO, f"New message(s) added. Reading... ({start + self._reading_delay() - loop.time()})")
+
+
+    def _discard_draft(self) -> None:
+        '''Throws away the current draft, cancelling it if it's still in flight'''
+        draft: asyncio.Task | None = self._draft
+        if draft is not None:
+            if self._generating is draft: self._record(cancelled=1)
+            elif self._generated is draft: self._record(wasted=1)
+            draft.cancel()
+            self._draft_lines.put_nowait(None)      # In case it's cancelled before it started
+        self._draft = None
+        self._generating = None
+        self._generated = None
+
+
+    def _redraft(self, log: LogHanglerInterface=LogNothing()) -> None:
+        '''Throws away the current draft and drafts a response to the unread messages'''
+        self._discard_draft()
+        if len(self.unread_message_queue) == 0: return
+        log.log(LogType.INFO, f"Drafting response to {len(self.unread_message_queue)} message(s)...")
+        self._draft_lines = asyncio.Queue()
+        self._draft_answered = list(self.unread_message_queue)
+        self._draft = asyncio.create_task(self._draft_response(self._draft_lines, log))
+
+
+    def _record(self, used: int=0, wasted: int=0, cancelled: int=0, cached: int=0) -> None:
+        for stats in (self.generation_stats, GENERATION_STATS):
+            stats.used += used
+            stats.wasted += wasted
+            stats.cancelled += cancelled
+            stats.cached += cached
+
+
+    async def _search(self, key: tuple, log: LogHanglerInterface=LogNothing()) -> list[Message]:
+        '''
+        Long-term memories worth putting into the prompt. Queries already covered by short-term memory are dropped
+        by RETRIEVAL_GATE, the hits of the others are over-fetched and re-ranked by RETRIEVER.
+        '''
+        results: list[Message] | None = self.response_cache.get(key)
+        if results is None:
+            stm_messages: list[Message] = await self.memory.get_short_term_memory(log=log.sub())
+            unread_ids  : set[int] = {message.id for message in self.unread_message_queue}
+            queries: list[str] = await RETRIEVAL_GATE.filter(list(key[2]), [message for message in stm_messages if message.id not in unread_ids], log=log.sub())
+            results = []
+            if len(queries):
+                start: float = time.perf_counter()
+                hits: list[SearchHit] = (await self.memory.search_long_term_memory_hits(queries, RETRIEVER.fetch_limit, log=log.sub())).unwrap()
+                RETRIEVAL_GATE.stats.search_seconds += time.perf_counter() - start
+                results = RETRIEVER.rank(hits, stm_messages)
+            else:
+                log.log(LogType.INFO, "Long term memory search skipped, short term memory covers it")
+            self.response_cache.put(key, results)
+        return results
+
+
+    async def _draft_response(self, lines: asyncio.Queue[str | None], log: LogHanglerInterface=LogNothing()) -> bool:
+        '''
+        Searches long-term memory, crafts the prompt and generates a response to the unread messages. 
+        Lines of the response are queued as soon as they're complete, followed by None.
+        Returns whether the response was generated, an empty response counts. It's False when generating failed.
+        '''
+        # Wait for all messages to be in memory
+        await self.messages_saved.wait()
+        version: int = self.state_version
+        ltm_task = asyncio.create_task(self._search(("search", version, tuple(create_search_queries(self.unread_message_queue))), log))
+        try:
+            # Slots are shared by every channel, the artificial delays don't hold one
+            async with SCHEDULER.pipeline():
                 stm_messages: list[Message] = await self.memory.get_short_term_memory(log=log.sub())
                 log.log(LogType.INFO, f"Got short term memory")
                 log.log(LogType.DEBUG, (f"STM INFO:\n"
@@ -104,67 +230,133 @@ class ComplexMemoryConversation(ConversationInterface):
                                         f"oldest: {str(stm_messages[ 0] if len(stm_messages) else None)}\n"
                                         f"newest: {str(stm_messages[-1] if len(stm_messages) else None)}"))
 
-                ltm_search_results: list[Message] = (await ltm_task).unwrap()
+                ltm_search_results: list[Message] = await ltm_task
                 log.log(LogType.INFO, "Got long term memory")
                 log.log(LogType.DEBUG, "LTM INFO:\nresults: {}".format('\n         '.join([str(message) for message in ltm_search_results])))
 
-                # Redo if message amount has changed
-                if current_amount_of_unread_messages != len(self.unread_message_queue):
-                    log.log(LogType.INFO, "New message(s) added. Rereading...") 
-                    continue
-
-                ltm_messages: list[list[Message]] = [await get_messages_around_MAGIC(self.channel_id, message) for message in ltm_search_results ]
+                ltm_messages: list[list[Message]] = await CONTEXT_STORE.expand(self.memory, ltm_search_results[:LTM_CONTEXT_WINDOWS], log=log.sub())
                 log.log(LogType.INFO, "Magic done on long term memory!")
 
-                ai_prompt: str = await prompt.prompt_crafter(ltm_messages[:3], stm_messages, 0.5, prompt.DefaultTextModel(), log=log.sub())
+                ai_prompt: str = await prompt.prompt_crafter(ltm_messages, stm_messages, 0.5, self.memory.textModel, self.ltm_text_model, log=log.sub())
                 self.current_prompt = ai_prompt
                 log.log(LogType.INFO, "Prompt crafted!")
 
-                response: str = (await ai.openai_generate_response(ai_prompt, log=log.sub())).unwrap_or("")
-                response_attempts += 1
-                if current_amount_of_unread_messages != len(self.unread_message_queue):
-                    log.log(LogType.INFO, "New message(s) added. Recalculating...") 
-                    continue
-                if response == "":
-                    response = (await ai.openai_generate_response(ai_prompt, log=log.sub())).unwrap_or("")
+                generation_key: tuple = ("generate", version, hashlib.sha256(ai_prompt.encode("utf-8")).digest())
+                cached: list[str] | None = self.response_cache.get(generation_key)
+                if cached is not None:
+                    self._record(cached=1)
+                    for line in cached: lines.put_nowait(line)
+                    log.log(LogType.INFO, "Response replayed from cache!")
+                    return True
+
+                generated: list[str] = []
+                self._generating = asyncio.current_task()
+                try:
+                    if self.streaming:
+                        async for line in ai.openai_stream_response(ai_prompt, log=log.sub()):
+                            lines.put_nowait(line)
+                            generated.append(line)
+                    else:
+                        result: Result[str] = await ai.openai_generate_response(ai_prompt, log=log.sub())
+                        if not result.is_valid(): return False
+                        if result.unwrap() != "": generated = result.unwrap().split('\n')
+                        for line in generated: lines.put_nowait(line)
+                except Exception:
+                    return False
+                finally:
+                    if self._generating is asyncio.current_task(): self._generating = None
+                self._generated = asyncio.current_task()
+                # An empty response is generated again rather than replayed
+                if len(generated) != 0: self.response_cache.put(generation_key, generated)
                 log.log(LogType.INFO, "Response generated!")
-
-                #? RESPONSE --------------------------------------------------------------------------------------------        
-
-                # Redo if message amount has changed
-                if len(self.unread_message_queue) == 0: break
-                if current_amount_of_unread_messages != len(self.unread_message_queue):
-                    log.log(LogType.INFO, "New message(s) added. Recalculating...") 
-                    continue
-                break
-
-            log.log(LogType.DEBUG, "CONVERSATION\nreading attempts: {}\nresponse attempts: {}\nmessages:\n    {}\nresponse:\n    {}".format(
-                reading_attempts,
-                response_attempts, 
-                '\n    '.join([str(message) for message in self.unread_message_queue]),
-                response))
-
-            # Respond
-            if len(self.unread_message_queue) != 0:
-                with open("private.json", encoding='utf-8') as file:
-                    USERNAME = json.load(file)["userName"]
-
-                response = response.strip()
-                response = re.sub(r'\d{4}-\d{2}-\d{2}|\d{2}:\d{2}:\d{2}', '', response)
-                response = re.sub(r'\(\s*\)', '', response)
-                response = re.sub(r'\w+#\d+', '', response)
-                response = re.sub(USERNAME, '', response, flags=re.IGNORECASE)
-                response = response.replace(":", '')
-                response = response.strip()
-                if response == "":
-                    self.is_processing = False 
-                    return
-
-                for message in response.split('\n'):
-                    message = message.strip()
-                    if message == "": continue 
-                    await callback(message)
-            self.unread_message_queue.clear()
-            self.is_processing = False
+                return True
+        finally:
+            ltm_task.cancel()
+            lines.put_nowait(None)
 
 
+    async def communicate(self, callback=Callable[[str], Any], log: LogHanglerInterface=LogNothing()):
+        log.log(LogType.INFO, "Communicating...")
+        if not self.is_processing and len(self.unread_message_queue) != 0:
+            self.is_processing = True 
+            self._log = log
+            reading_attempts : int = 0
+            response_attempts: int = 0
+            answered: list[Message] = []    # The unread messages the delivered response answers
+            sent    : list[str] = []
+            try:
+                # Speculatively, the response is drafted during the delays and redrafted whenever a message arrives
+                if self.speculative: self._redraft(log)
+
+                # Sleeping delay
+                delay: float = self.delay.ping()
+                log.log(LogType.INFO, f"Sleeping... ({delay})")
+                if delay > 0: await asyncio.sleep(delay)                                        # Bot start computing delay
+
+                lines     : asyncio.Queue[str | None] | None = None    # Lines of the response which is being delivered
+                first_line: str | None = None
+                while len(self.unread_message_queue) != 0 and reading_attempts < 5 and response_attempts < 3:
+                    await self._read(log)                                                       # Reading delay
+                    reading_attempts += 1
+                    if len(self.unread_message_queue) == 0: break
+
+                    # Response
+                    log.log(LogType.INFO, "Generating response...")
+                    if self._draft is None: self._redraft(log)
+                    draft: asyncio.Task = self._draft   # type: ignore
+                    lines = self._draft_lines
+                    first_line = await lines.get()
+                    if draft is not self._draft:
+                        lines = None
+                        log.log(LogType.INFO, "New message(s) added. Recalculating...") 
+                        continue
+                    response_attempts += 1
+                    # From here on the response is delivered as it's generated, new messages don't cancel it anymore
+                    self._draft = None
+                    answered = self._draft_answered
+                    self._record(used=1)
+                    if first_line is None:
+                        await asyncio.wait([draft])
+                        if draft.exception() is not None: raise draft.exception()     # type: ignore
+                        if draft.result(): break
+                        # Generating failed, tried once more
+                        lines = asyncio.Queue()
+                        for line in (await ai.openai_generate_response(self.current_prompt, log=log.sub())).unwrap_or("").split('\n'): lines.put_nowait(line)
+                        lines.put_nowait(None)
+                        first_line = await lines.get()
+                    break
+
+                # Respond
+                if lines is not None and len(self.unread_message_queue) != 0:
+                    with open("private.json", encoding='utf-8') as file:
+                        USERNAME = json.load(file)["userName"]
+
+                    line: str | None = first_line
+                    while line is not None:
+                        line = clean_response_line(line, USERNAME)
+                        if line != "":
+                            await callback(line)
+                            sent.append(line)
+                        line = await lines.get()
+
+                log.log(LogType.DEBUG, "CONVERSATION\nreading attempts: {}\nresponse attempts: {}\ngenerations: {}\nmessages:\n    {}\nresponse:\n    {}".format(
+                    reading_attempts,
+                    response_attempts, 
+                    self.generation_stats,
+                    '\n    '.join([str(message) for message in self.unread_message_queue]),
+                    '\n    '.join(sent)))
+
+                # Messages which arrived while the response was delivered aren't answered by it
+                if len(sent) != 0:
+                    answered_ids: set[int] = {message.id for message in answered}
+                    self.unread_message_queue = [message for message in self.unread_message_queue if message.id not in answered_ids]
+            finally:
+                # Nothing would read a new draft, the next communicate drafts again
+                self._discard_draft()
+                self.response_cache.clear()
+                self.is_processing = False
+
+            # Nothing else starts communicating while it's processing, those messages would never be answered
+            if len(sent) != 0 and len(self.unread_message_queue) != 0:
+                log.log(LogType.INFO, f"{len(self.unread_message_queue)} message(s) arrived while responding. Communicating again...")
+                await self.communicate(callback, log=log)
@@ -1,11 +1,10 @@
-import logging, inspect, typing, time, colorama, json, subprocess, os
+import logging, logging.handlers, inspect, typing, time, colorama, json, subprocess, os, threading, queue, atexit
 import multiprocessing as mp
 from enum import Enum
 from abc import ABC, abstractmethod
 from datetime import datetime
-from debug_terminal import json_file_path as debug_terminal_json_file_path
+from debug_terminal import log_file_path as debug_terminal_log_file_path
 from debug_terminal import termination_signal as debug_terminal_termination_signal
-from utility import create_json_file_if_not_exist
 
 # def init():
 #     colorama.init()
@@ -24,9 +23,13 @@ ch.setLevel(logging.INFO)
 formatter = logging.Formatter('%(message)s')
 ch.setFormatter(formatter)
 fh.setFormatter(formatter)
-# add the handlers to logger
+# add the handlers to logger, the file is written by a background thread
 # logger.addHandler(ch)
-logger.addHandler(fh)
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+listener = logging.handlers.QueueListener(log_queue, fh)
+listener.start()
+atexit.register(listener.stop)
 LOGGED = False
 
 class LogType(Enum):
@@ -82,6 +85,83 @@ class LogHanglerInterface(ABC):
 
 
 LAST_IDENTIFIER_PRINTED_STDCOUT = ""
+
+
+def caller_file_name(frame) -> str:
+    return frame.f_code.co_filename.split("Discord Selfbot\\")[-1]
+
+
+
+class LogPipe:
+    '''
+    Log lines are queued by the loggers and appended to a newline delimited JSON file by a background thread,
+    so logging never waits on the disk. debug_terminal.py tails the file.
+    '''
+    file_path    : str
+    lines_written: int
+    writes       : int
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.lines_written = 0
+        self.writes = 0
+        self._queue: queue.SimpleQueue[list[str] | threading.Event | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._run, name="LogPipe", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+
+    def put(self, lines: list[str]) -> None:
+        if self._thread is None: self._start()
+        self._queue.put(lines)
+
+
+    def flush(self, timeout: float | None=None) -> None:
+        '''Waits until every line queued so far is written'''
+        if self._thread is None: return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+
+
+    def close(self) -> None:
+        if self._thread is None or not self._thread.is_alive(): return
+        self._queue.put(None)
+        self._thread.join()
+
+
+    def _run(self) -> None:
+        with open(self.file_path, 'a', encoding='utf-8') as file:
+            running: bool = True
+            while running:
+                # Write everything queued since the last write at once
+                items: list = [self._queue.get()]
+                while True:
+                    try: items.append(self._queue.get_nowait())
+                    except queue.Empty: break
+
+                lines: list[str] = []
+                events: list[threading.Event] = []
+                for item in items:
+                    if   item is None                   : running = False
+                    elif isinstance(item, threading.Event): events.append(item)
+                    else                                : lines.extend(item)
+                if len(lines):
+                    file.write(''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines))
+                    file.flush()
+                    self.lines_written += len(lines)
+                    self.writes += 1
+                for event in events: event.set()
+
+
+LOG_PIPE: LogPipe = LogPipe(debug_terminal_log_file_path)
     
 class LogStdcout(LogHanglerInterface):
 
@@ -114,7 +194,7 @@ class LogStdcout(LogHanglerInterface):
 
         # Information about caller
         caller_frame = inspect.currentframe().f_back                                        # type: ignore
-        file_name = caller_frame.f_code.co_filename.split("Discord Selfbot\\")[1]           # type: ignore
+        file_name = caller_file_name(caller_frame)                                          # type: ignore
         function_name = caller_frame.f_code.co_name                                         # type: ignore
 
         # Elements
@@ -185,21 +265,9 @@ class LogJsonFile(LogHanglerInterface):
 
     INDENTATION = "   o "
 
-    def __init__(self, loggingLevel: LogType = LogType.INFO, identifier: str = "", depth: int = 0) -> None:
-        create_json_file_if_not_exist(debug_terminal_json_file_path, [])
-        super().__init__(loggingLevel, identifier, depth)
-
-
     def send_termination_signal(self):
-        json_data: list
-
-        with open(debug_terminal_json_file_path, encoding='utf-8') as file:
-            json_data = json.load(file)
-
-        json_data.append(debug_terminal_termination_signal)
-
-        with open(debug_terminal_json_file_path, 'w', encoding='utf-8') as file:
-            json.dump(json_data, file, ensure_ascii=False)
+        LOG_PIPE.put([debug_terminal_termination_signal])
+        LOG_PIPE.flush()
 
 
     def log(self, level: LogType, message: str) -> None:
@@ -210,7 +278,7 @@ class LogJsonFile(LogHanglerInterface):
 
         # Information about caller
         caller_frame = inspect.currentframe().f_back                                        # type: ignore
-        file_name = caller_frame.f_code.co_filename.split("Discord Selfbot\\")[1]           # type: ignore
+        file_name = caller_file_name(caller_frame)                                          # type: ignore
         function_name = caller_frame.f_code.co_name                                         # type: ignore
 
         # Elements
@@ -238,28 +306,23 @@ class LogJsonFile(LogHanglerInterface):
 
         space = lambda string: ' '*len(string)
 
-        json_data: list
-
-        with open(debug_terminal_json_file_path, encoding='utf-8') as file:
-            json_data = json.load(file)
+        terminal_lines: list[str] = []
 
-            if not self.first_line_printed or LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier:
-                json_data.append(f"{space(e_date)} {p_id if LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier else space(e_id)} {p_indentation} {p_path}")
-                logger.log(logging.INFO, f"{space(e_date)} {e_id if LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier else space(e_id)} {e_indentation} {e_path}") 
-                self.first_line_printed = True
-
-            # Log main line
-            json_data.append(f"{p_date} {space(e_id)} {p_indentation}{self.INDENTATION} {p_symbol} {c_base}{lines[0]}{colorama.Fore.RESET}")
-            logger.log(logging.INFO, f"{e_date} {space(e_id)} {e_indentation}{self.INDENTATION} {e_symbol} {lines[0]}")
+        if not self.first_line_printed or LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier:
+            terminal_lines.append(f"{space(e_date)} {p_id if LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier else space(e_id)} {p_indentation} {p_path}")
+            logger.log(logging.INFO, f"{space(e_date)} {e_id if LAST_IDENTIFIER_PRINTED_STDCOUT != self.identifier else space(e_id)} {e_indentation} {e_path}") 
+            self.first_line_printed = True
 
-            # Log extra lines
-            for line in lines[1:]:
-                json_data.append(f"{space(f'{e_date} {space(e_id)}')} {p_indentation}{self.INDENTATION} {space(e_symbol)} {c_extra_data}{line}{colorama.Fore.RESET}")
-                logger.log(logging.INFO, f"{space(f'{e_date} {space(e_id)}')} {e_indentation}{self.INDENTATION} {space(e_symbol)} {line}")
+        # Log main line
+        terminal_lines.append(f"{p_date} {space(e_id)} {p_indentation}{self.INDENTATION} {p_symbol} {c_base}{lines[0]}{colorama.Fore.RESET}")
+        logger.log(logging.INFO, f"{e_date} {space(e_id)} {e_indentation}{self.INDENTATION} {e_symbol} {lines[0]}")
 
-        with open(debug_terminal_json_file_path, 'w', encoding='utf-8') as file:
-            json.dump(json_data, file, ensure_ascii=False)
+        # Log extra lines
+        for line in lines[1:]:
+            terminal_lines.append(f"{space(f'{e_date} {space(e_id)}')} {p_indentation}{self.INDENTATION} {space(e_symbol)} {c_extra_data}{line}{colorama.Fore.RESET}")
+            logger.log(logging.INFO, f"{space(f'{e_date} {space(e_id)}')} {e_indentation}{self.INDENTATION} {space(e_symbol)} {line}")
 
+        LOG_PIPE.put(terminal_lines)
         LAST_IDENTIFIER_PRINTED_STDCOUT = self.identifier
 
 
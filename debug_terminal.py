@@ -1,59 +1,48 @@
-import json, time, colorama
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from typing import Any
+import json, os, time, colorama
+from typing import Iterator
 
-from utility import create_json_file_if_not_exist
-
-# Replace 'data.json' with the path to your JSON file
-json_file_path = 'logs.json'
+# Newline delimited JSON, one log line per line, appended by debug.LogPipe
+log_file_path = 'logs.jsonl'
 termination_signal = '123024 TERMINATEjdpsdh 324 99034234 12df *** 11'
-run: bool = True
-
-
-class JsonChangeHandler(FileSystemEventHandler):
-    current_index: int = 0
-    printing_lock: bool = False
-    logs: list[str] = []
-
-    def start_printing(self):
-        global run
-        if not self.printing_lock:
-            self.printing_lock = True
-            if self.current_index > len(self.logs): self.current_index = len(self.logs)
-            while self.current_index < len(self.logs):
-                if self.logs[self.current_index] == termination_signal:
-                    run = False
-                    return
-                print(self.logs[self.current_index])
-                self.current_index += 1
-            self.printing_lock = False
-            
-
-    def on_modified(self, event):  
-        if event.src_path == f".\\{json_file_path}":
+poll_interval: float = 0.1     # In seconds
+
+
+def tail(file_path: str) -> Iterator[str]:
+    '''Yields log lines as they are appended, only new bytes are read. Starts over if the file is truncated'''
+    offset: int = 0
+    buffer: bytes = b''
+    while True:
+        size: int = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+        if size < offset:
+            offset = 0
+            buffer = b''
+        if size == offset:
+            time.sleep(poll_interval)
+            continue
+
+        with open(file_path, 'rb') as file:
+            file.seek(offset)
+            data: bytes = file.read(size - offset)
+        offset += len(data)
+
+        # A line that is still being written is kept until it is complete
+        *lines, buffer = (buffer + data).split(b'\n')
+        for line in lines:
             try:
-                with open(json_file_path, encoding='utf-8') as file:
-                    self.logs = json.load(file)
-                self.start_printing()
-            except Exception as e:
+                yield json.loads(line)
+            except ValueError:
                 pass
 
 
 if __name__ == "__main__":
     colorama.init()
-    with open(json_file_path, 'w', encoding='utf-8') as file:
-        json.dump([], file, ensure_ascii=False)
-    event_handler = JsonChangeHandler()
-    observer = Observer()
-    observer.schedule(event_handler, path='.', recursive=False)
-    observer.start()
+    open(log_file_path, 'w', encoding='utf-8').close()
 
     try:
-        while run:
-            time.sleep(1)
+        for line in tail(log_file_path):
+            if line == termination_signal: break
+            print(line)
     except KeyboardInterrupt:
         pass
     print("--- GAVE UP! ---")
-    observer.stop()
     colorama.deinit()
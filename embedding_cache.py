@@ -0,0 +1,150 @@
+import os, hashlib, unicodedata
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from storage import AppendOnlyLog
+
+
+
+@dataclass
+class CacheStats:
+    hits     : int = 0
+    misses   : int = 0
+    evictions: int = 0
+
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0
+
+
+
+class EmbeddingCache:
+    '''
+    Disk-backed embedding cache keyed by hash(model, normalized text).
+    Vectors are kept as float32 rows of a memory-mapped file, the key -> row index is an append-only journal:
+        ["snapshot", [[key, row], ...]]
+        ["put"     , key, row]
+        ["evict"   , row]
+    The least recently used row is reused once the cache is full.
+    '''
+    directory: str
+    dim      : int
+    capacity : int
+    stats    : CacheStats
+
+    def __init__(self, directory: str, dim: int, capacity: int) -> None:
+        if capacity <= 0:
+            raise ValueError("Capacity cannot be less than 1")
+        self.directory = directory
+        self.dim = dim
+        self.capacity = capacity
+        self.stats = CacheStats()
+        self._rows: OrderedDict[str, int] = OrderedDict()    # Least recently used first
+        self._free: list[int] = []
+        self._journal = AppendOnlyLog(os.path.join(directory, "index.jsonl"))
+        self._journal_records: int = 0
+
+        os.makedirs(directory, exist_ok=True)
+        vectors_path: str = os.path.join(directory, f"vectors_{dim}.f32")
+        expected_size: int = capacity * dim * 4
+        if os.path.isfile(vectors_path) and os.path.getsize(vectors_path) == expected_size:
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+            self._load_index()
+        else:
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(capacity, dim))
+            self._journal.remove()
+        self._free = sorted(set(range(capacity)) - set(self._rows.values()), reverse=True)
+
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return unicodedata.normalize("NFC", ' '.join(text.split()))
+
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{EmbeddingCache.normalize(text)}".encode("utf-8")).hexdigest()[:32]
+
+
+    def _load_index(self) -> None:
+        owners: dict[int, str] = {}
+        for record in self._journal.read():
+            if record[0] == "snapshot":
+                self._rows.clear()
+                owners.clear()
+                for key, row in record[1]:
+                    self._rows[key] = row
+                    owners[row] = key
+            elif record[0] == "evict":
+                if record[1] in owners: self._rows.pop(owners.pop(record[1]), None)
+            elif record[0] == "put":
+                if record[2] in owners: self._rows.pop(owners.pop(record[2]), None)
+                self._rows.pop(record[1], None)
+                self._rows[record[1]] = record[2]
+                owners[record[2]] = record[1]
+        self._compact()
+
+
+    def _compact(self) -> None:
+        self._journal.compact([["snapshot", [[key, row] for key, row in self._rows.items()]]])
+        self._journal_records = 1
+
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+
+    def get_many(self, model: str, strings: list[str], count: bool=True) -> list[list[float] | None]:
+        '''Returns the cached embedding of every string, None where it isn't cached'''
+        results: list[list[float] | None] = []
+        for string in strings:
+            key: str = EmbeddingCache.key(model, string)
+            row: int | None = self._rows.get(key)
+            if row is None:
+                if count: self.stats.misses += 1
+                results.append(None)
+                continue
+            if count: self.stats.hits += 1
+            self._rows.move_to_end(key)
+            results.append(self._vectors[row].tolist())
+        return results
+
+
+    def put_many(self, model: str, strings: list[str], embeddings: list[list[float]]) -> None:
+        assert len(strings) == len(embeddings)
+        evicts: list[list] = []
+        puts  : list[list] = []
+        writes: list[tuple[int, list[float]]] = []
+        for string, embedding in zip(strings, embeddings):
+            key: str = EmbeddingCache.key(model, string)
+            if key in self._rows:
+                self._rows.move_to_end(key)
+                continue
+            if len(self._free):
+                row: int = self._free.pop()
+            else:
+                _, row = self._rows.popitem(last=False)
+                evicts.append(["evict", row])
+                self.stats.evictions += 1
+            self._rows[key] = row
+            puts.append(["put", key, row])
+            writes.append((row, embedding))
+
+        # Evicted rows are journaled before their vectors are overwritten on disk
+        self._journal.append(evicts)
+        for row, embedding in writes:
+            self._vectors[row] = np.asarray(embedding, dtype=np.float32)
+        self._vectors.flush()
+        self._journal.append(puts)
+        self._journal_records += len(evicts) + len(puts)
+        if self._journal_records > 4 * self.capacity: self._compact()
+
+
+    def clear(self) -> None:
+        self._rows.clear()
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._compact()
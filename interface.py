@@ -1,12 +1,15 @@
 import asyncio
 from abc import ABC, abstractmethod
 
-from typing import Callable, Any
+from typing import Callable, Any, TYPE_CHECKING
 
-from structure import Message
+from structure import Message, DatabaseEntry, SearchHit
 from utility import Result
 from debug import LogHanglerInterface, LogNothing, LogType
 
+if TYPE_CHECKING:
+    from prompt import TextModelInterface
+
 
 class ConversationInterface(ABC):
     channel_id: int
@@ -15,11 +18,16 @@ class ConversationInterface(ABC):
     is_saving_message: bool 
     is_processing    : bool
     current_prompt   : str
+    messages_saved   : asyncio.Event    # Set while no message is being saved
+    message_arrived  : asyncio.Event    # Set whenever a message is added to the unread message queue
 
     @abstractmethod
     def __init__(self, channel_id: int, log: LogHanglerInterface=LogNothing()) -> None:
         self.is_saving_message = False
         self.is_processing = False
+        self.messages_saved = asyncio.Event()
+        self.messages_saved.set()
+        self.message_arrived = asyncio.Event()
         self.channel_id = channel_id
         self.unread_message_queue = []
         self.unsaved_message_queue = []
@@ -36,10 +44,13 @@ class ConversationInterface(ABC):
 class MemoryInterface(ABC):
     channel_id: int
     STM_LIMIT: int
+    textModel: 'TextModelInterface'
+    on_load  : Callable[[], None]       # Called after messages were loaded on demand, e.g. to re-check a memory budget
 
     def __init__(self, channel_id: int, stm_limit: int, log: LogHanglerInterface=LogNothing()) -> None:
         self.channel_id = channel_id
         self.STM_LIMIT = stm_limit
+        self.on_load = lambda: None
 
     @abstractmethod
     async def add_messages(self, messages: list[Message], log: LogHanglerInterface=LogNothing()) -> None:
@@ -51,8 +62,24 @@ class MemoryInterface(ABC):
     async def search_long_term_memory(self, text: str, log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
         ...
     @abstractmethod
+    async def search_long_term_memory_batch(self, texts: list[str], log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
+        '''Searches with every text in a single round-trip. Returns messages found by any of them, most relevant first'''
+        ...
+    async def search_long_term_memory_hits(self, texts: list[str], limit: int=10, log: LogHanglerInterface=LogNothing()) -> Result[list[SearchHit]]:
+        '''Same as search_long_term_memory_batch, keeping the distance of every hit. Memories without distances report 0'''
+        return (await self.search_long_term_memory_batch(texts, log=log)).map(lambda messages : [SearchHit(message, 0.0) for message in messages[:limit]])
+    @abstractmethod
     async def get_short_term_memory(self, log: LogHanglerInterface=LogNothing()) -> list[Message]:
         ...
+    async def get_messages_around(self, message_id: int, amount: int, log: LogHanglerInterface=LogNothing()) -> list[Message]:
+        '''Up to amount stored messages centered on the given one, oldest first. Empty if it isn't stored locally'''
+        return []
+    def resident_bytes(self) -> int:
+        '''Approximate memory held by loaded messages'''
+        return 0
+    def unload(self) -> int:
+        '''Drops the messages loaded on demand, they're loaded again when needed. Returns the bytes released'''
+        return 0
     @abstractmethod
     async def clear_long_term_memory(self, log: LogHanglerInterface=LogNothing()) -> None:
         ...
@@ -61,6 +88,41 @@ class MemoryInterface(ABC):
         ...
 
 
+class VectorStoreInterface(ABC):
+    '''Embedded messages partitioned by channel, searched by L2 distance'''
+    @abstractmethod
+    def has_channel(self, channel_id: int) -> bool:
+        ...
+    @abstractmethod
+    async def create_channel_memory_if_new(self, channel_id: int, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Returns True if channel was created, False if channel wasn't created because it already exists'''
+        ...
+    @abstractmethod
+    async def remove_channel_memory_if_exists(self, channel_id: int, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Returns True if channel was removed, False if channel wasn't removed because it doesn't exist'''
+        ...
+    @abstractmethod
+    async def add_entries(self, channel_id: int, entries: list[DatabaseEntry], log: LogHanglerInterface=LogNothing()) -> bool:
+        ...
+    @abstractmethod
+    async def remove_entries(self, channel_id: int, entry_ids: list[int], log: LogHanglerInterface=LogNothing()) -> bool:
+        ...
+    @abstractmethod
+    async def create_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        ...
+    @abstractmethod
+    async def ensure_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        ...
+    @abstractmethod
+    async def search_hits(self, channel_id: int, vectors: list[list[float]] | None=None, expr: str | None=None, limit: int=10,
+                          log: LogHanglerInterface=LogNothing()) -> Result[list[list[SearchHit]]]:
+        '''Searches every vector in one call. Returns the hits of each vector, closest first'''
+        ...
+    async def search(self, channel_id: int, vectors: list[list[float]] | None=None, expr: str | None=None,
+                     log: LogHanglerInterface=LogNothing()) -> Result[list[list[Message]]]:
+        return (await self.search_hits(channel_id, vectors, expr, log=log)).map(lambda result : [[hit.message for hit in hits] for hits in result])
+
+
 class DelayInterface(ABC):
     @abstractmethod
     def ping(self, log: LogHanglerInterface=LogNothing()) -> float:
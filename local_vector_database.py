@@ -0,0 +1,634 @@
+import asyncio, os, re, shutil
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+
+from interface import VectorStoreInterface
+from storage import AppendOnlyLog
+from structure import Message, DatabaseEntry, SearchHit
+from utility import Result
+from vector_database import MilvusConnection, CollectionType, choose_nlist, _DIM
+
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+LOCAL_VECTOR_DIRECTORY: str = "vector-memory"
+
+_OPEN_PARTITIONS    : int = 64          # Partitions kept open at most, the least recently used idle ones are closed
+_MIN_CAPACITY       : int = 1024        # Rows a vector file is created with, it's doubled whenever it runs full
+_SEARCH_CHUNK_ROWS  : int = 65536       # Rows compared with the queries at once by an exhaustive search
+_DECODE_CHUNK_ROWS  : int = 4096        # Same for quantized rows, which are converted to float32 first and should stay in cache
+_COMPACT_MIN_DEAD   : int = 1000        # Removed rows after which a partition is compacted, once they're half of it
+
+_INDEX_MIN_ROWS     : int = 50000       # Partitions with fewer rows are always searched exhaustively
+_INDEX_NPROBE       : int = 10          # Clusters scanned per query, same as the Milvus search
+_KMEANS_ITERATIONS  : int = 10
+_KMEANS_MAX_SAMPLE  : int = 65536       # Rows the centroids are trained on at most
+_RERANK_FACTOR      : int = 4           # Quantized searches re-rank this many times the asked for hits with the exact vectors
+
+_VECTOR_FILE = re.compile(r"vectors_(\d+)\.f32")
+
+
+
+# ENUMS
+
+class Quantization(Enum):
+    '''How vectors are kept in memory for the first pass of a search, the float32 vectors stay on disk'''
+    NONE    = "float32"     # No copy, searches read the float32 vectors
+    FLOAT16 = "float16"     # Half the size
+    INT8    = "int8"        # A quarter of the size, every row is scaled to [-127, 127]
+
+
+QUANTIZATION: dict[CollectionType, Quantization] = {     # Per collection, applies to the local backend
+    CollectionType.MAIN   : Quantization.INT8,
+    CollectionType.TESTING: Quantization.NONE,
+}
+
+
+
+# STRUCTS
+
+@dataclass
+class LocalStoreStats:
+    exact_searches  : int = 0
+    indexed_searches: int = 0
+    builds          : int = 0
+    compactions     : int = 0
+    closes          : int = 0
+
+
+
+# FUNCTIONS
+
+def squared_distances(queries: np.ndarray, vectors: np.ndarray, norms: np.ndarray, scales: np.ndarray | None=None) -> np.ndarray:
+    '''
+    Squared L2 distance of every query to every vector, as Milvus reports it. norms are the squared norms of the vectors.
+    Quantized vectors are given as their codes with the scale of each row.
+    '''
+    distances: np.ndarray = queries @ vectors.T.astype(np.float32, copy=False)
+    if scales is not None: distances *= scales[None, :]
+    distances *= -2
+    distances += norms[None, :]
+    distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+    return np.maximum(distances, 0, out=distances)
+
+
+def quantize(vectors: np.ndarray, quantization: Quantization) -> tuple[np.ndarray, np.ndarray]:
+    '''Codes of the vectors along with the scale of every row, a row is approximated by its codes times its scale'''
+    if quantization == Quantization.INT8:
+        scales: np.ndarray = np.abs(vectors).max(axis=1) / 127
+        codes : np.ndarray = np.rint(vectors / np.where(scales > 0, scales, 1)[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if quantization == Quantization.FLOAT16:
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    raise ValueError(f"Vectors aren't quantized with {quantization}")
+
+
+def grow(array: np.ndarray, capacity: int) -> np.ndarray:
+    '''Copy of the array with room for capacity rows, new rows are zeroed'''
+    return np.concatenate([array, np.zeros((capacity - len(array), *array.shape[1:]), dtype=array.dtype)])
+
+
+def top_k(distances: np.ndarray, rows: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+    '''The limit closest rows of a single query, closest first'''
+    if len(distances) > limit:
+        closest: np.ndarray = np.argpartition(distances, limit - 1)[:limit]
+        distances, rows = distances[closest], rows[closest]
+    order: np.ndarray = np.argsort(distances, kind="stable")
+    return distances[order], rows[order]
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    centroid_norms: np.ndarray = np.einsum("ij,ij->i", centroids, centroids)
+    labels: np.ndarray = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _SEARCH_CHUNK_ROWS):
+        chunk: np.ndarray = np.asarray(vectors[start:start + _SEARCH_CHUNK_ROWS], dtype=np.float32)
+        labels[start:start + len(chunk)] = np.argmin(centroid_norms[None, :] - 2 * (chunk @ centroids.T), axis=1)
+    return labels
+
+
+
+# CLASSES
+
+class IVFIndex:
+    '''
+    Inverted file index over the first rows of a partition. Rows are grouped by their closest k-means centroid,
+    a query only scans the rows of its nprobe closest centroids.
+    '''
+    centroids: np.ndarray
+    rows     : int          # Rows covered by the index, rows added later are scanned exhaustively
+
+    def __init__(self, centroids: np.ndarray, labels: np.ndarray) -> None:
+        self.centroids = centroids
+        self.rows = len(labels)
+        self._order: np.ndarray = np.argsort(labels, kind="stable").astype(np.int64)
+        self._bounds: np.ndarray = np.searchsorted(labels[self._order], np.arange(len(centroids) + 1))
+
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+
+    @staticmethod
+    def train(vectors: np.ndarray, nlist: int, iterations: int=_KMEANS_ITERATIONS, seed: int=0) -> 'IVFIndex':
+        random = np.random.default_rng(seed)
+        sample_rows: np.ndarray = np.sort(random.choice(len(vectors), min(len(vectors), _KMEANS_MAX_SAMPLE), replace=False))
+        sample: np.ndarray = np.asarray(vectors[sample_rows], dtype=np.float32)
+        nlist = min(nlist, len(sample))
+        centroids: np.ndarray = sample[random.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels: np.ndarray = nearest_centroids(sample, centroids)
+            order : np.ndarray = np.argsort(labels, kind="stable")
+            used, starts = np.unique(labels[order], return_index=True)
+            counts: np.ndarray = np.diff(np.append(starts, len(order)))
+            centroids[used] = np.add.reduceat(sample[order], starts, axis=0) / counts[:, None]
+        return IVFIndex(centroids, nearest_centroids(vectors, centroids))
+
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        '''Rows in the nprobe clusters closest to the query'''
+        distances: np.ndarray = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2 * (self.centroids @ query)
+        probes: np.ndarray = np.argpartition(distances, min(nprobe, self.nlist) - 1)[:nprobe]
+        return np.concatenate([self._order[self._bounds[probe]:self._bounds[probe + 1]] for probe in probes])
+
+
+
+class LocalPartition:
+    '''
+    Messages of one channel with their embeddings, stored in a directory:
+        vectors_<generation>.f32 - float32 rows, memory-mapped
+        rows.jsonl               - append-only journal of the messages in row order
+            ["snapshot", <generation>, [[id, date, author, content], ...]]
+            ["add"     , [[id, date, author, content], ...]]
+            ["remove"  , [id, ...]]
+    Vectors are flushed before their rows are journaled. Removed rows are only masked, once enough of them
+    pile up the live rows are copied into the vector file of the next generation.
+    With quantization, searches rank the rows by their quantized copy kept in memory and only read the
+    float32 vectors of the closest ones from disk, to re-rank them exactly.
+    '''
+    directory : str
+    dim       : int
+    generation: int
+    count     : int     # Rows written, removed ones included
+    dead      : int
+    index     : IVFIndex | None
+    quantization: Quantization
+    rerank      : int
+
+    def __init__(self, directory: str, dim: int, quantization: Quantization=Quantization.NONE, rerank: int=_RERANK_FACTOR) -> None:
+        self.directory = directory
+        self.dim = dim
+        self.quantization = quantization
+        self.rerank = rerank
+        self.generation = 0
+        self.count = 0
+        self.dead = 0
+        self.index = None
+        self.lock = asyncio.Lock()
+        self.build_task: asyncio.Task | None = None
+        self._journal = AppendOnlyLog(os.path.join(directory, "rows.jsonl"))
+        self._messages: list[Message] = []
+        self._rows: dict[int, int] = {}         # Message id -> row
+        self._capacity: int = 0
+        self._vectors: np.memmap | None = None
+        self._norms: np.ndarray = np.zeros(0, dtype=np.float32)
+        self._alive: np.ndarray = np.zeros(0, dtype=bool)
+        self._codes: np.ndarray | None = None
+        self._scales: np.ndarray | None = None
+        self._load()
+
+
+    def _vector_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors_{generation}.f32")
+
+
+    def _load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for record in self._journal.read():
+            if record[0] == "snapshot":
+                self.generation = record[1]
+                self._messages.clear()
+                self._rows.clear()
+                self._append_messages(record[2])
+            elif record[0] == "add":
+                self._append_messages(record[1])
+            elif record[0] == "remove":
+                self._mask(record[1])
+
+        path: str = self._vector_path(self.generation)
+        stored: int = os.path.getsize(path) // (self.dim * 4) if os.path.isfile(path) else 0
+        if stored < len(self._messages):
+            # Vectors are written first, so this only happens if the file was damaged
+            for message in self._messages[stored:]:
+                if self._rows.get(message.id, -1) >= stored: self._rows.pop(message.id)
+            del self._messages[stored:]
+        self.count = len(self._messages)
+        self._open_vectors(max(stored, _MIN_CAPACITY))
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._alive[list(self._rows.values())] = True
+        self.dead = self.count - len(self._rows)
+        self._norms = np.zeros(self._capacity, dtype=np.float32)
+        if self.quantization != Quantization.NONE:
+            self._codes  = np.zeros((self._capacity, self.dim), dtype=self.quantization.value)
+            self._scales = np.zeros(self._capacity, dtype=np.float32)
+        for start in range(0, self.count, _SEARCH_CHUNK_ROWS):
+            chunk: np.ndarray = np.asarray(self._vectors[start:min(start + _SEARCH_CHUNK_ROWS, self.count)])   # type: ignore
+            self._set_rows(start, chunk)
+
+        # Leftovers of a compaction which was interrupted, or whose old file was still mapped
+        for name in os.listdir(self.directory):
+            match = _VECTOR_FILE.fullmatch(name)
+            if match and int(match.group(1)) != self.generation:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+    def _set_rows(self, start: int, vectors: np.ndarray) -> None:
+        '''Fills the in-memory columns of rows whose vectors were written'''
+        self._norms[start:start + len(vectors)] = np.einsum("ij,ij->i", vectors, vectors)
+        if self._codes is not None:
+            self._codes[start:start + len(vectors)], self._scales[start:start + len(vectors)] = quantize(vectors, self.quantization)   # type: ignore
+
+
+    def _append_messages(self, rows: list[list]) -> None:
+        for row in rows:
+            message: Message = Message.list_to_object(row)
+            self._rows[message.id] = len(self._messages)
+            self._messages.append(message)
+
+
+    def _mask(self, ids: list[int]) -> int:
+        removed: int = 0
+        for id in ids:
+            row: int | None = self._rows.pop(id, None)
+            if row is None: continue
+            if row < len(self._alive): self._alive[row] = False
+            removed += 1
+        return removed
+
+
+    def _open_vectors(self, capacity: int) -> None:
+        '''Maps the vector file with room for capacity rows, numpy extends the file if it's shorter'''
+        path: str = self._vector_path(self.generation)
+        mode: str = "r+" if os.path.isfile(path) and os.path.getsize(path) else "w+"
+        if self._vectors is not None: self._vectors.flush()
+        self._vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        self._capacity = capacity
+
+
+    def _reserve(self, rows: int) -> None:
+        if self.count + rows <= self._capacity: return
+        capacity: int = max(self._capacity * 2, self.count + rows)
+        self._open_vectors(capacity)
+        self._norms = grow(self._norms, capacity)
+        self._alive = grow(self._alive, capacity)
+        if self._codes is not None:
+            self._codes  = grow(self._codes , capacity)
+            self._scales = grow(self._scales, capacity)     # type: ignore
+
+
+    def __len__(self) -> int:
+        return self.count - self.dead
+
+
+    def resident_bytes(self) -> int:
+        '''Memory held by the columns searches scan, the float32 vectors count unless they're quantized'''
+        columns: int = self._norms.nbytes + self._alive.nbytes
+        if self._codes is not None: return columns + self._codes.nbytes + self._scales.nbytes     # type: ignore
+        return columns + self._capacity * self.dim * 4
+
+
+    def is_idle(self) -> bool:
+        return not self.lock.locked() and (self.build_task is None or self.build_task.done())
+
+
+    def add(self, entries: list[DatabaseEntry]) -> None:
+        '''Rows of ids which are already stored are replaced'''
+        if not len(entries): return
+        vectors: np.ndarray = np.asarray([entry.embedding for entry in entries], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of {self.dim} dimensions, got {vectors.shape[1]}")
+        self._reserve(len(entries))
+        start: int = self.count
+        self._vectors[start:start + len(entries)] = vectors   # type: ignore
+        self._vectors.flush()                                   # type: ignore
+        self._set_rows(start, vectors)
+
+        rows: list[list] = [entry.message.object_to_list() for entry in entries]
+        self._mask([row[0] for row in rows])
+        self._journal.append([["add", rows]])
+        self._append_messages(rows)
+        self._alive[[self._rows[row[0]] for row in rows]] = True     # An id given twice keeps its last row
+        self.count += len(entries)
+        self.dead = self.count - len(self._rows)
+
+
+    def remove(self, ids: list[int]) -> int:
+        '''Returns the amount of rows removed'''
+        removed: int = self._mask(ids)
+        if removed: self._journal.append([["remove", ids]])
+        self.dead += removed
+        return removed
+
+
+    def needs_compaction(self) -> bool:
+        return self.dead >= _COMPACT_MIN_DEAD and self.dead * 2 >= self.count
+
+
+    def compact(self) -> None:
+        '''Copies the live rows into a new vector file, drops the index as the rows move'''
+        live: np.ndarray = np.flatnonzero(self._alive[:self.count])
+        old_path: str = self._vector_path(self.generation)
+        old_vectors: np.memmap = self._vectors      # type: ignore
+        capacity: int = max(_MIN_CAPACITY, len(live))
+        vectors = np.memmap(self._vector_path(self.generation + 1), dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        for start in range(0, len(live), _SEARCH_CHUNK_ROWS):
+            rows: np.ndarray = live[start:start + _SEARCH_CHUNK_ROWS]
+            vectors[start:start + len(rows)] = old_vectors[rows]
+        vectors.flush()
+
+        messages: list[Message] = [self._messages[row] for row in live]
+        self._journal.compact([["snapshot", self.generation + 1, [message.object_to_list() for message in messages]]])
+        self.generation += 1
+        self._vectors = vectors
+        self._capacity = capacity
+        self._messages = messages
+        self._rows = {message.id: row for row, message in enumerate(messages)}
+        self._norms = grow(self._norms[live], capacity)
+        if self._codes is not None:
+            self._codes  = grow(self._codes [live], capacity)
+            self._scales = grow(self._scales[live], capacity)   # type: ignore
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[:len(live)] = True
+        self.count = len(live)
+        self.dead = 0
+        self.index = None
+        del old_vectors
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass    # Still mapped by a search or index build, removed on the next load
+
+
+    def needs_index(self, min_rows: int) -> bool:
+        if self.count < min_rows: return False
+        if self.index is None: return True
+        return self.index.nlist != choose_nlist(self.count) or self.count - self.index.rows > self.index.rows // 4
+
+
+    def build_index(self) -> tuple[int, IVFIndex]:
+        '''Trains an index over the current rows. Returns the generation it was built for along with the index'''
+        generation: int = self.generation
+        vectors: np.ndarray = self._vectors[:self.count]     # type: ignore
+        return generation, IVFIndex.train(vectors, choose_nlist(self.count))
+
+
+    def _distances(self, queries: np.ndarray, rows: slice | np.ndarray) -> np.ndarray:
+        '''First pass distances of the queries to the given rows, from the quantized copy if there is one'''
+        if self._codes is None: return squared_distances(queries, self._vectors[rows], self._norms[rows])   # type: ignore
+        return squared_distances(queries, self._codes[rows], self._norms[rows], self._scales[rows])      # type: ignore
+
+
+    def _closest(self, query: np.ndarray, distances: np.ndarray, rows: np.ndarray, limit: int) -> list[SearchHit]:
+        '''Hits of the closest first pass candidates. Quantized candidates are re-ranked with their float32 vectors'''
+        finite: np.ndarray = np.isfinite(distances)
+        distances, rows = distances[finite], rows[finite]
+        if self._codes is not None:
+            rows = np.sort(rows)    # Reads the vector file front to back
+            distances = squared_distances(query[None, :], self._vectors[rows], self._norms[rows])[0]   # type: ignore
+        return self._hits(*top_k(distances, rows, limit))
+
+
+    def search(self, queries: np.ndarray, limit: int, nprobe: int) -> list[list[SearchHit]]:
+        '''Uses the index if there is one, rows added after it was built are always scanned'''
+        fetch: int = limit * self.rerank if self._codes is not None else limit
+        alive: np.ndarray = self._alive[:self.count]
+        hits : list[list[SearchHit]] = []
+        if self.index is not None:
+            tail: np.ndarray = np.arange(self.index.rows, self.count)
+            for query in queries:
+                rows: np.ndarray = np.concatenate([self.index.candidates(query, nprobe), tail])
+                rows = rows[alive[rows]]
+                hits.append(self._closest(query, *top_k(self._distances(query[None, :], rows)[0], rows, fetch), limit))
+            return hits
+
+        step: int = _SEARCH_CHUNK_ROWS if self._codes is None else _DECODE_CHUNK_ROWS
+        best: list[tuple[list[np.ndarray], list[np.ndarray]]] = [([], []) for _ in queries]
+        for start in range(0, self.count, step):
+            end: int = min(start + step, self.count)
+            distances: np.ndarray = self._distances(queries, slice(start, end))
+            distances[:, ~alive[start:end]] = np.inf
+            for query, query_distances in enumerate(distances):
+                chunk_distances, chunk_rows = top_k(query_distances, np.arange(start, end), fetch)
+                best[query][0].append(chunk_distances)
+                best[query][1].append(chunk_rows)
+        for query, (distances_list, rows_list) in zip(queries, best):
+            if not len(rows_list):
+                hits.append([])
+                continue
+            hits.append(self._closest(query, *top_k(np.concatenate(distances_list), np.concatenate(rows_list), fetch), limit))
+        return hits
+
+
+    def _hits(self, distances: np.ndarray, rows: np.ndarray) -> list[SearchHit]:
+        return [SearchHit(self._messages[row], float(distance)) for distance, row in zip(distances, rows)]
+
+
+    def close(self) -> None:
+        if self._vectors is not None: self._vectors.flush()
+        self._vectors = None
+
+
+
+class LocalVectorStore(VectorStoreInterface):
+    '''
+    Vector store running inside the bot's process, a drop-in replacement for MilvusConnection which needs no server.
+    Every channel is a LocalPartition, searched exhaustively with matrix multiplications. Channels with at least
+    index_min_rows rows get an IVF index, built in the background while searches keep scanning every row.
+    '''
+    directory      : str
+    dim            : int
+    quantization   : Quantization
+    rerank         : int
+    max_open       : int
+    index_min_rows : int
+    nprobe         : int
+    stats          : LocalStoreStats
+
+    def __init__(self, directory: str, dim: int=_DIM, quantization: Quantization=Quantization.NONE, rerank: int=_RERANK_FACTOR,
+                 max_open: int=_OPEN_PARTITIONS, index_min_rows: int=_INDEX_MIN_ROWS, nprobe: int=_INDEX_NPROBE) -> None:
+        if max_open <= 0:
+            raise ValueError("Capacity cannot be less than 1")
+        if rerank <= 0:
+            raise ValueError("Re-rank factor cannot be less than 1")
+        self.directory = directory
+        self.dim = dim
+        self.quantization = quantization
+        self.rerank = rerank
+        self.max_open = max_open
+        self.index_min_rows = index_min_rows
+        self.nprobe = nprobe
+        self.stats = LocalStoreStats()
+        self._partitions: OrderedDict[str, LocalPartition] = OrderedDict()   # Least recently used first
+        os.makedirs(directory, exist_ok=True)
+
+
+    def _partition_directory(self, channel_id: int) -> str:
+        return os.path.join(self.directory, MilvusConnection.get_partion_name(channel_id))
+
+
+    async def _get_partition(self, channel_id: int) -> LocalPartition:
+        name: str = MilvusConnection.get_partion_name(channel_id)
+        if name in self._partitions:
+            self._partitions.move_to_end(name)
+            return self._partitions[name]
+        partition: LocalPartition = await asyncio.get_event_loop().run_in_executor(None, LocalPartition, self._partition_directory(channel_id), self.dim, self.quantization, self.rerank)
+        if name in self._partitions:    # Opened by someone else meanwhile
+            return self._partitions[name]
+        self._partitions[name] = partition
+        for other in list(self._partitions.keys()):
+            if len(self._partitions) <= self.max_open: break
+            if other != name and self._partitions[other].is_idle():
+                self._partitions.pop(other).close()
+                self.stats.closes += 1
+        return partition
+
+
+    def resident_bytes(self) -> int:
+        return sum(partition.resident_bytes() for partition in self._partitions.values())
+
+
+    def has_channel(self, channel_id: int) -> bool:
+        return os.path.isdir(self._partition_directory(channel_id))
+
+
+    async def create_channel_memory_if_new(self, channel_id: int, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Returns True if channel was created, False if channel wasn't created because it already exists'''
+        if self.has_channel(channel_id): return False
+        os.makedirs(self._partition_directory(channel_id))
+        log.log(LogType.INFO, f"Channel created\nid: {channel_id}")
+        return True
+
+
+    async def remove_channel_memory_if_exists(self, channel_id: int, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Returns True if channel was removed, False if channel wasn't removed because it doesn't exist'''
+        if not self.has_channel(channel_id): return False
+        partition: LocalPartition | None = self._partitions.pop(MilvusConnection.get_partion_name(channel_id), None)
+        if partition is not None:
+            async with partition.lock:
+                if partition.build_task is not None: partition.build_task.cancel()
+                partition.close()
+        shutil.rmtree(self._partition_directory(channel_id), ignore_errors=True)
+        log.log(LogType.INFO, f"Channel removed\nid: {channel_id}")
+        return True
+
+
+    async def add_entries(self, channel_id: int, entries: list[DatabaseEntry], log: LogHanglerInterface=LogNothing()) -> bool:
+        """Returns True if entries were succesfully added, False if error occurred while inserting"""
+        if not len(entries): return True
+        await self.create_channel_memory_if_new(channel_id, log=log.sub())
+        partition: LocalPartition = await self._get_partition(channel_id)
+        try:
+            async with partition.lock:
+                await asyncio.get_event_loop().run_in_executor(None, partition.add, entries)
+        except (OSError, ValueError) as e:
+            log.log(LogType.ERROR, f"Failed to insert messages into {self.directory}!\namount: {len(entries)}\nfirst message: {entries[0].message}\nerror: {e}")
+            return False
+        log.log(LogType.DEBUG, f"Insert success!\nrows: {len(partition)}")
+        return True
+
+
+    async def remove_entries(self, channel_id: int, entry_ids: list[int], log: LogHanglerInterface=LogNothing()) -> bool:
+        """Returns True if entries were succesfully removed, False if channel doesn't exist or error occurred while deleting"""
+        if not self.has_channel(channel_id): return False
+        partition: LocalPartition = await self._get_partition(channel_id)
+        try:
+            async with partition.lock:
+                partition.remove(entry_ids)
+                if partition.needs_compaction():
+                    await asyncio.get_event_loop().run_in_executor(None, partition.compact)
+                    self.stats.compactions += 1
+        except OSError as e:
+            log.log(LogType.ERROR, f"Failed to remove messages from {self.directory}!\namount: {len(entry_ids)}\nfirst message id: {entry_ids[0]}\nerror: {e}")
+            return False
+        return True
+
+
+    def _start_build(self, partition: LocalPartition, log: LogHanglerInterface=LogNothing()) -> None:
+        if partition.build_task is None or partition.build_task.done():
+            partition.build_task = asyncio.get_event_loop().create_task(self._build(partition, log=log))
+
+
+    async def _build(self, partition: LocalPartition, log: LogHanglerInterface=LogNothing()) -> bool:
+        try:
+            generation, index = await asyncio.get_event_loop().run_in_executor(None, partition.build_index)
+        except Exception as e:
+            log.log(LogType.ERROR, f"Failed to build index!\npartition: {partition.directory}\nerror: {e}")
+            return False
+        if generation != partition.generation: return False     # Compacted meanwhile, the rows have moved
+        partition.index = index
+        self.stats.builds += 1
+        log.log(LogType.INFO, f"Index built\npartition: {partition.directory}\nrows : {index.rows}\nnlist: {index.nlist}")
+        return True
+
+
+    async def create_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        """Builds the indexes of open partitions which need one now. Returns True if succesful, False if error occurred"""
+        results: list[bool] = [await self._build(partition, log=log) for partition in list(self._partitions.values()) if partition.needs_index(self.index_min_rows)]
+        return all(results)
+
+
+    async def ensure_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        """Partitions are indexed once they're searched, nothing has to be created up front"""
+        return True
+
+
+    async def search_hits(self,
+                          channel_id : int,
+                          vectors : list[list[float]] | None = None, expr : str | None = None,
+                          limit : int = 10,
+                          log: LogHanglerInterface=LogNothing()) -> Result[list[list[SearchHit]]]:
+        '''Searches every vector in one call. Returns the hits of each vector, closest first'''
+        if expr is not None:
+            return Result.err(ValueError("Filter expressions aren't supported by the local vector store"))
+        if not vectors: return Result.ok([])
+        if not self.has_channel(channel_id): return Result.ok([[] for _ in vectors])
+
+        queries: np.ndarray = np.asarray(vectors, dtype=np.float32)
+        partition: LocalPartition = await self._get_partition(channel_id)
+        async with partition.lock:
+            if partition.needs_index(self.index_min_rows): self._start_build(partition, log=log.sub())
+            if partition.index is not None: self.stats.indexed_searches += 1
+            else                          : self.stats.exact_searches += 1
+            hits: list[list[SearchHit]] = await asyncio.get_event_loop().run_in_executor(None, partition.search, queries, limit, self.nprobe)
+        log.log(LogType.DEBUG, "Search success!")
+        return Result.ok(hits)
+
+
+    async def close(self) -> None:
+        for partition in self._partitions.values():
+            if partition.build_task is not None: partition.build_task.cancel()
+            partition.close()
+        self._partitions.clear()
+
+
+
+# MODULE INTERFACE
+
+_STORES: dict[str, LocalVectorStore] = {}
+
+
+def create_local_store(collectionType: CollectionType) -> LocalVectorStore:
+    if collectionType.value not in _STORES:
+        _STORES[collectionType.value] = LocalVectorStore(os.path.join(LOCAL_VECTOR_DIRECTORY, collectionType.value), quantization=QUANTIZATION[collectionType])
+    return _STORES[collectionType.value]
+
+
+async def DROP_ALL_LOCAL_MEMORY(collectionType: CollectionType) -> None:
+    store: LocalVectorStore | None = _STORES.pop(collectionType.value, None)
+    if store is not None: await store.close()
+    shutil.rmtree(os.path.join(LOCAL_VECTOR_DIRECTORY, collectionType.value), ignore_errors=True)
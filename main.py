@@ -21,11 +21,11 @@ from interface import ConversationInterface
 from structure import Message
 from utility import create_json_file_if_not_exist
 from conversation import ComplexMemoryConversation
-from memory import VirtualComplexMemory
+from memory import VirtualComplexMemory, VECTOR_BACKEND, VectorBackend
 from vector_database import connect_to_database, disconnect_from_database, CollectionType
 from delay import NaturalDelay
 
-import app, configuration, bot
+import app, configuration, bot, ai
 from app import TerminalText
 from debug import LogHanglerInterface, LogStdcout, LogType, LogJsonFile
 from prompt import DefaultTextModel
@@ -196,7 +196,7 @@ async def handle_input(text):
                 # START CONVERSATION
                 VIRTUAL_CONVERSATION = ComplexMemoryConversation(
                     id,
-                    await VirtualComplexMemory.create(id, 1500, CollectionType.MAIN, LogJsonFile(LogType.DEBUG, "addMemory_VIRTUAL")),
+                    await VirtualComplexMemory.create(id, 1500, CollectionType.MAIN, log=LogJsonFile(LogType.DEBUG, "addMemory_VIRTUAL")),
                     NaturalDelay(),
                     log=LogJsonFile(LogType.DEBUG, "initializeVIRTUAL")
                     )
@@ -275,38 +275,42 @@ def accept(buff):
 
 
 input_given = None
+input_event = asyncio.Event()
 
 def _accept(buff):
     pass
 
 
-def accept_private_userName(buff):
+def give_input(value) -> None:
     global input_given
+    input_given = value
+    input_event.set()
+
+
+def accept_private_userName(buff):
     text = buff.text.strip()
     if len(text) < 1:
         log_terminal.append("Invalid username", "error")
         return
     input_field.accept_handler = accept    # type: ignore
-    input_given = text
+    give_input(text)
 
 def accept_private_userId(buff):
-    global input_given
     text = buff.text.strip()
     try:
         id = int(text)
         input_field.accept_handler = accept    # type: ignore
-        input_given = id
+        give_input(id)
     except ValueError as e:
         log_terminal.append("Invalid user id", "error")
 
 def accept_private_token(buff):
-    global input_given
     text = buff.text.strip()
     if len(text) < 1:
         log_terminal.append("Invalid token", "error")
         return
     input_field.accept_handler = accept    # type: ignore
-    input_given = text
+    give_input(text)
 
 input_field.accept_handler = accept         # type: ignore
 
@@ -314,9 +318,9 @@ input_field.accept_handler = accept         # type: ignore
 async def wait_for_input() -> str:
     global input_given
     input_given = None
-    while input_given is None:
-        await asyncio.sleep(0.5)
-    return input_given
+    input_event.clear()
+    await input_event.wait()
+    return input_given      # type: ignore
 
 
 async def start_logging_terminal():
@@ -373,10 +377,13 @@ async def setup() -> bool:
 
     # Setup vector database
     text_terminal.write(3, "[-] Connecting to vector database...", "focus")
-    if not (await allocator.allocate(connect_to_database, disconnect_from_database)).success:
-        text_terminal.write(3, "[!] Failed to connect to vector database!", "error")
-        return False
-    text_terminal.write(3, "[#] Connected to vector database!", "ok")
+    if VECTOR_BACKEND == VectorBackend.MILVUS:
+        if not (await allocator.allocate(connect_to_database, disconnect_from_database)).success:
+            text_terminal.write(3, "[!] Failed to connect to vector database!", "error")
+            return False
+        text_terminal.write(3, "[#] Connected to vector database!", "ok")
+    else:
+        text_terminal.write(3, "[#] Using local vector database!", "ok")
 
     # Setup logging terminal
     text_terminal.write(4, "[-] Seting up logging terminal...", "focus")
@@ -399,6 +406,7 @@ async def setup() -> bool:
 async def cleanup():
     global EXIT
     await allocator.deallocate()
+    await ai.close()
     input_prompt.text = FormattedText([('class:error', "EXIT > ")])
     EXIT = True
 
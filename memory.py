@@ -1,43 +1,75 @@
 # External modules
-import json, os, random, asyncio
+import json, os, random, asyncio, bisect
+from array import array
 from dataclasses import dataclass
+from typing import Callable
 from io import TextIOWrapper
 from datetime import datetime, timedelta
+from enum import Enum
 
 # Internal modules
 import prompt, ai, threading
 
 # Protocols
-from interface import MemoryInterface
-from structure import Message, DatabaseEntry, ShortTermMemory
-from utility import Result, create_json_file_if_not_exist
+from interface import MemoryInterface, VectorStoreInterface
+from structure import Message, DatabaseEntry, ShortTermMemory, SearchHit, MessageStore
+from utility import Result
+from storage import AppendOnlyLog
 
 # Impementations
 import vector_database
 from vector_database import MilvusConnection, create_connection_to_collection, CollectionType
+from local_vector_database import create_local_store
 
 from debug import LogHanglerInterface, LogNothing, LogType
 
 
+_TOKEN_CACHE_ENTRY_BYTES: int = 250    # Rough size of one token cache entry, for memory accounting
+
+
+class VectorBackend(Enum):
+    MILVUS = "milvus"       # Milvus server on localhost
+    LOCAL  = "local"        # In-process NumPy store, see local_vector_database
+
+VECTOR_BACKEND: VectorBackend = VectorBackend(os.environ.get("VECTOR_BACKEND", VectorBackend.MILVUS.value))
+
+
+async def create_vector_store(collectionType: CollectionType, backend: VectorBackend=VECTOR_BACKEND) -> VectorStoreInterface:
+    if backend == VectorBackend.LOCAL: return create_local_store(collectionType)
+    return await create_connection_to_collection(collectionType)
+
+
+
+def merge_search_hits(hits: list[list[SearchHit]], limit: int) -> list[SearchHit]:
+    '''Merges the hits of several query vectors. A message found by several vectors keeps its closest distance'''
+    best: dict[int, SearchHit] = {}
+    for query_hits in hits:
+        for hit in query_hits:
+            if hit.message.id not in best or hit.distance < best[hit.message.id].distance:
+                best[hit.message.id] = hit
+    return sorted(best.values(), key=lambda hit : hit.distance)[:limit]
+
+
 
 class MemoryMilvus():
-    connection: MilvusConnection
+    '''Long-term memory of a channel, in Milvus or in the local vector store depending on the backend'''
+    connection: VectorStoreInterface
     channel_id: int
 
     @staticmethod
-    async def create(channel_id: int, collectionType: CollectionType, log: LogHanglerInterface=LogNothing()) -> 'MemoryMilvus':
-        connection = await create_connection_to_collection(collectionType)
+    async def create(channel_id: int, collectionType: CollectionType, backend: VectorBackend=VECTOR_BACKEND, log: LogHanglerInterface=LogNothing()) -> 'MemoryMilvus':
+        connection: VectorStoreInterface = await create_vector_store(collectionType, backend)
         obj: MemoryMilvus = MemoryMilvus(channel_id, connection, log=log)
         await connection.create_channel_memory_if_new(channel_id, log=log.sub())
-        await connection.create_index(log=log.sub())
+        await connection.ensure_index(log=log.sub())
         log.log(LogType.DEBUG, (f"Created MemoryMilvus object:\n"
                                 f"id: {channel_id}\n"
                                 f"collection type: {collectionType.value}\n"
-                                f"collection info: {connection._collection_info}"))
+                                f"backend: {backend.value}"))
         return obj
 
 
-    def __init__(self, channel_id: int, connection: vector_database.MilvusConnection, log: LogHanglerInterface=LogNothing()) -> None:
+    def __init__(self, channel_id: int, connection: VectorStoreInterface, log: LogHanglerInterface=LogNothing()) -> None:
         self.connection = connection
         self.channel_id = channel_id
 
@@ -45,16 +77,20 @@ class MemoryMilvus():
     async def add_messages(self, messages: list[Message], embeddings: list[list[float]], log: LogHanglerInterface=LogNothing()) -> None:
         entries: list[DatabaseEntry] = [DatabaseEntry(entryInfo[0], entryInfo[1]) for entryInfo in zip(messages, embeddings)]
         await self.connection.add_entries(self.channel_id, entries, log=log.sub())
-        await self.connection.create_index(log=log.sub())
         
 
     async def remove_messages(self, message_ids: list[int], log: LogHanglerInterface=LogNothing()) -> None:
         await self.connection.remove_entries(self.channel_id, message_ids, log=log.sub())
-        await self.connection.create_index(log=log.sub())
 
 
     async def search(self, embedding: list[float], log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
         return (await self.connection.search(self.channel_id, [embedding], log=log.sub())).map(lambda r : r[0])
+
+
+    async def search_many(self, embeddings: list[list[float]], limit: int=10, log: LogHanglerInterface=LogNothing()) -> Result[list[SearchHit]]:
+        '''Searches all embeddings in a single call. Returns the merged hits, closest first'''
+        if not len(embeddings): return Result.ok([])
+        return (await self.connection.search_hits(self.channel_id, embeddings, limit=limit, log=log.sub())).map(lambda r : merge_search_hits(r, limit))
      
 
     async def clear(self, log: LogHanglerInterface=LogNothing()) -> None:
@@ -64,37 +100,80 @@ class MemoryMilvus():
 
     
 class MemoryJson():
+    '''
+    Message memory stored as an append-only log (channel-memory/<id>.jsonl) of JSON records:
+        ["snapshot", <ShortTermMemory json>]
+        ["add"     , <tokens after>, [<message>, ...]]
+        ["remove"  , <amount of oldest messages>, <tokens after>]
+    The log is compacted into a single snapshot once most of its messages have been removed.
+    '''
     channel_id: int
     file_path : str
+    log_file  : AppendOnlyLog
     memory    : ShortTermMemory
     textModel : prompt.DefaultTextModel
+    dead_messages: int                  # Messages in the log file which are no longer in memory
+    loaded    : bool                    # The log is only read on first use
+
+    COMPACT_MIN_DEAD_MESSAGES: int = 64
 
     @staticmethod
     def get_memory_file_path(channel_id: int, extra_identifier: str="") -> str:
+        return f"channel-memory/{extra_identifier+'_' if len(extra_identifier) else ''}{channel_id}.jsonl"
+
+
+    @staticmethod
+    def get_legacy_memory_file_path(channel_id: int, extra_identifier: str="") -> str:
         return f"channel-memory/{extra_identifier+'_' if len(extra_identifier) else ''}{channel_id}.json"
 
 
+    @staticmethod
+    def migrate_legacy_memory_if_exists(channel_id: int, extra_identifier: str="", log: LogHanglerInterface=LogNothing()) -> bool:
+        '''
+        Converts channel-memory/<id>.json (whole memory rewritten on every save) into the append-only log format.
+        The old file is kept as <id>.json.bak. Returns True if a file was migrated.
+        '''
+        legacy_path: str = MemoryJson.get_legacy_memory_file_path(channel_id, extra_identifier)
+        log_file: AppendOnlyLog = AppendOnlyLog(MemoryJson.get_memory_file_path(channel_id, extra_identifier))
+        if log_file.exists() or not os.path.isfile(legacy_path): return False
+
+        memory: ShortTermMemory = ShortTermMemory()
+        if os.path.getsize(legacy_path) != 0:
+            with open(legacy_path, encoding="utf-8") as file:
+                memory.from_json(json.load(file))
+        log_file.compact([["snapshot", memory.to_json()]])
+        os.replace(legacy_path, legacy_path + ".bak")
+        log.log(LogType.INFO, f"Migrated {legacy_path} to {log_file.file_path}\nmessages: {len(memory.messages)}")
+        return True
+
+
     @staticmethod
     def create_channel_memory_if_new(channel_id, extra_identifier, log: LogHanglerInterface=LogNothing()) -> bool:
         '''Returns True if channel was created, False if channel wasn't created because it already exists'''
-        file_path: str = MemoryJson.get_memory_file_path(channel_id, extra_identifier)
-        return create_json_file_if_not_exist(file_path, ShortTermMemory().to_json())
+        if MemoryJson.migrate_legacy_memory_if_exists(channel_id, extra_identifier, log=log): return False
+        log_file: AppendOnlyLog = AppendOnlyLog(MemoryJson.get_memory_file_path(channel_id, extra_identifier))
+        if log_file.exists(): return False
+        log_file.compact([["snapshot", ShortTermMemory().to_json()]])
+        return True
     
 
     @staticmethod
     def remove_channel_memory_if_exists(channel_id: int, extra_identifier: str="", log: LogHanglerInterface=LogNothing()) -> bool:
         '''Returns True if channel was removed, False if channel wasn't removed because it doesn't exist'''
-        if os.path.isfile(MemoryJson.get_memory_file_path(channel_id, extra_identifier)):
-            os.remove(MemoryJson.get_memory_file_path(channel_id, extra_identifier))
-            log.log(LogType.INFO, f"Channel removed\nid: {channel_id}")
-            return True
-        return False
+        legacy_path: str = MemoryJson.get_legacy_memory_file_path(channel_id, extra_identifier)
+        removed: bool = AppendOnlyLog(MemoryJson.get_memory_file_path(channel_id, extra_identifier)).remove()
+        if os.path.isfile(legacy_path):
+            os.remove(legacy_path)
+            removed = True
+        if removed: log.log(LogType.INFO, f"Channel removed\nid: {channel_id}")
+        return removed
     
 
     @staticmethod
-    async def create(channel_id: int, extra_identifier: str="", log: LogHanglerInterface=LogNothing()) -> 'MemoryJson':
+    async def create(channel_id: int, extra_identifier: str="", load: bool=True, log: LogHanglerInterface=LogNothing()) -> 'MemoryJson':
         obj: MemoryJson = MemoryJson(channel_id, extra_identifier, log=log)
-        MemoryJson.create_channel_memory_if_new(channel_id, extra_identifier)
+        MemoryJson.create_channel_memory_if_new(channel_id, extra_identifier, log=log.sub())
+        if not load: return obj
         await obj._load_memory()
         log.log(LogType.DEBUG, (f"Created MemoryJson object:\n"
                                 f"id           : {channel_id}\n"
@@ -107,61 +186,207 @@ class MemoryJson():
     def __init__(self, channel_id: int, extra_identifier: str="", log: LogHanglerInterface=LogNothing()) -> None:
         self.channel_id = channel_id
         self.file_path = MemoryJson.get_memory_file_path(channel_id, extra_identifier)
+        self.log_file = AppendOnlyLog(self.file_path)
         self.memory = ShortTermMemory()
-        self.textModel = prompt.DefaultTextModel()
+        self.textModel = prompt.DefaultTextModel(self.memory.token_cache)
+        self.dead_messages = 0
+        self.loaded = False
 
 
-    async def _load_memory(self):  
-        with open(self.file_path, encoding="utf-8") as file:
-            self.memory.from_json(json.load(file))
+    async def _ensure_loaded(self):
+        if not self.loaded: await self._load_memory()
+
+
+    async def _load_memory(self):
+        # Replay the log
+        logged_messages: int = 0
+        for record in self.log_file.read():
+            if record[0] == "snapshot":
+                self.memory.from_json(record[1])
+                logged_messages = len(self.memory.messages)
+            elif record[0] == "add":
+                self.memory.messages.extend_lists(record[2])
+                self.memory.tokens = record[1]
+                logged_messages += len(record[2])
+            elif record[0] == "remove":
+                self.memory.messages.remove_oldest(record[1])
+                self.memory.tokens = record[2]
+        self.dead_messages = logged_messages - len(self.memory.messages)
+        self.loaded = True
+        await self._compact_if_needed()
+
+
+    async def _compact_if_needed(self):
+        if self.dead_messages > max(len(self.memory.messages), self.COMPACT_MIN_DEAD_MESSAGES):
+            await self._save_memory()
 
 
     async def _save_memory(self):
-        with open(self.file_path, 'w', encoding="utf-8") as file:
-            json.dump(self.memory.to_json(), file, ensure_ascii=False)
+        '''Compacts the log into a single snapshot of the current memory'''
+        self.log_file.compact([["snapshot", self.memory.to_json()]])
+        self.dead_messages = 0
 
 
     async def add_messages(self, messages: list[Message], log: LogHanglerInterface=LogNothing()) -> None:
+        await self._ensure_loaded()
         before: int = len(self.memory.messages)
+        prev_message: Message | None = self.memory.messages[-1] if before else None
+        await self.textModel.cache_tokens(messages, prev_message)
         for message in messages:
-            self.memory.tokens += await self.textModel._tokens_from_message(self.memory.messages[0] if len(self.memory.messages) else None, message)
+            self.memory.tokens += await self.textModel._tokens_from_message(prev_message, message)
             self.memory.messages.append(message)
+            prev_message = message
         log.log(LogType.INFO, f"Added {len(self.memory.messages) - before} message(s) to {self.file_path}")
-        await self._save_memory()
+        if len(messages): self.log_file.append([["add", self.memory.tokens, [message.object_to_list() for message in messages]]])
         
 
     async def remove_oldest_messages(self, amount: int, log: LogHanglerInterface=LogNothing()) -> None:
+        await self._ensure_loaded()
         before: int = len(self.memory.messages)
         # Remove messages
-        self.memory.messages = self.memory.messages[amount:]
-        self.memory.tokens = (await self.textModel._process_messages(self.memory.messages)).tokens
+        self.textModel.forget_messages(self.memory.messages[:amount])
+        self.memory.messages.remove_oldest(amount)
+        self.memory.tokens = (await self.textModel.tokens_from_messages(self.memory.messages))["total"]
         log.log(LogType.INFO, f"Removed {before - len(self.memory.messages)} oldests message(s) from {self.file_path}")
-        await self._save_memory()
+        if before == len(self.memory.messages): return
+        self.log_file.append([["remove", before - len(self.memory.messages), self.memory.tokens]])
+        self.dead_messages += before - len(self.memory.messages)
+        await self._compact_if_needed()
 
 
     async def get(self, log: LogHanglerInterface=LogNothing()) -> ShortTermMemory:
+        await self._ensure_loaded()
         return self.memory
 
 
+    def resident_bytes(self) -> int:
+        return self.memory.messages.nbytes() + len(self.memory.token_cache) * _TOKEN_CACHE_ENTRY_BYTES
+
+
     async def clear(self, log: LogHanglerInterface=LogNothing())	-> None:
-        self.memory = ShortTermMemory()
+        self.textModel.token_cache.clear()
+        self.memory = ShortTermMemory(token_cache=self.textModel.token_cache)
+        self.loaded = True
         await self._save_memory()
 
 
 
+class MessageArchive():
+    '''
+    Every message moved to long-term memory, appended to channel-memory/ltm_<id>.jsonl with the same records as 
+    MemoryJson (token counts aren't kept). The archive is only read into memory once messages are looked up in it,
+    and can be unloaded again (see ChannelManager) until the next lookup.
+    '''
+    EXTRA_IDENTIFIER: str = "ltm"
+
+    channel_id: int
+    file_path : str
+    log_file  : AppendOnlyLog
+    messages  : MessageStore | None     # None until loaded
+    _sorted_ids : array | None          # Message ids in order without duplicates, built on the first lookup
+    _sorted_rows: array | None          # Index of each of those messages in the store
+    on_load   : Callable[[], None]      # Called after the archive is read into memory
+
+    @staticmethod
+    async def create(channel_id: int, log: LogHanglerInterface=LogNothing()) -> 'MessageArchive':
+        MemoryJson.create_channel_memory_if_new(channel_id, MessageArchive.EXTRA_IDENTIFIER, log=log.sub())
+        return MessageArchive(channel_id)
+
+
+    def __init__(self, channel_id: int) -> None:
+        self.channel_id = channel_id
+        self.file_path = MemoryJson.get_memory_file_path(channel_id, MessageArchive.EXTRA_IDENTIFIER)
+        self.log_file = AppendOnlyLog(self.file_path)
+        self.messages = None
+        self._sorted_ids = self._sorted_rows = None
+        self.on_load = lambda: None
+
+
+    def _load(self) -> MessageStore:
+        if self.messages is not None: return self.messages
+        messages: MessageStore = MessageStore()
+        for record in self.log_file.read():
+            if   record[0] == "snapshot": messages = MessageStore.from_lists(record[1]["messages"])
+            elif record[0] == "add"     : messages.extend_lists(record[2])
+            elif record[0] == "remove"  : messages.remove_oldest(record[1])
+        self.messages = messages
+        self.on_load()      # Could unload the archive again, the caller still gets its messages
+        return messages
+
+
+    def unload(self) -> None:
+        self.messages = None
+        self._sorted_ids = self._sorted_rows = None
+
+
+    def resident_bytes(self) -> int:
+        return self.messages.nbytes() if self.messages is not None else 0
+
+
+    async def add_messages(self, messages: list[Message], skip_archived: bool=False, log: LogHanglerInterface=LogNothing()) -> None:
+        '''With skip_archived, messages which are already archived aren't appended again (this reads the archive in)'''
+        if skip_archived: messages = [message for message in messages if not self.is_archived(message.id)]
+        if not len(messages): return
+        self.log_file.append([["add", 0, [message.object_to_list() for message in messages]]])
+        log.log(LogType.INFO, f"Added {len(messages)} message(s) to {self.file_path}")
+        if self.messages is None: return
+
+        # Newer messages keep the lookup order, anything else (backfilled history) rebuilds it on the next lookup
+        before: int = len(self.messages)
+        self.messages.extend(messages)
+        if self._sorted_ids is not None and self._sorted_rows is not None:
+            for i, message in enumerate(messages):
+                if len(self._sorted_ids) and message.id <= self._sorted_ids[-1]:
+                    self._sorted_ids = self._sorted_rows = None
+                    break
+                self._sorted_ids.append(message.id)
+                self._sorted_rows.append(before + i)
+
+
+    def _index(self) -> tuple[array, array]:
+        messages: MessageStore = self._load()
+        if self._sorted_ids is None or self._sorted_rows is None:
+            unique: dict[int, int] = {messages.id_at(row): row for row in range(len(messages))}
+            self._sorted_ids  = array('q', sorted(unique))
+            self._sorted_rows = array('q', (unique[id] for id in self._sorted_ids))
+        return self._sorted_ids, self._sorted_rows
+
+
+    def is_archived(self, message_id: int) -> bool:
+        sorted_ids, _ = self._index()
+        index: int = bisect.bisect_left(sorted_ids, message_id)
+        return index != len(sorted_ids) and sorted_ids[index] == message_id
+
+
+    def get_messages_around(self, message_id: int, amount: int) -> list[Message]:
+        '''Up to amount messages centered on the given one, oldest first. Empty if the message isn't archived'''
+        sorted_ids, sorted_rows = self._index()
+        messages: MessageStore = self._load()
+        index: int = bisect.bisect_left(sorted_ids, message_id)
+        if index == len(sorted_ids) or sorted_ids[index] != message_id: return []
+        return [messages[row] for row in sorted_rows[max(index - amount // 2, 0):index + amount - amount // 2]]
+
+
+    async def clear(self, log: LogHanglerInterface=LogNothing()) -> None:
+        self.log_file.compact([["snapshot", ShortTermMemory().to_json()]])
+        self.messages = MessageStore()
+        self._sorted_ids = self._sorted_rows = None
+
+
+
 class ComplexMemory(MemoryInterface):
     LTM      : MemoryMilvus
-    LTM_Json : MemoryJson
+    LTM_Json : MessageArchive
     STM      : MemoryJson
     STM_LIMIT: int
     textModel: prompt.DefaultTextModel
 
 
     @staticmethod
-    async def create(channel_id: int, stm_limit: int, collectionType: CollectionType, log: LogHanglerInterface=LogNothing()) -> 'ComplexMemory':
-        LTM     : MemoryMilvus  = await MemoryMilvus.create(channel_id, collectionType, log=log.sub())
-        LTM_Json: MemoryJson    = await MemoryJson  .create(channel_id, "ltm", log=log.sub())
-        STM     : MemoryJson    = await MemoryJson  .create(channel_id, log=log.sub())
+    async def create(channel_id: int, stm_limit: int, collectionType: CollectionType, backend: VectorBackend=VECTOR_BACKEND, log: LogHanglerInterface=LogNothing()) -> 'ComplexMemory':
+        LTM     : MemoryMilvus   = await MemoryMilvus  .create(channel_id, collectionType, backend, log=log.sub())
+        LTM_Json: MessageArchive = await MessageArchive.create(channel_id, log=log.sub())
+        STM     : MemoryJson     = await MemoryJson    .create(channel_id, load=False, log=log.sub())
 
         obj: ComplexMemory = ComplexMemory(channel_id, stm_limit, LTM, LTM_Json, STM, log=log)
         log.log(LogType.DEBUG, (f"Created ComplexMemory object:\n"
@@ -175,8 +400,9 @@ class ComplexMemory(MemoryInterface):
         self.LTM      = LTM
         self.LTM_Json = LTM_Json
         self.STM      = STM
-        self.textModel = prompt.DefaultTextModel()
+        self.textModel = STM.textModel
         super().__init__(channel_id, stm_limit)
+        self.LTM_Json.on_load = lambda: self.on_load()
         
 
 
@@ -188,15 +414,20 @@ class ComplexMemory(MemoryInterface):
         stm: ShortTermMemory = await self.STM.get(log=log.sub())
         messages_to_add_to_ltm: list[Message] = []
         
-        converation: prompt.GeneratedConversation = await self.textModel.conversation_crafter_newest_to_oldest(stm.messages, self.STM_LIMIT)
+        converation: prompt.GeneratedConversation = await self.STM.textModel.conversation_crafter_newest_to_oldest(stm.messages, self.STM_LIMIT)
         messages_to_add_to_ltm = stm.messages[:len(stm.messages) - len(converation.messages)]
         await self.STM.remove_oldest_messages(len(messages_to_add_to_ltm), log=log.sub())
 
         # Add excess STM to LTM
         if len(messages_to_add_to_ltm):
-            await self.LTM_Json.add_messages(messages_to_add_to_ltm, log=log.sub())
             embeddings: list[list[float]] = (await ai.embed_strings([message.content for message in messages_to_add_to_ltm], log=log.sub())).unwrap() #! TODO: Add safety
-            asyncio.create_task(self.LTM.add_messages(messages_to_add_to_ltm, embeddings, log.sub()))
+            await self.add_messages_to_long_term_memory(messages_to_add_to_ltm, embeddings, log=log.sub())
+
+
+    async def add_messages_to_long_term_memory(self, messages: list[Message], embeddings: list[list[float]], skip_archived: bool=False, log: LogHanglerInterface=LogNothing()) -> None:
+        '''Archives already embedded messages, without going through short-term memory. See MessageArchive.add_messages for skip_archived'''
+        await self.LTM_Json.add_messages(messages, skip_archived=skip_archived, log=log.sub())
+        await self.LTM.add_messages(messages, embeddings, log=log.sub())
     
     
     async def remove_messages(self, message_ids: list[int], log: LogHanglerInterface=LogNothing()) -> None:
@@ -211,8 +442,32 @@ class ComplexMemory(MemoryInterface):
         return await self.LTM.search(embedding, log=log.sub())
 
 
+    async def search_long_term_memory_batch(self, texts: list[str], log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
+        return (await self.search_long_term_memory_hits(texts, log=log)).map(lambda hits : [hit.message for hit in hits])
+
+
+    async def search_long_term_memory_hits(self, texts: list[str], limit: int=10, log: LogHanglerInterface=LogNothing()) -> Result[list[SearchHit]]:
+        embeddings: Result[list[list[float]]] = await ai.embed_strings(texts, log=log.sub())
+        if not embeddings.is_valid(): return Result.err(embeddings.error)   # type: ignore
+        return await self.LTM.search_many(embeddings.unwrap(), limit=limit, log=log.sub())
+
+
     async def get_short_term_memory(self, log: LogHanglerInterface=LogNothing()) -> list[Message]:
-        return (await self.STM.get(log=log.sub())).messages
+        return list((await self.STM.get(log=log.sub())).messages)
+
+
+    async def get_messages_around(self, message_id: int, amount: int, log: LogHanglerInterface=LogNothing()) -> list[Message]:
+        return self.LTM_Json.get_messages_around(message_id, amount)
+
+
+    def resident_bytes(self) -> int:
+        return self.STM.resident_bytes() + self.LTM_Json.resident_bytes()
+
+
+    def unload(self) -> int:
+        released: int = self.LTM_Json.resident_bytes()
+        self.LTM_Json.unload()
+        return released
 
 
     async def clear_long_term_memory(self, log: LogHanglerInterface=LogNothing()) -> None:
@@ -234,8 +489,8 @@ class VirtualComplexMemory(MemoryInterface):
 
 
     @staticmethod
-    async def create(channel_id: int, stm_limit: int, collectionType: CollectionType, log: LogHanglerInterface=LogNothing()) -> 'VirtualComplexMemory':
-        LTM     : MemoryMilvus  = await MemoryMilvus.create(channel_id, collectionType, log=log.sub())
+    async def create(channel_id: int, stm_limit: int, collectionType: CollectionType, backend: VectorBackend=VECTOR_BACKEND, log: LogHanglerInterface=LogNothing()) -> 'VirtualComplexMemory':
+        LTM     : MemoryMilvus  = await MemoryMilvus.create(channel_id, collectionType, backend, log=log.sub())
         STM     : MemoryJson    = await MemoryJson  .create(channel_id, log=log.sub())
 
         obj: VirtualComplexMemory = VirtualComplexMemory(channel_id, stm_limit, LTM, STM, log=log)
@@ -249,7 +504,7 @@ class VirtualComplexMemory(MemoryInterface):
     def __init__(self, channel_id: int, stm_limit: int, LTM, STM, log: LogHanglerInterface=LogNothing()) -> None:
         self.LTM      = LTM
         self.STM      = STM
-        self.textModel = prompt.DefaultTextModel()
+        self.textModel = STM.textModel
         self.current_messages = []
         super().__init__(channel_id, stm_limit)
         
@@ -272,8 +527,18 @@ class VirtualComplexMemory(MemoryInterface):
         return await self.LTM.search(embedding, log=log.sub())
 
 
+    async def search_long_term_memory_batch(self, texts: list[str], log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
+        return (await self.search_long_term_memory_hits(texts, log=log)).map(lambda hits : [hit.message for hit in hits])
+
+
+    async def search_long_term_memory_hits(self, texts: list[str], limit: int=10, log: LogHanglerInterface=LogNothing()) -> Result[list[SearchHit]]:
+        embeddings: Result[list[list[float]]] = await ai.embed_strings(texts, log=log.sub())
+        if not embeddings.is_valid(): return Result.err(embeddings.error)   # type: ignore
+        return await self.LTM.search_many(embeddings.unwrap(), limit=limit, log=log.sub())
+
+
     async def get_short_term_memory(self, log: LogHanglerInterface=LogNothing()) -> list[Message]:
-        return ((await self.STM.get(log=log.sub())).messages + self.current_messages)
+        return (list((await self.STM.get(log=log.sub())).messages) + self.current_messages)
 
 
     async def clear_long_term_memory(self, log: LogHanglerInterface=LogNothing()) -> None:
@@ -287,6 +552,7 @@ class VirtualComplexMemory(MemoryInterface):
 
 class DebugMemory(MemoryInterface):
     def __init__(self, channel_id: int, stm_limit: int, log: LogHanglerInterface=LogNothing()) -> None:
+        self.textModel = prompt.DefaultTextModel()
         super().__init__(channel_id, stm_limit)
 
 
@@ -302,6 +568,10 @@ class DebugMemory(MemoryInterface):
         return Message.debug_messages(5)
 
 
+    async def search_long_term_memory_batch(self, texts: list[str], log: LogHanglerInterface=LogNothing()) -> Result[list[Message]]:
+        return Result.ok(Message.debug_messages(5))
+
+
     async def get_short_term_memory(self, log: LogHanglerInterface=LogNothing()) -> list[Message]:
         time: datetime = datetime.now()
         messages: list[Message] = []
@@ -0,0 +1,168 @@
+import asyncio, json, random
+import aiohttp
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+
+OPENAI_BASE_URL       : str = "https://api.openai.com/v1"
+OPENAI_MAX_CONNECTIONS: int = 16
+OPENAI_TIMEOUT        : float = 60        # In seconds, for a whole request
+OPENAI_MAX_RETRIES    : int = 4
+OPENAI_BACKOFF        : float = 0.5       # In seconds, doubled after every failed attempt
+OPENAI_MAX_BACKOFF    : float = 20
+OPENAI_CONCURRENCY    : dict[str, int] = {  # Requests in flight at once per endpoint, others use DEFAULT_CONCURRENCY
+    "chat/completions": 8,
+    "embeddings"      : 2,
+}
+DEFAULT_CONCURRENCY   : int = 4
+
+RETRY_STATUSES: set[int] = {408, 409, 429, 500, 502, 503, 504}
+
+
+
+class OpenAIError(Exception):
+    status   : int
+    retryable: bool
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.retryable = status in RETRY_STATUSES
+
+
+
+@dataclass
+class OpenAIClientStats:
+    requests: int = 0
+    retries : int = 0
+    failures: int = 0
+
+
+
+class OpenAIClient:
+    '''
+    OpenAI REST API over a pool of keep-alive connections. Every endpoint has its own limit of requests in flight.
+    Failed requests are retried with exponential backoff and full jitter, honoring Retry-After when it's given.
+    Streamed requests aren't retried once their response has started.
+    '''
+    base_url   : str
+    max_retries: int
+    stats      : OpenAIClientStats
+
+    def __init__(self, api_key: str, base_url: str=OPENAI_BASE_URL, max_connections: int=OPENAI_MAX_CONNECTIONS,
+                 concurrency: dict[str, int]=OPENAI_CONCURRENCY, timeout: float=OPENAI_TIMEOUT, max_retries: int=OPENAI_MAX_RETRIES,
+                 backoff: float=OPENAI_BACKOFF, max_backoff: float=OPENAI_MAX_BACKOFF) -> None:
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = OpenAIClientStats()
+        self._session: aiohttp.ClientSession | None = None
+        self._limits: dict[str, asyncio.Semaphore] = {}
+
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout   = aiohttp.ClientTimeout(total=self.timeout),
+                headers   = {"Authorization": f"Bearer {self.api_key}"})
+        return self._session
+
+
+    def _get_limit(self, endpoint: str) -> asyncio.Semaphore:
+        if not endpoint in self._limits:
+            self._limits[endpoint] = asyncio.Semaphore(self.concurrency.get(endpoint, DEFAULT_CONCURRENCY))
+        return self._limits[endpoint]
+
+
+    def _retry_delay(self, attempt: int, retry_after: str | None) -> float:
+        delay: float = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        try:
+            if retry_after is not None: delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+        return delay
+
+
+    @staticmethod
+    async def _raise_for_status(response: aiohttp.ClientResponse) -> None:
+        if response.status < 400: return
+        text: str = await response.text()
+        try:
+            message: str = json.loads(text)["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = text
+        raise OpenAIError(response.status, message)
+
+
+    async def _attempts(self, endpoint: str, payload: dict[str, Any]) -> AsyncIterator[aiohttp.ClientResponse]:
+        '''Yields the response of every attempt which succeeded, the caller stops once it's done with one'''
+        attempt: int = 0
+        while True:
+            retry_after: str | None = None
+            try:
+                async with self._get_limit(endpoint):
+                    self.stats.requests += 1
+                    async with self._get_session().post(f"{self.base_url}/{endpoint}", json=payload) as response:
+                        retry_after = response.headers.get("Retry-After")
+                        await self._raise_for_status(response)
+                        yield response
+                        return
+            except (OpenAIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, OpenAIError) and not e.retryable or attempt >= self.max_retries:
+                    self.stats.failures += 1
+                    raise
+            attempt += 1
+            self.stats.retries += 1
+            await asyncio.sleep(self._retry_delay(attempt - 1, retry_after))
+
+
+    async def post(self, endpoint: str, payload: dict[str, Any]) -> dict[str, Any]:
+        attempts = self._attempts(endpoint, payload)
+        try:
+            async for response in attempts:
+                return await response.json()
+        finally:
+            await attempts.aclose()
+        raise OpenAIError(0, "No response")
+
+
+    async def stream(self, endpoint: str, payload: dict[str, Any]) -> AsyncIterator[dict[str, Any]]:
+        '''Yields the server-sent events of a streamed request'''
+        attempts = self._attempts(endpoint, {**payload, "stream": True})
+        try:
+            async for response in attempts:
+                async for line in response.content:
+                    data: str = line.decode("utf-8").strip()
+                    if not data.startswith("data:"): continue
+                    data = data[len("data:"):].strip()
+                    if data == "[DONE]": return
+                    yield json.loads(data)
+        finally:
+            await attempts.aclose()
+
+
+    async def chat_completion(self, messages: list[dict[str, str]], model: str, **parameters: Any) -> dict[str, Any]:
+        return await self.post("chat/completions", {"model": model, "messages": messages, **parameters})
+
+
+    async def chat_completion_stream(self, messages: list[dict[str, str]], model: str, **parameters: Any) -> AsyncIterator[str]:
+        '''Yields the content of the response piece by piece'''
+        async for event in self.stream("chat/completions", {"model": model, "messages": messages, **parameters}):
+            content: str | None = event["choices"][0]["delta"].get("content")
+            if content: yield content
+
+
+    async def embeddings(self, strings: list[str], model: str) -> dict[str, Any]:
+        return await self.post("embeddings", {"model": model, "input": strings})
+
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,14 +1,15 @@
-import datetime, tiktoken, re
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
-from typing import Callable
+from typing import Callable, Sequence
 from debug import LogHanglerInterface, LogNothing, LogType
 
-from structure import Message# , ShortTermMemory
+from structure import Message, TokenCache# , ShortTermMemory
+from utility import LRUCache
 from ai import MAX_TOKENS
+from tokenizer import enc, tokens_from_string, TokenizerService, TOKENIZER
 
-# def get_token_amount(message):
-enc = tiktoken.get_encoding("cl100k_base")
+GROUPING_MICROSECONDS: int = 5 * 60 * 1_000_000     # Messages by the same author within this time are written as one
+LTM_TOKEN_CACHE_CAPACITY: int = 1024                # Token counts of long-term memory messages kept per conversation
 
 
 # STRUCTS
@@ -45,13 +46,6 @@ class GeneratedConversation:
 #         return batch
 
 
-# GENERAL FUNCTIONS
-
-# the added * 2 is there to get a more accurate answer for this kind of usage, as Discord messages aren't like typical paragraphs
-def tokens_from_string(string: str):
-    return len(enc.encode(string))
-
-
 # INTERFACES
 
 class TextModelInterface(ABC):
@@ -91,36 +85,74 @@ class TextModelInterface(ABC):
 # CONCRETE IMPLEMENTATIONS
 
 class DefaultTextModel(TextModelInterface):
+    token_cache: TokenCache | LRUCache
+    tokenizer  : TokenizerService
 
-    async def _message_to_string(self, prev_message: Message | None, current_message: Message) -> str:
-        if prev_message is None: return f"\n({current_message.date.split('.')[0]}) {current_message.author}:\n{current_message.content}\n"
+    def __init__(self, token_cache: TokenCache | LRUCache | None = None, tokenizer: TokenizerService=TOKENIZER) -> None:
+        # Token counts per (message id, grouped with previous message). Shared with ShortTermMemory when given,
+        # so that crafting a window only tokenizes messages which haven't been seen before.
+        # Messages which never leave through forget_messages (long-term memory) belong in a bounded LRUCache.
+        self.token_cache = token_cache if token_cache is not None else {}
+        self.tokenizer = tokenizer
 
-        if current_message.content == "": current_message.content = "[attachment]"
-        
-        prev_message.date    = re.sub(r"\+\d{1,2}:\d{1,2}", '', prev_message.date)
-        current_message.date = re.sub(r"\+\d{1,2}:\d{1,2}", '', current_message.date)
 
-        if len(prev_message.date)    == 19:    prev_message.date += ".000000"
-        if len(current_message.date) == 19: current_message.date += ".000000"
+    def _is_grouped(self, prev_message: Message | None, current_message: Message) -> bool:
+        if prev_message is None: return False
+        return current_message.author == prev_message.author and abs(current_message.timestamp - prev_message.timestamp) < GROUPING_MICROSECONDS
 
-        prev_date    = datetime.datetime.strptime(   prev_message.date, '%Y-%m-%d %H:%M:%S.%f')
-        current_date = datetime.datetime.strptime(current_message.date, '%Y-%m-%d %H:%M:%S.%f')  
 
-        if current_message.author == prev_message.author and abs( current_date - prev_date ).total_seconds() < 5 * 60:    
-            return current_message.content + '\n'
-        else:                                           
-            return f"\n({current_message.date.split('.')[0]}) {current_message.author}:\n{current_message.content}\n"
+    def _format_message(self, message: Message, grouped: bool) -> str:
+        content: str = message.content if message.content != "" else "[attachment]"
+        if grouped: return content + '\n'
+        return f"\n({message.display_date}) {message.author}:\n{content}\n"
+
+
+    async def _message_to_string(self, prev_message: Message | None, current_message: Message) -> str:
+        return self._format_message(current_message, self._is_grouped(prev_message, current_message))
+
+
+    def _cached_tokens(self, message: Message, grouped: bool) -> int | None:
+        cached = self.token_cache.get((message.id, grouped))
+        # Content is compared as well, as virtual conversations reuse message ids
+        if cached is not None and cached[0] == hash(message.content): return cached[1]
+        return None
 
 
     async def _tokens_from_message(self, prev_message: Message | None, current_message: Message) -> int:
-        return tokens_from_string(await self._message_to_string(prev_message, current_message))
+        grouped: bool = self._is_grouped(prev_message, current_message)
+        tokens: int | None = self._cached_tokens(current_message, grouped)
+        if tokens is not None: return tokens
+        tokens = await self.tokenizer.count_tokens(self._format_message(current_message, grouped))
+        self.token_cache[(current_message.id, grouped)] = (hash(current_message.content), tokens)
+        return tokens
+
+
+    async def cache_tokens(self, messages: Sequence[Message], prev_message: Message | None=None) -> None:
+        '''Counts the tokens of the messages which aren't cached yet in one tokenizer batch'''
+        missing: list[tuple[Message, bool]] = []
+        for message in messages:
+            grouped: bool = self._is_grouped(prev_message, message)
+            if self._cached_tokens(message, grouped) is None: missing.append((message, grouped))
+            prev_message = message
+        if not len(missing): return
+        counts: list[int] = await self.tokenizer.count_tokens_batch([self._format_message(message, grouped) for message, grouped in missing])
+        for (message, grouped), tokens in zip(missing, counts):
+            self.token_cache[(message.id, grouped)] = (hash(message.content), tokens)
+
+
+    def forget_messages(self, messages: list[Message]) -> None:
+        '''Drops cached token counts of messages which are no longer needed.'''
+        for message in messages:
+            self.token_cache.pop((message.id, True ), None)
+            self.token_cache.pop((message.id, False), None)
 
 
-    async def tokens_from_messages(self, messages: list[Message]):
+    async def tokens_from_messages(self, messages: Sequence[Message]):
         info = {
             "total" : 0,
             "each"  : []
         }
+        await self.cache_tokens(messages)
 
         prev_message = None
         for message in messages:
@@ -130,20 +162,20 @@ class DefaultTextModel(TextModelInterface):
             prev_message   = message
 
         return info
-    
-
-    # def _tokens_from_message(self, prev_message: Message | None, message: Message):
-    #     return tokens_from_string(self._message_to_string(prev_message, message))
-
 
 
-    async def _process_messages(self, messages: list[Message]) -> GeneratedConversation: 
-        string = ""
+    async def _messages_to_string(self, messages: list[Message]) -> str:
+        strings: list[str] = []
         prev_message: Message | None = None
         for message in messages:
-            string += await self._message_to_string(prev_message, message)
+            strings.append(await self._message_to_string(prev_message, message))
             prev_message = message
-        return GeneratedConversation(string, tokens_from_string(string) if len(messages) else 0, messages)
+        return ''.join(strings)
+
+
+    async def _process_messages(self, messages: list[Message]) -> GeneratedConversation: 
+        tokens: int = (await self.tokens_from_messages(messages))["total"]
+        return GeneratedConversation(await self._messages_to_string(messages), tokens, messages)
 
 
 
@@ -153,20 +185,18 @@ class DefaultTextModel(TextModelInterface):
         Returned string could then be placed onto a prompt.
         '''
 
-        string      : str = ""
+        await self.cache_tokens(messages)
         total_tokens: int = 0
         amount      : int = 0
         prev_message = None
         for message in messages:
-            next        = await self._message_to_string(prev_message, message)
-            next_tokens = tokens_from_string(next)
+            next_tokens = await self._tokens_from_message(prev_message, message)
             if total_tokens + next_tokens > max_tokens: break
             total_tokens += next_tokens
-            string += next
             prev_message = message
             amount += 1
 
-        return GeneratedConversation(string, total_tokens, messages[:amount])
+        return GeneratedConversation(await self._messages_to_string(messages[:amount]), total_tokens, messages[:amount])
 
 
     async def conversation_crafter_newest_to_oldest(self, messages: list[Message], max_tokens: int) -> GeneratedConversation:
@@ -175,33 +205,29 @@ class DefaultTextModel(TextModelInterface):
         Returned string could then be placed onto a prompt.
         '''
 
-        strings     : list[str] = []
-        tokens      : list[int] = []
+        tokens      : list[int] = []    # Tokens of the selected messages, newest first
         total_tokens: int = 0
-        amount      : int = 0
+        await self.cache_tokens(messages)
         
         for i in range(len(messages) - 1, -1, -1):
-            next        = await self._message_to_string(messages[i - 1] if not i == 0 else None, messages[i])
-            next_tokens = tokens_from_string(next)
+            next_tokens = await self._tokens_from_message(messages[i - 1] if not i == 0 else None, messages[i])
             total_tokens += next_tokens
             tokens.append(next_tokens)
-            strings.append(next)
             
             if total_tokens > max_tokens:
-                while total_tokens > max_tokens:
+                # Drop the oldest message, the one after it is no longer grouped with anything
+                while total_tokens > max_tokens and len(tokens):
                     total_tokens -= tokens.pop()
-                    strings.pop()
-                    if i == len(messages) - 1: break
-                    next          = await self._message_to_string(None, messages[i+1])
-                    next_tokens   = tokens_from_string(next)
+                    if not len(tokens): break
+                    first: int = len(messages) - len(tokens)
                     total_tokens -= tokens.pop()
-                    strings.pop()
+                    next_tokens   = await self._tokens_from_message(None, messages[first])
                     total_tokens += next_tokens
                     tokens.append(next_tokens)
-                    strings.append(next)
                 break
-        strings.reverse()
-        return GeneratedConversation(''.join(strings), total_tokens, messages[len(messages)-len(strings):])
+
+        selected: list[Message] = messages[len(messages)-len(tokens):]
+        return GeneratedConversation(await self._messages_to_string(selected), total_tokens, selected)
 
 
     async def conversation_crafter_center_to_ends(self, messages: list[Message], max_tokens: int) -> GeneratedConversation:
@@ -211,47 +237,29 @@ class DefaultTextModel(TextModelInterface):
         Returned string could then be placed onto a prompt.
         '''
         if len(messages) == 0: return GeneratedConversation("", 0, [])
-
-        string      : str = ""
-        total_tokens: int = 0
         
-        result = await self.tokens_from_messages(messages)
+        each: list[int] = (await self.tokens_from_messages(messages))["each"]
 
-        switch = True
+        # The first message of the section is never grouped with a previous message
+        switch  = True
         section = [0, len(messages) - 1]
-        while result["total"] > max_tokens:
-            if switch:
-                result["total"] -= result["each"][section[0]]
-                section[0]      += 1
-                switch           = False
-            else:
-                result["total"] -= result["each"][section[1]]
-                section[1]      -= 1
-                switch           = True
-
-        result["total"] -= result["each"][section[0]]
-        tokens = await self._tokens_from_message(None, messages[section[0]])
-        result["total"] += tokens
-
-        while result["total"] > max_tokens:
-            if switch:
-                result["total"] -= result["each"][section[0]]
-                section[0]      += 1
-                switch           = False
+        total_tokens: int = sum(each[1:]) + await self._tokens_from_message(None, messages[0])
+        while total_tokens > max_tokens and section[0] <= section[1]:
+            if section[0] == section[1]:
+                total_tokens = 0
+                section[1]  -= 1
+            elif switch:
+                total_tokens -= await self._tokens_from_message(None, messages[section[0]])
+                section[0]   += 1
+                total_tokens += await self._tokens_from_message(None, messages[section[0]]) - each[section[0]]
+                switch        = False
             else:
-                result["total"] -= result["each"][section[1]]
-                section[1]      -= 1
-                switch           = True
-
-        prev_message = None
-        for message in messages[section[0]:section[1]+1]:
-            next        = await self._message_to_string(prev_message, message)
-            next_tokens = tokens_from_string(next)
-            total_tokens += next_tokens
-            string += next
-            prev_message = message
+                total_tokens -= each[section[1]]
+                section[1]   -= 1
+                switch        = True
 
-        return GeneratedConversation(string, total_tokens, messages[section[0]:section[1]+1])
+        selected: list[Message] = messages[section[0]:section[1]+1]
+        return GeneratedConversation(await self._messages_to_string(selected), total_tokens, selected)
 
 
 
@@ -260,9 +268,12 @@ async def prompt_crafter(
         short_term_memory: list[Message], 
         token_ratio: float, 
         textModel: TextModelInterface, 
+        ltmTextModel: TextModelInterface | None=None,
         log: LogHanglerInterface=LogNothing()) -> str:
     '''
     Craft a prompt containing long-term memory and short-term memory.
+    Long-term memory is crafted with ltmTextModel (a new DefaultTextModel if not given), so that its messages
+    don't end up in the token cache of short-term memory.
     '''
     assert token_ratio >= 0 and token_ratio <= 1
 
@@ -288,9 +299,10 @@ async def prompt_crafter(
                             f"response: {RESPONSE_TOKENS}\n"
                             f"padding : {MARGIN_OF_ERROR}"))
 
+    if ltmTextModel is None: ltmTextModel = DefaultTextModel()
     i = 1
     for memory in long_term_memory:
-        ltm_snippet  = (await textModel.conversation_crafter_center_to_ends(memory, ltm_tokens_per_memory)).string
+        ltm_snippet  = (await ltmTextModel.conversation_crafter_center_to_ends(memory, ltm_tokens_per_memory)).string
         ltm         += f"MEMORY {i}{ltm_snippet}\n"
         i           += 1
     
@@ -0,0 +1,128 @@
+import asyncio, heapq, itertools, time
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    '''Lower values are served first'''
+    CHAT      = 0
+    EMBEDDING = 1
+    BACKFILL  = 2
+
+
+
+class TokenBucket:
+    '''Holds up to capacity tokens, refilled continuously at capacity per period'''
+    capacity: float
+    rate    : float     # Tokens per second
+
+    def __init__(self, capacity: float, period: float=60) -> None:
+        if capacity <= 0:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.level: float = capacity
+        self._updated: float = time.monotonic()
+
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def time_until(self, amount: float, now: float) -> float:
+        '''Seconds until amount tokens can be taken, amounts over the capacity wait for a full bucket'''
+        self._refill(now)
+        return max(0, (min(amount, self.capacity) - self.level) / self.rate)
+
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+
+
+@dataclass
+class PriorityStats:
+    acquired    : int = 0
+    wait_seconds: float = 0
+    max_wait    : float = 0
+    max_queued  : int = 0
+
+    def average_wait(self) -> float:
+        return self.wait_seconds / self.acquired if self.acquired else 0
+
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    order   : int
+    tokens  : int = field(compare=False)
+    queued  : float = field(compare=False)
+    future  : asyncio.Future = field(compare=False)
+
+
+
+class RateLimiter:
+    '''
+    Keeps requests and tokens per minute within their limits with a token bucket each, shared by every caller.
+    Callers are queued by priority, then in order of arrival. Only the first caller in the queue takes from
+    the buckets, so a burst of low priority calls can't delay one of higher priority by more than a single call.
+    '''
+    rpm  : int
+    tpm  : int
+    stats: dict[Priority, PriorityStats]
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm)
+        self.tokens   = TokenBucket(tpm)
+        self.stats = {priority: PriorityStats() for priority in Priority}
+        self._queue: list[_Waiter] = []
+        self._order = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+
+    def queue_depth(self, priority: Priority | None=None) -> int:
+        return sum(1 for waiter in self._queue if not waiter.future.done() and (priority is None or waiter.priority == priority))
+
+
+    async def acquire(self, tokens: int, priority: Priority=Priority.CHAT) -> float:
+        '''Waits until a call using the given amount of tokens is allowed. Returns the seconds waited'''
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._order), tokens, time.monotonic(), loop.create_future())
+        heapq.heappush(self._queue, waiter)
+        stats: PriorityStats = self.stats[Priority(priority)]
+        stats.max_queued = max(stats.max_queued, self.queue_depth(priority))
+        self._dispatch()
+        try:
+            waited: float = await waiter.future
+        except asyncio.CancelledError:
+            self._dispatch()
+            raise
+        stats.acquired += 1
+        stats.wait_seconds += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        return waited
+
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while len(self._queue):
+            waiter: _Waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            now : float = time.monotonic()
+            wait: float = max(self.requests.time_until(1, now), self.tokens.time_until(waiter.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1, now)
+            self.tokens.take(waiter.tokens, now)
+            waiter.future.set_result(now - waiter.queued)
@@ -0,0 +1,224 @@
+import math, re, time
+import numpy as np
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from structure import Message, SearchHit
+from utility import Result
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+RETRIEVAL_OVERFETCH     : int = 4            # Hits fetched per memory returned, for the re-ranking to choose from
+RETRIEVAL_HALF_LIFE     : float = 180        # In days, after which the recency part of a hit's score is halved
+RETRIEVAL_DECAY_WEIGHT  : float = 0.3        # Share of the score that decays with age, the rest is similarity alone
+RETRIEVAL_DIVERSITY     : float = 0.5        # MMR trade-off, 1 ranks by relevance only, 0 by novelty only
+RETRIEVAL_MAX_REDUNDANCY: float = 0.8        # Hits at least this redundant to a chosen one are dropped
+RETRIEVAL_BURST_SECONDS : float = 300        # Messages this close in time share most of their context window
+
+GATE_MIN_CHARS     : int = 10               # Shorter queries ("ok", "lol") aren't searched with
+GATE_MAX_OVERLAP   : float = 0.6            # Queries sharing this much of their words with a message of the context aren't either
+GATE_MAX_SIMILARITY: float = 0.95           # Nor queries this similar to the cached embedding of a message of the context
+
+# Embeddings of strings which are already known, None for the others. Mustn't call the API
+EmbeddingLookup = Callable[[list[str]], list[list[float] | None]]
+Embedder        = Callable[[list[str]], Awaitable[Result[list[list[float]]]]]
+
+_WORD = re.compile(r"\w+")
+_MICROSECONDS_PER_DAY: int = 86400 * 1_000_000
+
+
+def similarity_from_distance(distance: float) -> float:
+    '''Cosine similarity of unit vectors (OpenAI embeddings are) from their squared L2 distance'''
+    return 1 - distance / 2
+
+
+def words(text: str) -> frozenset[str]:
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def lexical_overlap(a: frozenset[str], b: frozenset[str]) -> float:
+    '''Jaccard similarity of two word sets'''
+    if not a or not b: return 0
+    return len(a & b) / len(a | b)
+
+
+
+@dataclass
+class RetrievalStats:
+    searches  : int = 0
+    candidates: int = 0     # Hits fetched from long-term memory
+    in_stm    : int = 0     # Hits dropped as they're already in short-term memory
+    redundant : int = 0     # Hits dropped as near duplicates of chosen ones
+    returned  : int = 0
+
+
+
+class HybridRetriever:
+    '''
+    Re-ranks over-fetched long-term memory hits before they're expanded and put into the prompt.
+    A hit's relevance is its similarity to the query, partly decayed by the age of the message. Hits are chosen
+    by maximal marginal relevance, where two hits are redundant if they share most of their words or were sent
+    in the same burst of messages (their context windows would overlap). Hits already in short-term memory,
+    and hits nearly redundant to chosen ones, are dropped, so fewer than limit memories can come back.
+    '''
+    limit         : int
+    overfetch     : int
+    half_life     : float
+    decay_weight  : float
+    diversity     : float
+    max_redundancy: float
+    burst_seconds : float
+    stats         : RetrievalStats
+
+    def __init__(self, limit: int, overfetch: int=RETRIEVAL_OVERFETCH, half_life: float=RETRIEVAL_HALF_LIFE, decay_weight: float=RETRIEVAL_DECAY_WEIGHT,
+                 diversity: float=RETRIEVAL_DIVERSITY, max_redundancy: float=RETRIEVAL_MAX_REDUNDANCY, burst_seconds: float=RETRIEVAL_BURST_SECONDS,
+                 clock: Callable[[], float]=time.time) -> None:
+        if limit <= 0 or overfetch <= 0:
+            raise ValueError("Limit and over-fetch cannot be less than 1")
+        if not 0 <= decay_weight <= 1 or not 0 <= diversity <= 1:
+            raise ValueError("Decay weight and diversity must be between 0 and 1")
+        self.limit = limit
+        self.overfetch = overfetch
+        self.half_life = half_life
+        self.decay_weight = decay_weight
+        self.diversity = diversity
+        self.max_redundancy = max_redundancy
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.stats = RetrievalStats()
+
+
+    @property
+    def fetch_limit(self) -> int:
+        '''Hits to ask long-term memory for'''
+        return self.limit * self.overfetch
+
+
+    def relevance(self, hit: SearchHit, now: int) -> float:
+        similarity: float = similarity_from_distance(hit.distance)
+        if not hit.message.timestamp: return similarity     # Undated messages don't decay
+        age_days: float = max(0, now - hit.message.timestamp) / _MICROSECONDS_PER_DAY
+        return similarity * (1 - self.decay_weight + self.decay_weight * 0.5 ** (age_days / self.half_life))
+
+
+    def redundancy(self, a: Message, a_words: frozenset[str], b: Message, b_words: frozenset[str]) -> float:
+        overlap: float = lexical_overlap(a_words, b_words)
+        if not a.timestamp or not b.timestamp: return overlap
+        seconds_apart: float = abs(a.timestamp - b.timestamp) / 1_000_000
+        return max(overlap, math.exp(-seconds_apart / self.burst_seconds))
+
+
+    def rank(self, hits: list[SearchHit], short_term_memory: list[Message]) -> list[Message]:
+        '''The hits worth expanding, best first'''
+        self.stats.searches += 1
+        self.stats.candidates += len(hits)
+        stm_ids     : set[int] = {message.id for message in short_term_memory}
+        stm_contents: set[str] = {' '.join(message.content.lower().split()) for message in short_term_memory}
+        now: int = int(self.clock() * 1_000_000)
+
+        candidates: list[tuple[float, Message, frozenset[str]]] = []
+        seen: set[int] = set()
+        for hit in hits:
+            if hit.message.id in seen: continue
+            seen.add(hit.message.id)
+            if hit.message.id in stm_ids or ' '.join(hit.message.content.lower().split()) in stm_contents:
+                self.stats.in_stm += 1
+                continue
+            candidates.append((self.relevance(hit, now), hit.message, words(hit.message.content)))
+
+        chosen: list[tuple[Message, frozenset[str]]] = []
+        while len(candidates) and len(chosen) < self.limit:
+            best_index: int = -1
+            best_score: float = -math.inf
+            for index, (relevance, message, message_words) in enumerate(candidates):
+                redundancy: float = max((self.redundancy(message, message_words, other, other_words) for other, other_words in chosen), default=0)
+                score: float = self.diversity * relevance - (1 - self.diversity) * redundancy
+                if score > best_score: best_index, best_score = index, score
+            _, message, message_words = candidates.pop(best_index)
+            chosen.append((message, message_words))
+            # Whatever is now nearly redundant won't be chosen anyway
+            remaining: int = len(candidates)
+            candidates = [candidate for candidate in candidates if self.redundancy(candidate[1], candidate[2], message, message_words) < self.max_redundancy]
+            self.stats.redundant += remaining - len(candidates)
+
+        self.stats.returned += len(chosen)
+        return [message for message, _ in chosen]
+
+
+
+@dataclass
+class GateStats:
+    searches      : int = 0     # Retrievals which searched long-term memory
+    skipped       : int = 0     # Retrievals skipped, as none of their queries could find anything new
+    queries       : int = 0
+    short         : int = 0     # Queries dropped for being too short
+    overlapping   : int = 0     # Queries dropped for sharing their words with the context
+    similar       : int = 0     # Queries dropped for being similar to the context
+    search_seconds: float = 0
+
+    def average_search_seconds(self) -> float:
+        return self.search_seconds / self.searches if self.searches else 0
+
+    def saved_seconds(self) -> float:
+        '''Estimated time the skipped retrievals would have taken'''
+        return self.skipped * self.average_search_seconds()
+
+
+
+class RetrievalGate:
+    '''
+    Cheap checks run before long-term memory is searched, from cheapest to most expensive. A query is dropped if it's
+    too short to mean anything, if it mostly repeats the words of a message in the context (short-term memory), or if
+    its embedding is nearly the same as the cached embedding of such a message. Query embeddings are only computed
+    when some context embeddings are cached, and the search reuses them. If every query is dropped, the retrieval
+    is skipped along with its embedding, search and context expansion.
+    '''
+    min_chars     : int
+    max_overlap   : float
+    max_similarity: float
+    stats         : GateStats
+
+    def __init__(self, lookup: EmbeddingLookup, embed: Embedder, min_chars: int=GATE_MIN_CHARS,
+                 max_overlap: float=GATE_MAX_OVERLAP, max_similarity: float=GATE_MAX_SIMILARITY) -> None:
+        self.lookup = lookup
+        self.embed = embed
+        self.min_chars = min_chars
+        self.max_overlap = max_overlap
+        self.max_similarity = max_similarity
+        self.stats = GateStats()
+
+
+    async def filter(self, queries: list[str], context: list[Message], log: LogHanglerInterface=LogNothing()) -> list[str]:
+        '''The queries worth searching with, empty if the retrieval should be skipped'''
+        self.stats.queries += len(queries)
+        remaining: list[str] = [query for query in queries if len(' '.join(query.split())) >= self.min_chars]
+        self.stats.short += len(queries) - len(remaining)
+
+        context_words: list[frozenset[str]] = [words(message.content) for message in context]
+        kept: list[str] = [query for query in remaining if max((lexical_overlap(words(query), other) for other in context_words), default=0) < self.max_overlap]
+        self.stats.overlapping += len(remaining) - len(kept)
+        remaining = kept
+
+        if len(remaining):
+            remaining = await self._drop_similar(remaining, context, log=log)
+
+        if len(remaining): self.stats.searches += 1
+        else             : self.stats.skipped += 1
+        log.log(LogType.DEBUG, f"Retrieval gate: {len(remaining)}/{len(queries)} queries kept\nstats: {self.stats}")
+        return remaining
+
+
+    async def _drop_similar(self, queries: list[str], context: list[Message], log: LogHanglerInterface=LogNothing()) -> list[str]:
+        cached: list[list[float]] = [embedding for embedding in self.lookup([message.content for message in context]) if embedding is not None]
+        if not len(cached): return queries
+        embeddings: Result[list[list[float]]] = await self.embed(queries)
+        if not embeddings.is_valid(): return queries    # The search will report it
+
+        context_vectors: np.ndarray = np.asarray(cached, dtype=np.float32)
+        query_vectors  : np.ndarray = np.asarray(embeddings.unwrap(), dtype=np.float32)
+        context_vectors /= np.maximum(np.linalg.norm(context_vectors, axis=1, keepdims=True), 1e-12)
+        query_vectors   /= np.maximum(np.linalg.norm(query_vectors  , axis=1, keepdims=True), 1e-12)
+        similarities: np.ndarray = (query_vectors @ context_vectors.T).max(axis=1)
+        kept: list[str] = [query for query, similarity in zip(queries, similarities) if similarity < self.max_similarity]
+        self.stats.similar += len(queries) - len(kept)
+        return kept
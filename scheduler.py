@@ -0,0 +1,123 @@
+import asyncio, traceback
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, Generic, TypeVar
+
+from debug import LogHanglerInterface, LogNothing, LogType
+
+
+MAX_CONCURRENT_PIPELINES: int = 8      # Conversations crafting a prompt and generating a response at once
+MAX_CONCURRENT_OPENAI   : int = 4      # Requests to OpenAI in flight at once, across all channels
+
+T = TypeVar("T")
+
+
+
+@dataclass
+class SchedulerStats:
+    pipelines       : int = 0
+    pipelines_queued: int = 0       # Pipelines which had to wait for a free slot
+    openai_calls    : int = 0
+    openai_queued   : int = 0
+
+
+
+class Scheduler:
+    '''
+    Caps the work shared by every channel. Waiters get a slot in the order they asked for it,
+    so a busy channel can't starve the others.
+    '''
+    max_pipelines   : int
+    max_openai_calls: int
+    stats           : SchedulerStats
+
+    def __init__(self, max_pipelines: int=MAX_CONCURRENT_PIPELINES, max_openai_calls: int=MAX_CONCURRENT_OPENAI) -> None:
+        if max_pipelines <= 0 or max_openai_calls <= 0:
+            raise ValueError("Concurrency cannot be less than 1")
+        self.max_pipelines = max_pipelines
+        self.max_openai_calls = max_openai_calls
+        self.stats = SchedulerStats()
+        self._pipelines = asyncio.Semaphore(max_pipelines)
+        self._openai    = asyncio.Semaphore(max_openai_calls)
+
+
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncIterator[None]:
+        self.stats.pipelines += 1
+        if self._pipelines.locked(): self.stats.pipelines_queued += 1
+        async with self._pipelines:
+            yield
+
+
+    @asynccontextmanager
+    async def openai_call(self) -> AsyncIterator[None]:
+        self.stats.openai_calls += 1
+        if self._openai.locked(): self.stats.openai_queued += 1
+        async with self._openai:
+            yield
+
+
+
+SCHEDULER: Scheduler = Scheduler()
+
+
+
+class ChannelActor(Generic[T]):
+    '''
+    Handles the items of one channel in order. Posted items wait in a mailbox, a single consumer task hands
+    everything which piled up to the handler at once. The consumer exits once the mailbox is empty and is
+    started again by the next post. Longer work started on behalf of the channel is owned by the actor too,
+    so it's logged when it fails and cancelled when the actor is closed.
+    '''
+    channel_id: int
+    mailbox   : asyncio.Queue[T]
+
+    def __init__(self, channel_id: int, handler: Callable[[list[T]], Awaitable[None]], log: LogHanglerInterface=LogNothing()) -> None:
+        self.channel_id = channel_id
+        self.mailbox = asyncio.Queue()
+        self.handler = handler
+        self.log = log
+        self._consumer: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+
+    def post(self, item: T) -> None:
+        self.mailbox.put_nowait(item)
+        if self._consumer is None or self._consumer.done():
+            self._consumer = self.start_task(self._consume())
+
+
+    def start_task(self, coroutine: Coroutine) -> asyncio.Task:
+        task: asyncio.Task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error: BaseException = task.exception()     # type: ignore
+            self.log.log(LogType.ERROR, f"{str(error)}\n{''.join(traceback.format_exception(error))}")
+
+
+    def is_busy(self) -> bool:
+        return len(self._tasks) != 0 or not self.mailbox.empty()
+
+
+    async def _consume(self) -> None:
+        while not self.mailbox.empty():
+            batch: list[T] = []
+            while not self.mailbox.empty(): batch.append(self.mailbox.get_nowait())
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                self.log.log(LogType.ERROR, f"{str(e)}\n{traceback.format_exc()}")
+
+
+    async def close(self) -> None:
+        '''Drops pending items and cancels the consumer along with every task started by the actor'''
+        while not self.mailbox.empty(): self.mailbox.get_nowait()
+        tasks: list[asyncio.Task] = list(self._tasks)
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,76 @@
+import json, os
+from typing import Any
+
+
+
+class AppendOnlyLog:
+    '''
+    Newline delimited JSON records appended to the end of a single file.
+    Records are never rewritten in place, compact() replaces the whole file atomically.
+    '''
+    file_path    : str
+    bytes_written: int
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.bytes_written = 0
+
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.file_path)
+
+
+    def size(self) -> int:
+        return os.path.getsize(self.file_path) if self.exists() else 0
+
+
+    def read(self) -> list[Any]:
+        '''Returns every record in the log. A torn record at the end of the file (interrupted write) is cut off.'''
+        if not self.exists(): return []
+
+        records: list[Any] = []
+        valid_until: int = 0
+        with open(self.file_path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'): break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                valid_until += len(line)
+
+        if valid_until != self.size():
+            with open(self.file_path, 'r+b') as file:
+                file.truncate(valid_until)
+        return records
+
+
+    def append(self, records: list[Any]) -> int:
+        '''Returns the amount of bytes written'''
+        if not len(records): return 0
+        data: bytes = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode("utf-8")
+        with open(self.file_path, 'ab') as file:
+            file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+
+    def compact(self, records: list[Any]) -> int:
+        '''Replaces the content of the log with the given records. Returns the amount of bytes written'''
+        data: bytes = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode("utf-8")
+        temporary_path: str = self.file_path + ".tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.file_path)
+        self.bytes_written += len(data)
+        return len(data)
+
+
+    def remove(self) -> bool:
+        '''Returns True if log was removed, False if log wasn't removed because it doesn't exist'''
+        if self.exists():
+            os.remove(self.file_path)
+            return True
+        return False
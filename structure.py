@@ -1,14 +1,93 @@
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Any
+from datetime import datetime, timezone, timedelta
+from typing import Any, Iterable, Iterator, overload
+
+
+EPOCH: datetime = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_timestamp(date: str) -> int:
+    '''Epoch microseconds of a message date, dates without a timezone are taken as UTC. 0 if it can't be parsed'''
+    try:
+        moment: datetime = datetime.fromisoformat(date)
+    except ValueError:
+        return 0
+    if moment.tzinfo is None: moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def format_timestamp(timestamp: int) -> str:
+    '''Canonical date of a timestamp, the same as str() of a UTC datetime'''
+    return str(EPOCH + timedelta(microseconds=timestamp))
+
+
+def is_canonical_date(date: str, timestamp: int) -> bool:
+    '''Whether format_timestamp(timestamp) gives back the date, checked without formatting it'''
+    if not date.endswith("+00:00") or len(date) < 11 or date[10] != ' ' or timestamp == 0: return False
+    if len(date) == 25: return timestamp % 1_000_000 == 0
+    if len(date) == 32: return timestamp % 1_000_000 != 0
+    return False
 
 
-@dataclass
 class Message:
-    id        : int
-    date      : str
-    author    : str
-    content   : str
+    '''
+    The date is parsed once into timestamp (epoch microseconds), the date strings are formatted from it when needed.
+    '''
+    __slots__ = ("id", "author", "content", "timestamp", "_date", "_display_date")
+    id       : int
+    author   : str
+    content  : str
+    timestamp: int
+
+    def __init__(self, id: int, date: str, author: str, content: str) -> None:
+        self.id = id
+        self.author = author
+        self.content = content
+        self.timestamp = parse_timestamp(date)
+        self._date: str | None = date
+        self._display_date: str | None = None
+
+    @staticmethod
+    def view(id: int, date: str | None, author: str, content: str, timestamp: int) -> 'Message':
+        '''Builds a message from already parsed columns. Without a date, it's formatted from the timestamp when needed'''
+        message: Message = object.__new__(Message)
+        message.id, message.author, message.content, message.timestamp = id, author, content, timestamp
+        message._date = date
+        message._display_date = None
+        return message
+
+    @property
+    def date(self) -> str:
+        if self._date is None: self._date = format_timestamp(self.timestamp)
+        return self._date
+
+    @date.setter
+    def date(self, date: str) -> None:
+        self._date = date
+        self.timestamp = parse_timestamp(date)
+        self._display_date = None
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Message): return NotImplemented
+        return (self.id, self.date, self.author, self.content) == (other.id, other.date, other.author, other.content)
+
+    __hash__ = None     # type: ignore
+
+    def __repr__(self) -> str:
+        return f"Message(id={self.id!r}, date={self.date!r}, author={self.author!r}, content={self.content!r})"
+
+    @property
+    def created_at(self) -> datetime:
+        return EPOCH + timedelta(microseconds=self.timestamp)
+
+    @property
+    def display_date(self) -> str:
+        '''Date to the second, without timezone, as shown in prompts'''
+        if self._display_date is None:
+            self._display_date = self.created_at.strftime("%Y-%m-%d %H:%M:%S") if self.timestamp else self.date.split('.')[0]
+        return self._display_date
     
     def __str__(self) -> str:
         return f"({self.date}) <{self.id}> {self.author}: {self.content}"
@@ -37,20 +116,161 @@ class DatabaseEntry:
     embedding : list[float]
 
 
+@dataclass(frozen=True)
+class SearchHit:
+    message   : Message
+    distance  : float
+
+
+
+class MessageStore(Sequence[Message]):
+    '''
+    Messages kept column by column instead of as objects: ids and timestamps in arrays, authors as indices into 
+    an interned author table and contents packed into one UTF-8 buffer. Indexing builds Message views on demand.
+    Dates are rebuilt from timestamps, only dates that don't match their canonical form are kept as strings.
+    '''
+    COMPACT_MIN_REMOVED: int = 64
+
+    def __init__(self, messages: Iterable[Message]=()) -> None:
+        self._start       : int = 0                 # Rows before this one have been removed
+        self._ids         : array = array('q')
+        self._timestamps  : array = array('q')
+        self._authors     : array = array('I')
+        self._author_table: list[str] = []
+        self._author_index: dict[str, int] = {}
+        self._offsets     : array = array('Q', [0]) # Content of row i is _contents[_offsets[i]:_offsets[i+1]]
+        self._contents    : bytearray = bytearray()
+        self._dates       : dict[int, str] = {}     # Row -> date, where it differs from the timestamp's canonical form
+        self.extend(messages)
+
+
+    @staticmethod
+    def from_lists(messages: list[list]) -> 'MessageStore':
+        store: MessageStore = MessageStore()
+        store.extend_lists(messages)
+        return store
+
+
+    def to_lists(self) -> list[list]:
+        return [self._row(row, as_list=True) for row in range(self._start, len(self._ids))]     # type: ignore
+
+
+    def _append(self, id: int, date: str, author: str, content: str, timestamp: int | None=None) -> None:
+        if timestamp is None: timestamp = parse_timestamp(date)
+        author_index: int | None = self._author_index.get(author)
+        if author_index is None:
+            author_index = self._author_index[author] = len(self._author_table)
+            self._author_table.append(author)
+        if not is_canonical_date(date, timestamp): self._dates[len(self._ids)] = date
+        self._ids.append(id)
+        self._timestamps.append(timestamp)
+        self._authors.append(author_index)
+        self._contents += content.encode("utf-8")
+        self._offsets.append(len(self._contents))
+
+
+    def append(self, message: Message) -> None:
+        self._append(message.id, message.date, message.author, message.content, message.timestamp)
+
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        for message in messages: self.append(message)
+
+
+    def extend_lists(self, messages: list[list]) -> None:
+        '''Appends messages in their serialized form (Message.object_to_list), without building Message objects'''
+        for message in messages: self._append(message[0], str(message[1]), message[2], message[3])
+
+
+    def remove_oldest(self, amount: int) -> None:
+        self._start = min(self._start + max(amount, 0), len(self._ids))
+        if self._start > max(len(self), self.COMPACT_MIN_REMOVED): self._compact()
+
+
+    def clear(self) -> None:
+        self.__init__()
+
+
+    def _compact(self) -> None:
+        start: int = self._start
+        content_start: int = self._offsets[start]
+        self._ids        = self._ids[start:]
+        self._timestamps = self._timestamps[start:]
+        self._authors    = self._authors[start:]
+        self._offsets    = array('Q', (offset - content_start for offset in self._offsets[start:]))
+        self._contents   = self._contents[content_start:]
+        self._dates      = {row - start: date for row, date in self._dates.items() if row >= start}
+        self._start      = 0
+
+
+    def _row(self, row: int, as_list: bool=False) -> Message | list:
+        timestamp: int = self._timestamps[row]
+        date: str | None = self._dates.get(row)
+        author: str = self._author_table[self._authors[row]]
+        content: str = self._contents[self._offsets[row]:self._offsets[row+1]].decode("utf-8")
+        if as_list: return [self._ids[row], date if date is not None else format_timestamp(timestamp), author, content]
+        return Message.view(self._ids[row], date, author, content, timestamp)
+
+
+    def id_at(self, index: int) -> int:
+        return self._ids[self._start + index]
+
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._start
+
+
+    @overload
+    def __getitem__(self, index: int) -> Message: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[Message]: ...
+    def __getitem__(self, index: int | slice) -> Message | list[Message]:
+        if isinstance(index, slice):
+            return [self._row(self._start + i) for i in range(*index.indices(len(self)))]     # type: ignore
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError("MessageStore index out of range")
+        return self._row(self._start + index)      # type: ignore
+
+
+    def __iter__(self) -> Iterator[Message]:
+        for row in range(self._start, len(self._ids)): yield self._row(row)     # type: ignore
+
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sequence): return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+
+    def __repr__(self) -> str:
+        return f"MessageStore({list(self)})"
+
+
+    def nbytes(self) -> int:
+        '''Approximate size of the stored columns'''
+        return (self._ids.itemsize * len(self._ids) + self._timestamps.itemsize * len(self._timestamps)
+                + self._authors.itemsize * len(self._authors) + self._offsets.itemsize * len(self._offsets)
+                + len(self._contents) + sum(len(author) for author in self._author_table) + sum(len(date) for date in self._dates.values()))
+
+
+
+# (message id, grouped with previous message) -> (hash of content, tokens)
+TokenCache = dict[tuple[int, bool], tuple[int, int]]
+
 
 @dataclass
 class ShortTermMemory:
     tokens  : int = 0
-    messages: list[Message] = field(default_factory=list)
+    messages: MessageStore = field(default_factory=MessageStore)
+    token_cache: TokenCache = field(default_factory=dict, repr=False, compare=False)
 
     def from_json(self, json: dict) -> None:
         self.tokens   = json["tokens"]
-        self.messages = [Message.list_to_object(message) for message in json["messages"]]
+        self.messages = MessageStore.from_lists(json["messages"])
 
     def to_json(self) -> dict:
         return { 
             "tokens": self.tokens, 
-            "messages": [Message.object_to_list(message) for message in self.messages] 
+            "messages": self.messages.to_lists()
         }
     
 
@@ -0,0 +1,107 @@
+import pytest, asyncio, os
+from datetime import datetime, timedelta
+import ai, backfill
+from backfill import HistoryBackfill
+from memory import ComplexMemory, MemoryJson, MessageArchive
+from utility import Result
+
+
+CHANNEL_ID = 1
+
+
+class FakeAuthor:
+    name = "Bob"
+    discriminator = "0"
+
+
+class FakeDiscordMessage:
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.created_at = datetime(2021, 1, 1) + timedelta(minutes=id)
+        self.author = FakeAuthor()
+        self.content = f"message {id}"
+
+
+class FakeChannel:
+    '''History of messages 1 to amount, newest first'''
+    def __init__(self, amount: int) -> None:
+        self.id = CHANNEL_ID
+        self.messages = [FakeDiscordMessage(id) for id in range(amount, 0, -1)]
+
+    async def history(self, limit, before, oldest_first):
+        for message in [message for message in self.messages if before is None or message.id < before.id][:limit]:
+            yield message
+
+
+class FakeVectorMemory:
+    '''Keeps the ids of inserted messages, inserting fails once fail_on_insert reaches 0'''
+    def __init__(self, fail_on_insert: int | None=None) -> None:
+        self.ids: list[int] = []
+        self.fail_on_insert = fail_on_insert
+
+    async def add_messages(self, messages, embeddings, log=None):
+        if self.fail_on_insert is not None:
+            if self.fail_on_insert == 0: raise ConnectionError("Vector store is down")
+            self.fail_on_insert -= 1
+        self.ids.extend(message.id for message in messages)
+
+    async def remove_messages(self, message_ids, log=None):
+        self.ids = [id for id in self.ids if id not in message_ids]
+
+
+def create_memory(LTM: FakeVectorMemory) -> ComplexMemory:
+    MemoryJson.create_channel_memory_if_new(CHANNEL_ID, MessageArchive.EXTRA_IDENTIFIER)
+    return ComplexMemory(CHANNEL_ID, 100, LTM, MessageArchive(CHANNEL_ID), MemoryJson(CHANNEL_ID))
+
+
+def archived_ids() -> list[int]:
+    messages = MessageArchive(CHANNEL_ID)._load()
+    return [messages.id_at(row) for row in range(len(messages))]
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("channel-memory")
+    monkeypatch.setattr(backfill, "BACKFILL_BATCH_SIZE", 3)
+    async def embed_strings(strings, log=None, priority=None): return Result.ok([[0.0] for _ in strings])
+    monkeypatch.setattr(ai, "embed_strings", embed_strings)
+
+
+def test_HistoryBackfill_archives_oldest_last():
+    LTM = FakeVectorMemory()
+    asyncio.run(HistoryBackfill(FakeChannel(10), create_memory(LTM), None).run())
+    checkpoint = HistoryBackfill.load_checkpoint(CHANNEL_ID)
+    assert checkpoint is not None and checkpoint.done and checkpoint.archived == 10 and checkpoint.before_id == 1
+    # Batches go from newest to oldest, each is archived oldest first
+    assert archived_ids() == [8, 9, 10, 5, 6, 7, 2, 3, 4, 1]
+    assert sorted(LTM.ids) == list(range(1, 11))
+    assert not HistoryBackfill.is_unfinished(CHANNEL_ID)
+
+
+def test_HistoryBackfill_limit():
+    LTM = FakeVectorMemory()
+    asyncio.run(HistoryBackfill(FakeChannel(10), create_memory(LTM), 9, limit=4).run())
+    assert sorted(LTM.ids) == [5, 6, 7, 8]
+    assert HistoryBackfill.load_checkpoint(CHANNEL_ID).archived == 4    # type: ignore
+
+
+def test_HistoryBackfill_resume_does_not_duplicate():
+    channel = FakeChannel(10)
+    # The second batch reaches the archive, but not the vector store nor the checkpoint
+    LTM = FakeVectorMemory(fail_on_insert=1)
+    asyncio.run(HistoryBackfill(channel, create_memory(LTM), None).run())
+    checkpoint = HistoryBackfill.load_checkpoint(CHANNEL_ID)
+    assert checkpoint is not None and not checkpoint.done
+    assert checkpoint.archived == 3 and checkpoint.before_id == 8
+    assert HistoryBackfill.is_unfinished(CHANNEL_ID)
+    assert sorted(archived_ids()) == [5, 6, 7, 8, 9, 10]
+
+    LTM.fail_on_insert = None
+    resumed = HistoryBackfill(channel, create_memory(LTM), None)
+    assert resumed.resumed
+    asyncio.run(resumed.run())
+    assert sorted(archived_ids()) == list(range(1, 11))
+    assert sorted(LTM.ids) == list(range(1, 11))
+    checkpoint = HistoryBackfill.load_checkpoint(CHANNEL_ID)
+    assert checkpoint is not None and checkpoint.done and checkpoint.archived == 10
@@ -0,0 +1,88 @@
+import pytest, asyncio
+from batcher import EmbeddingBatcher
+from rate_limiter import RateLimiter, Priority
+
+
+class FakeEmbeddingEndpoint:
+    '''Embeds a string as [length of string, index inside the batch], one token per string'''
+    def __init__(self, fail: bool=False) -> None:
+        self.batches: list[list[str]] = []
+        self.fail = fail
+
+    async def __call__(self, strings: list[str]) -> tuple[list[list[float]], int]:
+        self.batches.append(strings)
+        await asyncio.sleep(0.001)
+        if self.fail: raise ConnectionError("Endpoint is down")
+        return [[float(len(string)), float(i)] for i, string in enumerate(strings)], len(strings)
+
+
+def create_batcher(endpoint: FakeEmbeddingEndpoint, max_batch_size: int=1000) -> EmbeddingBatcher:
+    return EmbeddingBatcher(endpoint, max_batch_size=max_batch_size, max_batch_tokens=150000, rate_limiter=RateLimiter(rpm=20, tpm=150000), max_wait=0.01)
+
+
+def test_EmbeddingBatcher_concurrent_requests_share_batch():
+    endpoint = FakeEmbeddingEndpoint()
+    async def main():
+        batcher = create_batcher(endpoint)
+        return await asyncio.gather(batcher.embed(["a", "bb"]), batcher.embed(["ccc"]), batcher.embed(["dddd", "e"]))
+    results = asyncio.run(main())
+    assert len(endpoint.batches) == 1
+    assert [embedding[0] for embedding in results[0][0]] == [1, 2]
+    assert [embedding[0] for embedding in results[1][0]] == [3]
+    assert [embedding[0] for embedding in results[2][0]] == [4, 1]
+    assert sum(result[1] for result in results) == 5
+
+
+def test_EmbeddingBatcher_full_batch_is_split():
+    endpoint = FakeEmbeddingEndpoint()
+    async def main():
+        batcher = create_batcher(endpoint, max_batch_size=3)
+        return await asyncio.gather(batcher.embed(["a", "b"]), batcher.embed(["c", "d", "e", "f", "g"]))
+    results = asyncio.run(main())
+    assert all(len(batch) <= 3 for batch in endpoint.batches)
+    assert sum(len(batch) for batch in endpoint.batches) == 7
+    assert len(results[0][0]) == 2 and len(results[1][0]) == 5
+
+
+def test_EmbeddingBatcher_empty_request():
+    endpoint = FakeEmbeddingEndpoint()
+    assert asyncio.run(create_batcher(endpoint).embed([])) == ([], 0)
+    assert endpoint.batches == []
+
+
+def test_EmbeddingBatcher_error_reaches_every_caller():
+    endpoint = FakeEmbeddingEndpoint(fail=True)
+    async def main():
+        batcher = create_batcher(endpoint)
+        return await asyncio.gather(batcher.embed(["a"]), batcher.embed(["b"]), return_exceptions=True)
+    results = asyncio.run(main())
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_EmbeddingBatcher_uses_shared_rate_limiter():
+    endpoint = FakeEmbeddingEndpoint()
+    limiter = RateLimiter(rpm=20, tpm=150000)
+    async def main():
+        batcher = EmbeddingBatcher(endpoint, max_batch_size=1000, max_batch_tokens=150000, rate_limiter=limiter, max_wait=0.01)
+        await asyncio.gather(batcher.embed(["a"], Priority.BACKFILL), batcher.embed(["b"], Priority.EMBEDDING))
+    asyncio.run(main())
+    assert len(endpoint.batches) == 1
+    assert limiter.stats[Priority.EMBEDDING].acquired == 1 and limiter.stats[Priority.BACKFILL].acquired == 0
+
+
+def test_EmbeddingBatcher_special_tokens_in_messages(monkeypatch):
+    import tokenizer
+    class StrictEncoding:
+        '''Raises on special tokens like tiktoken's encode does'''
+        def encode(self, string):
+            if "<|endoftext|>" in string: raise ValueError("special token")
+            return self.encode_ordinary(string)
+        def encode_ordinary(self, string): return string.split()
+    monkeypatch.setattr(tokenizer, "enc", StrictEncoding())
+    endpoint = FakeEmbeddingEndpoint()
+    async def main():
+        # ai.get_embedding_batcher's counter
+        batcher = EmbeddingBatcher(endpoint, max_batch_size=1000, max_batch_tokens=150000, rate_limiter=RateLimiter(rpm=20, tpm=150000), max_wait=0.01, token_counter=tokenizer.tokens_from_string)
+        return await batcher.embed(["what does <|endoftext|> mean"])
+    embeddings, _ = asyncio.run(main())
+    assert len(embeddings) == 1
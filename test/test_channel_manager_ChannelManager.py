@@ -0,0 +1,79 @@
+from channel_manager import ChannelManager
+
+
+class FakeMemory:
+    '''size bytes of short-term memory, archive bytes loaded on demand'''
+    def __init__(self, size: int, archive: int=0) -> None:
+        self.size = size
+        self.archive = archive
+
+    def resident_bytes(self) -> int:
+        return self.size + self.archive
+
+    def unload(self) -> int:
+        released, self.archive = self.archive, 0
+        return released
+
+
+class FakeConversation:
+    def __init__(self, size: int=0, archive: int=0) -> None:
+        self.memory = FakeMemory(size, archive)
+        self.is_processing = False
+        self.is_saving_message = False
+        self.unread_message_queue = []
+
+
+def test_ChannelManager_least_recently_used_is_evicted():
+    manager = ChannelManager(max_channels=2)
+    manager.put(1, FakeConversation())      # type: ignore
+    manager.put(2, FakeConversation())      # type: ignore
+    manager.get(1)
+    manager.put(3, FakeConversation())      # type: ignore
+    assert 1 in manager and 3 in manager
+    assert 2 not in manager and manager.was_evicted(2)
+    manager.put(2, FakeConversation())      # type: ignore
+    assert manager.stats.reactivations == 1
+    assert not manager.was_evicted(2)
+
+
+def test_ChannelManager_busy_conversations_are_kept():
+    manager = ChannelManager(max_channels=1, keep=lambda channel_id: channel_id == 2)
+    busy = FakeConversation()
+    busy.is_processing = True
+    manager.put(1, busy)                    # type: ignore
+    manager.put(2, FakeConversation())      # type: ignore
+    manager.put(3, FakeConversation())      # type: ignore
+    assert 1 in manager and 2 in manager and 3 in manager
+
+
+def test_ChannelManager_memory_budget():
+    manager = ChannelManager(max_channels=10, memory_budget=100)
+    manager.put(1, FakeConversation(60))    # type: ignore
+    manager.put(2, FakeConversation(60))    # type: ignore
+    assert 1 not in manager and 2 in manager
+    assert manager.resident_bytes() == 60
+
+
+def test_ChannelManager_archives_are_unloaded_before_conversations():
+    manager = ChannelManager(max_channels=10, memory_budget=100)
+    first = FakeConversation(20, archive=50)
+    manager.put(1, first)                   # type: ignore
+    manager.put(2, FakeConversation(40))    # type: ignore
+    assert 1 in manager and 2 in manager
+    assert first.memory.archive == 0 and manager.stats.unloads == 1 and manager.stats.evictions == 0
+
+
+def test_ChannelManager_budget_checked_when_archive_loads():
+    manager = ChannelManager(max_channels=10, memory_budget=100)
+    idle = FakeConversation(10, archive=40)
+    busy = FakeConversation(10)
+    busy.is_processing = True
+    manager.put(1, idle)                    # type: ignore
+    manager.put(2, busy)                    # type: ignore
+    busy.memory.archive = 60
+    busy.memory.on_load()                   # type: ignore
+    assert idle.memory.archive == 0 and busy.memory.archive == 60
+    assert manager.resident_bytes() == 80
+    manager.remove(2)
+    busy.memory.on_load()                   # type: ignore
+    assert manager.stats.unloads == 1
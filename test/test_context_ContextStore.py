@@ -0,0 +1,49 @@
+import asyncio
+from context import ContextStore
+from structure import Message
+
+
+HISTORY: list[Message] = [Message(i, "2021-01-01 00:00:00", "Bob", str(i)) for i in range(100)]
+
+
+class FakeHistorySource:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def __call__(self, channel_id: int, message: Message, limit: int) -> list[Message]:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return HISTORY[max(message.id - limit // 2, 0):message.id + limit - limit // 2]
+
+
+class FakeMemory:
+    def __init__(self, archived: list[Message]) -> None:
+        self.channel_id = 1
+        self.archived = archived
+
+    async def get_messages_around(self, message_id: int, amount: int, log=None) -> list[Message]:
+        return [message for message in self.archived if abs(message.id - message_id) <= amount // 2]
+
+
+def test_ContextStore_archived_messages_are_not_fetched():
+    source = FakeHistorySource()
+    store = ContextStore(source, window=4)
+    windows = asyncio.run(store.expand(FakeMemory(HISTORY[:50]), [HISTORY[10]]))   # type: ignore
+    assert [message.id for message in windows[0]] == [8, 9, 10, 11, 12]
+    assert source.calls == 0
+
+
+def test_ContextStore_fetched_windows_are_shared_and_cached():
+    source = FakeHistorySource()
+    store = ContextStore(source, window=4)
+    memory = FakeMemory([])
+    async def main():
+        first = await store.expand(memory, [HISTORY[60], HISTORY[60], HISTORY[70]])   # type: ignore
+        second = await store.expand(memory, [HISTORY[70]])                             # type: ignore
+        return first, second
+    first, second = asyncio.run(main())
+    assert [message.id for message in first[0]] == [58, 59, 60, 61]
+    assert first[0] == first[1]
+    assert second[0] == first[2]
+    assert source.calls == 2
+    assert store.stats.cached == 1
@@ -0,0 +1,298 @@
+import pytest, asyncio, time, json
+import ai, prompt
+from conversation import ComplexMemoryConversation
+from interface import MemoryInterface, DelayInterface
+from delay import NaturalDelay
+from structure import Message
+from utility import Result
+
+
+class FakeMemory(MemoryInterface):
+    '''Keeps added messages in a list, saving takes save_seconds'''
+    def __init__(self, save_seconds: float=0) -> None:
+        super().__init__(1, 1500)
+        self.messages: list[Message] = []
+        self.save_seconds = save_seconds
+        self.textModel = None      # type: ignore
+
+    async def add_messages(self, messages, log=None): 
+        await asyncio.sleep(self.save_seconds)
+        self.messages.extend(messages)
+    async def remove_messages(self, message_ids, log=None): ...
+    async def search_long_term_memory(self, text, log=None): ...
+    async def search_long_term_memory_batch(self, texts, log=None): return Result.ok([])
+    async def get_short_term_memory(self, log=None): return self.messages
+    async def clear_long_term_memory(self, log=None): ...
+    async def clear_short_term_memory(self, log=None): ...
+
+
+class NoDelay(DelayInterface):
+    def ping(self, log=None) -> float: return 0
+
+
+def create_conversation(memory: FakeMemory) -> ComplexMemoryConversation:
+    conversation = ComplexMemoryConversation(1, memory, NaturalDelay(randomness=False))
+    conversation.reading_seconds_per_char = 0.01
+    return conversation
+
+
+def test_ComplexMemoryConversation_reading_extended_by_new_messages():
+    async def main():
+        conversation = create_conversation(FakeMemory())
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "x" * 10), False)
+        async def later():
+            await asyncio.sleep(0.05)
+            await conversation.add_message(Message.message_with_current_date(2, "Bob", "x" * 10), False)
+        start = time.perf_counter()
+        await asyncio.gather(conversation._read(), later())
+        return time.perf_counter() - start
+    elapsed = asyncio.run(main())
+    # 0.1s for the first message plus 0.1s for the second, not a full rereading of both
+    assert 0.18 < elapsed < 0.28
+
+
+def test_ComplexMemoryConversation_reading_stops_when_queue_is_reset():
+    async def main():
+        conversation = create_conversation(FakeMemory())
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "x" * 100), False)
+        async def later():
+            await asyncio.sleep(0.05)
+            await conversation.add_message(Message.message_with_current_date(2, "Me", "hi"), True)
+        start = time.perf_counter()
+        await asyncio.gather(conversation._read(), later())
+        return time.perf_counter() - start
+    assert asyncio.run(main()) < 0.5
+
+
+def test_ComplexMemoryConversation_messages_saved_event():
+    async def main():
+        memory = FakeMemory(save_seconds=0.05)
+        conversation = create_conversation(memory)
+        task = asyncio.create_task(conversation.add_message(Message.message_with_current_date(1, "Bob", "Hello"), False))
+        await asyncio.sleep(0)
+        assert not conversation.messages_saved.is_set()
+        await conversation.messages_saved.wait()
+        await task
+        return memory
+    assert len(asyncio.run(main()).messages) == 1
+
+
+def test_ComplexMemoryConversation_new_message_cancels_generation(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with open("private.json", 'w') as file: json.dump({"userName": "Me"}, file)
+    prompts: list[str] = []
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None):
+        return '|'.join(message.content for message in stm)
+    async def generate(ai_prompt, log=None):
+        prompts.append(ai_prompt)
+        await asyncio.sleep(0.1)
+        return Result.ok(f"answer to {ai_prompt}")
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_generate_response", generate)
+
+    responses: list[str] = []
+    async def main():
+        conversation = ComplexMemoryConversation(1, FakeMemory(), NoDelay())
+        conversation.streaming = False
+        conversation.reading_seconds_per_char = 0.02
+        async def respond(string: str): responses.append(string)
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        task = asyncio.create_task(conversation.communicate(respond))
+        await asyncio.sleep(0.05)
+        await conversation.add_message(Message.message_with_current_date(2, "Bob", "there"), False)
+        await task
+        return conversation
+    conversation = asyncio.run(main())
+    assert prompts == ["hello", "hello|there"]
+    assert responses == ["answer to hello|there"]
+    assert (conversation.generation_stats.used, conversation.generation_stats.cancelled, conversation.generation_stats.wasted) == (1, 1, 0)
+
+
+def test_ComplexMemoryConversation_streams_lines(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with open("private.json", 'w') as file: json.dump({"userName": "Me"}, file)
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None): return ""
+    async def stream(ai_prompt, log=None):
+        for line in ["(2023-01-01 10:00:00) Me: hi", "", "how are you"]:
+            await asyncio.sleep(0.05)
+            yield line
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    delivered: list[tuple[str, float]] = []
+    async def main():
+        conversation = ComplexMemoryConversation(1, FakeMemory(), NoDelay())
+        conversation.reading_seconds_per_char = 0
+        start = time.perf_counter()
+        async def respond(string: str): delivered.append((string, time.perf_counter() - start))
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        await conversation.communicate(respond)
+        return conversation
+    conversation = asyncio.run(main())
+    assert [line for line, _ in delivered] == ["hi", "how are you"]
+    # The first line is sent before the rest is generated
+    assert delivered[0][1] < 0.1 and delivered[1][1] > 0.13
+    assert len(conversation.unread_message_queue) == 0
+
+
+def test_ComplexMemoryConversation_unchanged_state_is_not_generated_twice(monkeypatch):
+    prompts: list[str] = []
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None):
+        return '|'.join(message.content for message in stm)
+    async def stream(ai_prompt, log=None):
+        prompts.append(ai_prompt)
+        yield f"answer to {ai_prompt}"
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    async def draft(conversation: ComplexMemoryConversation) -> list[str]:
+        lines: asyncio.Queue = asyncio.Queue()
+        await conversation._draft_response(lines)
+        return [line for line in iter(lines.get_nowait, None)]
+
+    async def main():
+        conversation = create_conversation(FakeMemory())
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        first, second = await draft(conversation), await draft(conversation)
+        await conversation.add_message(Message.message_with_current_date(2, "Bob", "there"), False)
+        third = await draft(conversation)
+        return conversation, first, second, third
+    conversation, first, second, third = asyncio.run(main())
+    assert first == second == ["answer to hello"] and third == ["answer to hello|there"]
+    assert prompts == ["hello", "hello|there"]
+    assert conversation.generation_stats.cached == 1
+
+
+def test_ComplexMemoryConversation_only_generated_drafts_are_wasted(monkeypatch):
+    failing: list[bool] = [False]
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None):
+        return '|'.join(message.content for message in stm)
+    async def stream(ai_prompt, log=None):
+        if failing[0]: raise ConnectionError("OpenAI is down")
+        yield f"answer to {ai_prompt}"
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    async def main():
+        conversation = create_conversation(FakeMemory())
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        conversation._redraft()
+        await conversation._draft                           # type: ignore
+        # Thrown away after it was generated, then replayed from the cache
+        conversation._redraft()
+        await conversation._draft                           # type: ignore
+        # The replayed draft is thrown away, then the new one fails
+        failing[0] = True
+        await conversation.add_message(Message.message_with_current_date(2, "Bob", "there"), False)
+        assert not await conversation._draft                # type: ignore
+        conversation._discard_draft()
+        return conversation
+    conversation = asyncio.run(main())
+    assert (conversation.generation_stats.wasted, conversation.generation_stats.cached) == (1, 1)
+
+
+def test_ComplexMemoryConversation_no_draft_left_after_empty_response(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with open("private.json", 'w') as file: json.dump({"userName": "Me"}, file)
+    prompts: list[str] = []
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None): return "prompt"
+    async def stream(ai_prompt, log=None):
+        prompts.append(ai_prompt)
+        return
+        yield
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    responses: list[str] = []
+    async def main():
+        conversation = ComplexMemoryConversation(1, FakeMemory(), NoDelay())
+        conversation.reading_seconds_per_char = 0
+        async def respond(string: str): responses.append(string)
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        await conversation.communicate(respond)
+        draft = conversation._draft
+        await asyncio.sleep(0.05)
+        return conversation, draft
+    conversation, draft = asyncio.run(main())
+    assert responses == []
+    assert draft is None and len(prompts) == 1
+    assert len(conversation.unread_message_queue) == 1
+
+
+def test_ComplexMemoryConversation_empty_response_generated_again(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with open("private.json", 'w') as file: json.dump({"userName": "Me"}, file)
+    prompts: list[str] = []
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None):
+        return '|'.join(message.content for message in stm)
+    async def stream(ai_prompt, log=None):
+        prompts.append(ai_prompt)
+        return
+        yield
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    async def main():
+        conversation = ComplexMemoryConversation(1, FakeMemory(), NoDelay())
+        conversation.reading_seconds_per_char = 0
+        async def respond(string: str): ...
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        await conversation.communicate(respond)
+        await conversation.communicate(respond)
+        assert len(conversation.response_cache) == 0
+        return conversation
+    conversation = asyncio.run(main())
+    # Nothing was sent, the second session on the same state tries again instead of replaying the empty response
+    assert prompts == ["hello", "hello"]
+    assert conversation.generation_stats.cached == 0
+
+
+def test_ComplexMemoryConversation_messages_queued_while_saving():
+    async def main():
+        memory = FakeMemory(save_seconds=0.05)
+        conversation = create_conversation(memory)
+        conversation.queue_message(Message.message_with_current_date(1, "Bob", "Hello"), False)
+        saving = asyncio.create_task(conversation.save_messages())
+        await asyncio.sleep(0.01)
+        # Queued at once, while the first message is still being saved
+        conversation.queue_message(Message.message_with_current_date(2, "Bob", "there"), False)
+        assert [message.id for message in conversation.unread_message_queue] == [1, 2]
+        await conversation.save_messages()      # Picked up by the running save
+        assert not conversation.messages_saved.is_set() and conversation.is_saving_message
+        await saving
+        return conversation, memory
+    conversation, memory = asyncio.run(main())
+    assert [message.id for message in memory.messages] == [1, 2]
+    assert conversation.messages_saved.is_set() and not conversation.is_saving_message
+
+
+def test_ComplexMemoryConversation_messages_during_delivery_are_answered(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with open("private.json", 'w') as file: json.dump({"userName": "Me"}, file)
+    prompts: list[str] = []
+    async def prompt_crafter(ltm, stm, ratio, textModel, ltmTextModel=None, log=None):
+        return '|'.join(message.content for message in stm)
+    async def stream(ai_prompt, log=None):
+        prompts.append(ai_prompt)
+        for line in [f"answer to {ai_prompt}", "and more"]:
+            await asyncio.sleep(0.05)
+            yield line
+    monkeypatch.setattr(prompt, "prompt_crafter", prompt_crafter)
+    monkeypatch.setattr(ai, "openai_stream_response", stream)
+
+    responses: list[str] = []
+    async def main():
+        conversation = ComplexMemoryConversation(1, FakeMemory(), NoDelay())
+        conversation.reading_seconds_per_char = 0
+        async def respond(string: str):
+            responses.append(string)
+            # Arrives while the rest of the response is being delivered
+            if string == "answer to hello":
+                await conversation.add_message(Message.message_with_current_date(2, "Bob", "there"), False)
+        await conversation.add_message(Message.message_with_current_date(1, "Bob", "hello"), False)
+        await conversation.communicate(respond)
+        return conversation
+    conversation = asyncio.run(main())
+    assert prompts == ["hello", "hello|there"]
+    assert responses == ["answer to hello", "and more", "answer to hello|there", "and more"]
+    assert len(conversation.unread_message_queue) == 0
@@ -0,0 +1,51 @@
+import pytest
+from embedding_cache import EmbeddingCache
+
+
+MODEL = "text-embedding-ada-002"
+
+
+@pytest.fixture()
+def directory(tmp_path) -> str:
+    return str(tmp_path / "embedding-cache")
+
+
+def test_EmbeddingCache_miss_then_hit(directory: str):
+    cache = EmbeddingCache(directory, 3, 10)
+    assert cache.get_many(MODEL, ["lol"]) == [None]
+    cache.put_many(MODEL, ["lol"], [[1, 2, 3]])
+    assert cache.get_many(MODEL, ["lol", "ok"]) == [[1, 2, 3], None]
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 2
+
+
+def test_EmbeddingCache_normalized_text(directory: str):
+    cache = EmbeddingCache(directory, 3, 10)
+    cache.put_many(MODEL, ["hello  world "], [[1, 2, 3]])
+    assert cache.get_many(MODEL, ["hello world"]) == [[1, 2, 3]]
+    assert cache.get_many("other-model", ["hello world"]) == [None]
+
+
+def test_EmbeddingCache_lru_eviction(directory: str):
+    cache = EmbeddingCache(directory, 2, 2)
+    cache.put_many(MODEL, ["a", "b"], [[1, 1], [2, 2]])
+    cache.get_many(MODEL, ["a"])
+    cache.put_many(MODEL, ["c"], [[3, 3]])
+    assert cache.get_many(MODEL, ["a", "b", "c"]) == [[1, 1], None, [3, 3]]
+    assert cache.stats.evictions == 1
+    assert len(cache) == 2
+
+
+def test_EmbeddingCache_persists(directory: str):
+    cache = EmbeddingCache(directory, 2, 2)
+    cache.put_many(MODEL, ["a", "b"], [[1, 1], [2, 2]])
+    cache.put_many(MODEL, ["c"], [[3, 3]])
+    reopened = EmbeddingCache(directory, 2, 2)
+    assert reopened.get_many(MODEL, ["a", "b", "c"]) == [None, [2, 2], [3, 3]]
+    reopened.put_many(MODEL, ["d"], [[4, 4]])
+    assert reopened.get_many(MODEL, ["b", "c", "d"]) == [None, [3, 3], [4, 4]]
+
+
+def test_EmbeddingCache_other_size_starts_empty(directory: str):
+    EmbeddingCache(directory, 2, 2).put_many(MODEL, ["a"], [[1, 1]])
+    assert EmbeddingCache(directory, 2, 4).get_many(MODEL, ["a"]) == [None]
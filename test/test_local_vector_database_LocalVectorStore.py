@@ -0,0 +1,141 @@
+import asyncio
+import numpy as np
+import pytest
+import local_vector_database
+from local_vector_database import LocalVectorStore, Quantization
+from structure import Message, DatabaseEntry
+
+
+DIM = 8
+
+
+def entries(vectors: np.ndarray, first_id: int=0) -> list[DatabaseEntry]:
+    return [DatabaseEntry(Message(first_id + i, "2021-01-01 00:00:00.000000", "Bob", f"message {first_id + i}"), vector.tolist()) for i, vector in enumerate(vectors)]
+
+
+def exact_ids(vectors: np.ndarray, query: np.ndarray, limit: int) -> list[int]:
+    return np.argsort(((vectors - query) ** 2).sum(axis=1), kind="stable")[:limit].tolist()
+
+
+@pytest.fixture()
+def directory(tmp_path) -> str:
+    return str(tmp_path / "vector-memory")
+
+
+def test_LocalVectorStore_exact_search(directory: str):
+    async def run():
+        store = LocalVectorStore(directory, DIM)
+        vectors = np.random.default_rng(0).standard_normal((500, DIM)).astype(np.float32)
+        assert await store.add_entries(1, entries(vectors))
+        hits = (await store.search_hits(1, [vectors[7].tolist(), vectors[42].tolist()], limit=5)).unwrap()
+        assert [hit.message.id for hit in hits[0]] == exact_ids(vectors, vectors[7], 5)
+        assert [hit.message.id for hit in hits[1]] == exact_ids(vectors, vectors[42], 5)
+        assert hits[0][0].distance == pytest.approx(0, abs=1e-4)
+        assert hits[0][0].message.content == "message 7"
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_remove_and_replace(directory: str):
+    async def run():
+        store = LocalVectorStore(directory, DIM)
+        vectors = np.eye(DIM, dtype=np.float32)
+        await store.add_entries(1, entries(vectors))
+        await store.remove_entries(1, [0])
+        hits = (await store.search_hits(1, [vectors[0].tolist()], limit=DIM)).unwrap()[0]
+        assert 0 not in [hit.message.id for hit in hits]
+        assert len(hits) == DIM - 1
+
+        await store.add_entries(1, entries(vectors[3:4] * 5, first_id=1))     # Same id, new vector
+        hits = (await store.search_hits(1, [vectors[1].tolist()], limit=1)).unwrap()[0]
+        assert hits[0].message.id != 1
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_persists(directory: str):
+    async def run():
+        vectors = np.random.default_rng(1).standard_normal((50, DIM)).astype(np.float32)
+        store = LocalVectorStore(directory, DIM)
+        await store.add_entries(-5, entries(vectors))
+        await store.remove_entries(-5, [3])
+        await store.close()
+
+        store = LocalVectorStore(directory, DIM)
+        assert store.has_channel(-5)
+        hits = (await store.search_hits(-5, [vectors[3].tolist()], limit=50)).unwrap()[0]
+        assert len(hits) == 49
+        assert [hit.message.id for hit in hits] == [id for id in exact_ids(vectors, vectors[3], 50) if id != 3]
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_compaction(directory: str, monkeypatch):
+    monkeypatch.setattr(local_vector_database, "_COMPACT_MIN_DEAD", 10)
+    async def run():
+        vectors = np.random.default_rng(2).standard_normal((40, DIM)).astype(np.float32)
+        store = LocalVectorStore(directory, DIM)
+        await store.add_entries(1, entries(vectors))
+        await store.remove_entries(1, list(range(30)))
+        assert store.stats.compactions == 1
+        await store.close()
+
+        store = LocalVectorStore(directory, DIM)
+        hits = (await store.search_hits(1, [vectors[35].tolist()], limit=40)).unwrap()[0]
+        assert sorted(hit.message.id for hit in hits) == list(range(30, 40))
+        assert hits[0].message.id == 35
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_index(directory: str):
+    async def run():
+        rng = np.random.default_rng(3)
+        centers = rng.standard_normal((16, DIM)).astype(np.float32) * 10
+        vectors = (centers[rng.integers(0, 16, 4000)] + rng.standard_normal((4000, DIM))).astype(np.float32)
+        store = LocalVectorStore(directory, DIM, index_min_rows=1000)
+        await store.add_entries(1, entries(vectors))
+        assert await store.create_index()
+        assert store.stats.builds == 1
+
+        recall: float = 0
+        for query in vectors[:50]:
+            hits = (await store.search_hits(1, [query.tolist()], limit=10)).unwrap()[0]
+            recall += len(set(hit.message.id for hit in hits) & set(exact_ids(vectors, query, 10))) / 10
+        assert store.stats.indexed_searches == 50
+        assert recall / 50 > 0.9
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("quantization", [Quantization.FLOAT16, Quantization.INT8])
+def test_LocalVectorStore_quantized_search(directory: str, quantization: Quantization):
+    async def run():
+        rng = np.random.default_rng(4)
+        vectors = rng.standard_normal((2000, 32)).astype(np.float32)
+        queries = vectors[:20] + 0.1 * rng.standard_normal((20, 32)).astype(np.float32)
+        store = LocalVectorStore(directory, 32, quantization=quantization)
+        await store.add_entries(1, entries(vectors))
+
+        hits = (await store.search_hits(1, queries.tolist(), limit=10)).unwrap()
+        recall: float = sum(len(set(hit.message.id for hit in query_hits) & set(exact_ids(vectors, query, 10))) for query, query_hits in zip(queries, hits)) / 200
+        assert recall > 0.95
+        # Re-ranked distances are exact
+        assert hits[0][0].distance == pytest.approx(float(((vectors[hits[0][0].message.id] - queries[0]) ** 2).sum()), rel=1e-4)
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_quantized_memory(directory: str):
+    async def run():
+        vectors = np.random.default_rng(5).standard_normal((100, 64)).astype(np.float32)
+        stores = [LocalVectorStore(f"{directory}/{quantization.value}", 64, quantization=quantization) for quantization in Quantization]
+        for store in stores: await store.add_entries(1, entries(vectors))
+        full, half, quarter = [store.resident_bytes() for store in stores]
+        assert full > half > quarter
+    asyncio.run(run())
+
+
+def test_LocalVectorStore_unknown_channel(directory: str):
+    async def run():
+        store = LocalVectorStore(directory, DIM)
+        assert (await store.search_hits(9, [[0.0] * DIM])).unwrap() == [[]]
+        assert not await store.remove_entries(9, [1])
+        assert await store.create_channel_memory_if_new(9)
+        assert await store.remove_channel_memory_if_exists(9)
+        assert not store.has_channel(9)
+    asyncio.run(run())
@@ -1,25 +1,36 @@
-import pytest
+import pytest, asyncio, os
 from vector_database import CollectionType, DatabaseEntry, _DIM, connect_to_database, disconnect_from_database, DROP_ALL_MEMORY
-from random import random
+from local_vector_database import DROP_ALL_LOCAL_MEMORY
+from random import random, Random
 from structure import Message
 from datetime import datetime, timedelta
-from random import random
-import prompt
+from utility import Result
+import prompt, ai
 
-from memory import ComplexMemory
+from memory import ComplexMemory, VectorBackend
 
 
 
-@pytest.fixture(scope="module")
-def setup():
+@pytest.fixture(params=[VectorBackend.MILVUS, VectorBackend.LOCAL], ids=lambda backend : backend.value)
+def setup(request, monkeypatch, tmp_path):
+    # Memory files go to a fresh channel-memory/, and the same string always gets the same embedding
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("channel-memory")
+    async def embed_strings(strings, log=None, priority=None):
+        return Result.ok([[Random(string).random()*2-1 for _ in range(_DIM)] for string in strings])
+    monkeypatch.setattr(ai, "embed_strings", embed_strings)
+    if request.param == VectorBackend.LOCAL:
+        yield request.param
+        asyncio.run(DROP_ALL_LOCAL_MEMORY(CollectionType.TESTING))
+        return
     try:
-        connect_to_database()
+        asyncio.run(connect_to_database())
     except Exception as e:
         pytest.fail("Failed to connect to the database: {}".format(str(e)))
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-    yield
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-    disconnect_from_database()
+    asyncio.run(DROP_ALL_MEMORY(CollectionType.TESTING))
+    yield request.param
+    asyncio.run(DROP_ALL_MEMORY(CollectionType.TESTING))
+    asyncio.run(disconnect_from_database())
 
 
 @pytest.fixture()
@@ -42,64 +53,72 @@ def test_channel() -> int:
     return -1
 
 
-@pytest.fixture()
-def memory(setup, test_channel):
-    memory: ComplexMemory = ComplexMemory(test_channel, 300, CollectionType.TESTING)
-    memory.clear_long_term_memory()
-    memory.clear_short_term_memory()
-    yield memory
-
+def run(backend: VectorBackend, test_channel: int, stm_limit: int, test):
+    '''Runs the test on a fresh ComplexMemory, on one event loop'''
+    async def main():
+        memory: ComplexMemory = await ComplexMemory.create(test_channel, stm_limit, CollectionType.TESTING, backend)
+        await memory.clear_long_term_memory()
+        await memory.clear_short_term_memory()
+        await test(memory)
+    asyncio.run(main())
 
-@pytest.fixture()
-def memory2(setup, test_channel):
-    memory2: ComplexMemory = ComplexMemory(test_channel, 0, CollectionType.TESTING)
-    memory2.clear_long_term_memory()
-    memory2.clear_short_term_memory()
-    yield memory2
 
+async def search(memory: ComplexMemory, text: str) -> list[Message]:
+    return (await memory.search_long_term_memory(text)).unwrap()
 
 
-def test_add_1_message(memory: ComplexMemory, messages: list[Message]):
-    memory.add_messages([messages[0]])
-    assert memory.get_short_term_memory() == [messages[0]]
-    assert memory.search_long_term_memory("Hello, World!") == []
-    assert memory.STM.get().tokens <= 300
+def test_add_1_message(setup: VectorBackend, test_channel: int, messages: list[Message]):
+    async def test(memory: ComplexMemory):
+        await memory.add_messages([messages[0]])
+        assert await memory.get_short_term_memory() == [messages[0]]
+        assert await search(memory, "Hello, World!") == []
+        assert (await memory.STM.get()).tokens <= 300
+    run(setup, test_channel, 300, test)
 
 
-def test_add_1_message_memory2(memory2: ComplexMemory, messages: list[Message]):
-    memory2.add_messages([messages[0]])
-    assert memory2.get_short_term_memory() == []
-    assert memory2.search_long_term_memory("Hello, World!") == [messages[0]]
-    assert memory2.STM.get().tokens <= 0
+def test_add_1_message_memory2(setup: VectorBackend, test_channel: int, messages: list[Message]):
+    async def test(memory2: ComplexMemory):
+        await memory2.add_messages([messages[0]])
+        assert await memory2.get_short_term_memory() == []
+        assert await search(memory2, "Hello, World!") == [messages[0]]
+        assert (await memory2.STM.get()).tokens <= 0
+    run(setup, test_channel, 0, test)
 
 
-def test_add_messages(memory: ComplexMemory, messages: list[Message]):
-    conversation: prompt.GeneratedConversation = prompt.DefaultTextModel().conversation_crafter_newest_to_oldest(messages, 300)
+async def add_messages(memory: ComplexMemory, messages: list[Message]):
+    conversation: prompt.GeneratedConversation = await prompt.DefaultTextModel().conversation_crafter_newest_to_oldest(messages, 300)
     messages_that_should_be_in_ltm : list[Message] = messages[:len(messages)-len(conversation.messages)]
   # print(len(messages_that_should_be_in_ltm))
-    memory.add_messages(messages)
-    assert memory.get_short_term_memory() == messages[len(messages_that_should_be_in_ltm):]
-    assert len(memory.search_long_term_memory("Hello, World!")) > 0
-    assert memory.STM.get().tokens <= 300
+    await memory.add_messages(messages)
+    assert await memory.get_short_term_memory() == messages[len(messages_that_should_be_in_ltm):]
+    assert len(await search(memory, "Hello, World!")) > 0
+    assert (await memory.STM.get()).tokens <= 300
   # print(prompt.tokens_from_string(prompt.DefaultTextModel()._process_messages(memory.STM.get().messages).string))
 
 
-# def test_remove_messages(memory: ComplexMemory, test_channel: int, messages: list[Message]):
-#     pass
+def test_add_messages(setup: VectorBackend, test_channel: int, messages: list[Message]):
+    run(setup, test_channel, 300, lambda memory : add_messages(memory, messages))
 
 
-def test_add_no_messages(memory: ComplexMemory, messages: list[Message]):
-    memory.add_messages([])
-    assert memory.get_short_term_memory() == []
-    assert memory.search_long_term_memory("Hello, World!") == []
+# def test_remove_messages(memory: ComplexMemory, test_channel: int, messages: list[Message]):
+#     pass
 
 
-def test_clear_messages(memory: ComplexMemory, messages: list[Message]):
-    test_add_messages(memory, messages)
-    memory.clear_short_term_memory()
-    assert memory.get_short_term_memory() == []
-    assert len(memory.search_long_term_memory("Hello, World!")) > 0
-    memory.clear_long_term_memory()
-    assert memory.get_short_term_memory() == []
-    assert memory.search_long_term_memory("Hello, World!") == []
-    
\ No newline at end of file
+def test_add_no_messages(setup: VectorBackend, test_channel: int, messages: list[Message]):
+    async def test(memory: ComplexMemory):
+        await memory.add_messages([])
+        assert await memory.get_short_term_memory() == []
+        assert await search(memory, "Hello, World!") == []
+    run(setup, test_channel, 300, test)
+
+
+def test_clear_messages(setup: VectorBackend, test_channel: int, messages: list[Message]):
+    async def test(memory: ComplexMemory):
+        await add_messages(memory, messages)
+        await memory.clear_short_term_memory()
+        assert await memory.get_short_term_memory() == []
+        assert len(await search(memory, "Hello, World!")) > 0
+        await memory.clear_long_term_memory()
+        assert await memory.get_short_term_memory() == []
+        assert await search(memory, "Hello, World!") == []
+    run(setup, test_channel, 300, test)
@@ -1,6 +1,7 @@
-import pytest
+import pytest, asyncio, json, os
 from memory import MemoryJson
-from structure import Message
+from storage import AppendOnlyLog
+from structure import Message, ShortTermMemory, MessageStore
 from datetime import datetime, timedelta
 import random
 
@@ -20,30 +21,89 @@ def messages() -> list[Message]:
     return messages
 
 
+@pytest.fixture()
+def test_channel(monkeypatch, tmp_path) -> int:
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("channel-memory")
+    return -1
+
+
 @pytest.fixture()
 def memory(test_channel):
-    memory: MemoryJson = MemoryJson(test_channel)
-    memory.clear()
+    memory: MemoryJson = asyncio.run(MemoryJson.create(test_channel))
+    asyncio.run(memory.clear())
     yield memory
 
 
-@pytest.fixture()
-def test_channel() -> int:
-    return -1
+def reopen(test_channel: int) -> MemoryJson:
+    '''The memory as it's loaded from disk by a new process'''
+    return asyncio.run(MemoryJson.create(test_channel))
+
+
+def records(test_channel: int) -> list:
+    return AppendOnlyLog(MemoryJson.get_memory_file_path(test_channel)).read()
 
 
 def test_MemoryJson_add_list(memory: MemoryJson, messages: list[Message]):
-    memory.add_messages(messages[:5])
-    memory.add_messages(messages[5:7])
-    assert memory.get().messages == messages[:7]
+    asyncio.run(memory.add_messages(messages[:5]))
+    asyncio.run(memory.add_messages(messages[5:7]))
+    assert asyncio.run(memory.get()).messages == messages[:7]
 
 
 def test_MemoryJson_add_empty_list(memory: MemoryJson, messages: list[Message]):
-    memory.add_messages([])
-    assert memory.get().messages == []
+    asyncio.run(memory.add_messages([]))
+    assert asyncio.run(memory.get()).messages == []
 
 
 def test_MemoryJson_clear(memory: MemoryJson, messages: list[Message]):
-    memory.add_messages(messages[:5])
-    memory.clear()
-    assert memory.get().messages == []
\ No newline at end of file
+    asyncio.run(memory.add_messages(messages[:5]))
+    asyncio.run(memory.clear())
+    assert asyncio.run(memory.get()).messages == []
+
+
+def test_MemoryJson_replayed_on_create(memory: MemoryJson, test_channel: int, messages: list[Message]):
+    asyncio.run(memory.add_messages(messages[:5]))
+    asyncio.run(memory.add_messages(messages[5:9]))
+    asyncio.run(memory.remove_oldest_messages(3))
+    assert [record[0] for record in records(test_channel)] == ["snapshot", "add", "add", "remove"]
+    loaded: ShortTermMemory = asyncio.run(reopen(test_channel).get())
+    assert loaded.messages == messages[3:9]
+    assert loaded.tokens == memory.memory.tokens
+
+
+def test_MemoryJson_compacted_once_mostly_removed(memory: MemoryJson, test_channel: int, messages: list[Message]):
+    asyncio.run(memory.add_messages(messages))
+    asyncio.run(memory.remove_oldest_messages(MemoryJson.COMPACT_MIN_DEAD_MESSAGES))
+    assert len(records(test_channel)) == 3 and memory.dead_messages == MemoryJson.COMPACT_MIN_DEAD_MESSAGES
+    asyncio.run(memory.remove_oldest_messages(1))
+    assert [record[0] for record in records(test_channel)] == ["snapshot"]
+    assert memory.dead_messages == 0
+    assert asyncio.run(reopen(test_channel).get()).messages == messages[MemoryJson.COMPACT_MIN_DEAD_MESSAGES + 1:]
+
+
+def test_MemoryJson_legacy_file_migrated(test_channel: int, messages: list[Message]):
+    legacy_path: str = MemoryJson.get_legacy_memory_file_path(test_channel)
+    with open(legacy_path, 'w', encoding="utf-8") as file:
+        json.dump(ShortTermMemory(42, MessageStore(messages[:10])).to_json(), file)
+    loaded: ShortTermMemory = asyncio.run(reopen(test_channel).get())
+    assert loaded.messages == messages[:10] and loaded.tokens == 42
+    assert not os.path.exists(legacy_path) and os.path.isfile(legacy_path + ".bak")
+    assert [record[0] for record in records(test_channel)] == ["snapshot"]
+    # Only migrated once, the backup isn't read again
+    assert not MemoryJson.migrate_legacy_memory_if_exists(test_channel)
+
+
+def test_MemoryJson_torn_last_line_dropped(memory: MemoryJson, test_channel: int, messages: list[Message]):
+    asyncio.run(memory.add_messages(messages[:5]))
+    asyncio.run(memory.add_messages(messages[5:7]))
+    file_path: str = MemoryJson.get_memory_file_path(test_channel)
+    size: int = os.path.getsize(file_path)
+    with open(file_path, 'r+b') as file:
+        file.truncate(size - 10)
+    assert asyncio.run(reopen(test_channel).get()).messages == messages[:5]
+    assert os.path.getsize(file_path) < size - 10
+
+    # Appends after the cut off record are read back
+    reopened: MemoryJson = reopen(test_channel)
+    asyncio.run(reopened.add_messages(messages[7:8]))
+    assert asyncio.run(reopen(test_channel).get()).messages == messages[:5] + messages[7:8]
@@ -1,24 +1,30 @@
-import pytest
+import pytest, asyncio
 from vector_database import CollectionType, DatabaseEntry, _DIM, connect_to_database, disconnect_from_database, DROP_ALL_MEMORY
+from local_vector_database import DROP_ALL_LOCAL_MEMORY
 from random import random
-from memory import MemoryMilvus
-from structure import Message
+from memory import MemoryMilvus, VectorBackend, merge_search_hits
+from structure import Message, SearchHit
 
 # memory.add_messages()
 # memory.remove_messages()
 # memory.get()
 # memory.clear()
 
-@pytest.fixture(scope="module")
-def setup():
+@pytest.fixture(params=[VectorBackend.MILVUS, VectorBackend.LOCAL], ids=lambda backend : backend.value)
+def backend(request, monkeypatch, tmp_path):
+    if request.param == VectorBackend.LOCAL:
+        monkeypatch.chdir(tmp_path)
+        yield request.param
+        asyncio.run(DROP_ALL_LOCAL_MEMORY(CollectionType.TESTING))
+        return
     try:
-        connect_to_database()
+        asyncio.run(connect_to_database())
     except Exception as e:
         pytest.fail("Failed to connect to the database: {}".format(str(e)))
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-    yield
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-    disconnect_from_database()
+    asyncio.run(DROP_ALL_MEMORY(CollectionType.TESTING))
+    yield request.param
+    asyncio.run(DROP_ALL_MEMORY(CollectionType.TESTING))
+    asyncio.run(disconnect_from_database())
 
 
 @pytest.fixture()
@@ -47,33 +53,64 @@ def test_channel() -> int:
     return 1
 
 
-@pytest.fixture()
-def memory(setup, test_channel):
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-    yield MemoryMilvus(test_channel, CollectionType.TESTING)
-    DROP_ALL_MEMORY(CollectionType.TESTING)
-
-
-def test_MemoryMilvus_add_list(memory: MemoryMilvus, messages: list[Message], embeddings: list[list[float]]):
-    memory.add_messages(messages[:3], embeddings[:3])
-    assert len(memory.search(embeddings[2]).unwrap()) == 3
-    assert memory.search(embeddings[2]).unwrap()[0] == messages[2]
-
-
-def test_MemoryMilvus_add_empty_list(memory: MemoryMilvus, messages: list[Message], embeddings: list[list[float]]):
-    memory.add_messages([], [])
-    assert memory.search(embeddings[0]).unwrap() == []
-
-
-def test_MemoryMilvus_clear(memory: MemoryMilvus, messages: list[Message], embeddings: list[list[float]]):
-    memory.add_messages(messages[:5], embeddings[:5])
-    memory.clear()
-    assert memory.search(embeddings[0]).unwrap() == []
-
-
-def test_MemoryMilvus_remove_messages(memory: MemoryMilvus, messages: list[Message], embeddings: list[list[float]]):
-    memory.add_messages(messages[:5], embeddings[:5])
-    memory.remove_messages([2, 3])
-    res: list[Message] = memory.search(embeddings[2]).unwrap()
-    assert len(res) == 3
-    assert res[0].id != 2
+def run(backend: VectorBackend, test_channel: int, test):
+    '''Runs the test on a fresh MemoryMilvus, on one event loop'''
+    async def main():
+        memory: MemoryMilvus = await MemoryMilvus.create(test_channel, CollectionType.TESTING, backend)
+        await memory.clear()
+        await test(memory)
+    asyncio.run(main())
+
+
+def test_MemoryMilvus_add_list(backend: VectorBackend, test_channel: int, messages: list[Message], embeddings: list[list[float]]):
+    async def test(memory: MemoryMilvus):
+        await memory.add_messages(messages[:3], embeddings[:3])
+        assert len((await memory.search(embeddings[2])).unwrap()) == 3
+        assert (await memory.search(embeddings[2])).unwrap()[0] == messages[2]
+    run(backend, test_channel, test)
+
+
+def test_MemoryMilvus_add_empty_list(backend: VectorBackend, test_channel: int, messages: list[Message], embeddings: list[list[float]]):
+    async def test(memory: MemoryMilvus):
+        await memory.add_messages([], [])
+        assert (await memory.search(embeddings[0])).unwrap() == []
+    run(backend, test_channel, test)
+
+
+def test_MemoryMilvus_clear(backend: VectorBackend, test_channel: int, messages: list[Message], embeddings: list[list[float]]):
+    async def test(memory: MemoryMilvus):
+        await memory.add_messages(messages[:5], embeddings[:5])
+        await memory.clear()
+        assert (await memory.search(embeddings[0])).unwrap() == []
+    run(backend, test_channel, test)
+
+
+def test_MemoryMilvus_remove_messages(backend: VectorBackend, test_channel: int, messages: list[Message], embeddings: list[list[float]]):
+    async def test(memory: MemoryMilvus):
+        await memory.add_messages(messages[:5], embeddings[:5])
+        await memory.remove_messages([2, 3])
+        res: list[Message] = (await memory.search(embeddings[2])).unwrap()
+        assert len(res) == 3
+        assert res[0].id != 2
+    run(backend, test_channel, test)
+
+
+def test_MemoryMilvus_search_many(backend: VectorBackend, test_channel: int, messages: list[Message], embeddings: list[list[float]]):
+    async def test(memory: MemoryMilvus):
+        await memory.add_messages(messages[:5], embeddings[:5])
+        hits: list[SearchHit] = (await memory.search_many([embeddings[1], embeddings[3]], limit=3)).unwrap()
+        assert len(hits) == 3
+        assert {hit.message.id for hit in hits[:2]} == {messages[1].id, messages[3].id}
+    run(backend, test_channel, test)
+
+
+def test_merge_search_hits(messages: list[Message]):
+    hits: list[list[SearchHit]] = [
+        [SearchHit(messages[0], 0.5), SearchHit(messages[1], 0.9)],
+        [SearchHit(messages[1], 0.1), SearchHit(messages[2], 0.7)],
+        []]
+    merged: list[SearchHit] = merge_search_hits(hits, 10)
+    assert [hit.message for hit in merged] == [messages[1], messages[0], messages[2]]
+    assert merged[0].distance == 0.1
+    assert len(merge_search_hits(hits, 2)) == 2
+    assert merge_search_hits([], 10) == []
@@ -0,0 +1,110 @@
+import pytest, asyncio, json
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from openai_client import OpenAIClient, OpenAIError
+
+
+class MockOpenAI:
+    '''Local stand-in for the OpenAI API, fails the first `failures` requests with `status`'''
+    def __init__(self, failures: int=0, status: int=429) -> None:
+        self.failures = failures
+        self.status = status
+        self.requests: list[dict] = []
+        self.connections: set = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        return app
+
+    async def _fail(self, request: web.Request) -> web.Response | None:
+        self.requests.append(await request.json())
+        self.connections.add(request.transport)
+        if len(self.requests) <= self.failures:
+            return web.json_response({"error": {"message": "Rate limit reached"}}, status=self.status, headers={"Retry-After": "0"})
+        return None
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        failure = await self._fail(request)
+        if failure is not None: return failure
+        body = self.requests[-1]
+        if not body.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": "Hello!"}}], "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for piece in ["Hel", "lo\nWor", "ld"]:
+            await response.write(f"data: {json.dumps({'choices': [{'delta': {'content': piece}}]})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        failure = await self._fail(request)
+        if failure is not None: return failure
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        strings = self.requests[-1]["input"]
+        return web.json_response({"data": [{"embedding": [float(len(string))]} for string in strings], "usage": {"total_tokens": len(strings)}})
+
+
+def run_with_server(mock: MockOpenAI, test, **client_options):
+    async def main():
+        server = TestServer(mock.app())
+        await server.start_server()
+        client = OpenAIClient("key", str(server.make_url("/v1")), backoff=0.001, **client_options)
+        try:
+            return await test(client)
+        finally:
+            await client.close()
+            await server.close()
+    return asyncio.run(main())
+
+
+def test_OpenAIClient_chat_completion():
+    mock = MockOpenAI()
+    response = run_with_server(mock, lambda client: client.chat_completion([{"role": "user", "content": "Hi"}], "gpt-3.5-turbo"))
+    assert response["choices"][0]["message"]["content"] == "Hello!"
+    assert mock.requests[0]["messages"][0]["content"] == "Hi"
+
+
+def test_OpenAIClient_retries_rate_limits():
+    mock = MockOpenAI(failures=2)
+    async def test(client: OpenAIClient):
+        return await client.embeddings(["a", "bb"], "ada"), client.stats
+    response, stats = run_with_server(mock, test)
+    assert [data["embedding"] for data in response["data"]] == [[1.0], [2.0]]
+    assert stats.requests == 3 and stats.retries == 2 and stats.failures == 0
+
+
+def test_OpenAIClient_gives_up():
+    mock = MockOpenAI(failures=10, status=503)
+    with pytest.raises(OpenAIError):
+        run_with_server(mock, lambda client: client.embeddings(["a"], "ada"), max_retries=2)
+    assert len(mock.requests) == 3
+
+
+def test_OpenAIClient_does_not_retry_client_errors():
+    mock = MockOpenAI(failures=1, status=400)
+    with pytest.raises(OpenAIError) as error:
+        run_with_server(mock, lambda client: client.embeddings(["a"], "ada"))
+    assert error.value.status == 400 and len(mock.requests) == 1
+
+
+def test_OpenAIClient_stream():
+    mock = MockOpenAI()
+    async def test(client: OpenAIClient):
+        return [content async for content in client.chat_completion_stream([{"role": "user", "content": "Hi"}], "gpt-3.5-turbo")]
+    assert ''.join(run_with_server(mock, test)) == "Hello\nWorld"
+
+
+def test_OpenAIClient_endpoint_concurrency_and_keep_alive():
+    mock = MockOpenAI()
+    async def test(client: OpenAIClient):
+        await asyncio.gather(*[client.embeddings([str(i)], "ada") for i in range(10)])
+    run_with_server(mock, test, concurrency={"embeddings": 2})
+    assert mock.peak_in_flight == 2
+    assert len(mock.connections) <= 2
@@ -1,6 +1,7 @@
-import pytest
+import pytest, asyncio, os
 from structure import Message
-from prompt import TextModelInterface, DefaultTextModel, GeneratedConversation
+from utility import LRUCache
+from prompt import TextModelInterface, DefaultTextModel, GeneratedConversation, prompt_crafter
 
 
 @pytest.fixture()
@@ -87,4 +88,15 @@ def test_token_pop(text_models: list[TextModelInterface], test_messages: list[Me
         #     tokens_removed: int = sum([model.get_tokens_removed_from_subset_pop(0, i, pop_oldest=False) for i in range(amount_to_pop)])
         #     tokens_from_subset: int = model._process_messages(test_messages[:len(test_messages)-amount_to_pop]).tokens
         #     print(amount_to_pop)
-        #     assert tokens_from_subset == conversation.tokens - tokens_removed
\ No newline at end of file
+        #     assert tokens_from_subset == conversation.tokens - tokens_removed
+
+def test_prompt_crafter_ltm_not_in_stm_token_cache(test_messages: list[Message], monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("prompts")
+    with open("prompts/default.txt", 'w') as file: file.write("{long_term_memory_string}|{short_term_memory_string}")
+    stm_model = DefaultTextModel()
+    ltm_model = DefaultTextModel(LRUCache(4))
+    stm, ltm = test_messages[8:11], [test_messages[0:4], test_messages[4:8]]
+    asyncio.run(prompt_crafter(ltm, stm, 0.5, stm_model, ltm_model))
+    assert {id for id, _ in stm_model.token_cache} == {9, 10, 11}
+    assert len(ltm_model.token_cache) == 4
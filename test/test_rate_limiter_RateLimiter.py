@@ -0,0 +1,62 @@
+import pytest, asyncio, time
+from rate_limiter import RateLimiter, TokenBucket, Priority
+
+
+def test_TokenBucket_refills_over_time():
+    bucket = TokenBucket(60, period=60)
+    now = time.monotonic()
+    bucket.take(60, now)
+    assert bucket.time_until(1, now) == pytest.approx(1)
+    assert bucket.time_until(1, now + 1) == pytest.approx(0)
+    # Amounts over the capacity wait for a full bucket
+    assert bucket.time_until(1000, now) == pytest.approx(60)
+
+
+def test_RateLimiter_enforces_requests_per_minute():
+    async def main():
+        limiter = RateLimiter(rpm=600, tpm=10**6)   # 10 requests per second after the first 600
+        limiter.requests.level = 2
+        start = time.monotonic()
+        await asyncio.gather(*[limiter.acquire(1) for _ in range(4)])
+        return time.monotonic() - start
+    assert 0.15 < asyncio.run(main()) < 0.4
+
+
+def test_RateLimiter_serves_higher_priority_first():
+    order: list[Priority] = []
+    async def main():
+        limiter = RateLimiter(rpm=600, tpm=10**6)
+        limiter.requests.level = 0
+        async def call(priority: Priority):
+            await limiter.acquire(1, priority)
+            order.append(priority)
+        tasks = [asyncio.create_task(call(priority)) for priority in (Priority.BACKFILL, Priority.EMBEDDING, Priority.BACKFILL, Priority.CHAT)]
+        await asyncio.sleep(0)
+        depth = limiter.queue_depth(Priority.BACKFILL)
+        await asyncio.gather(*tasks)
+        return limiter, depth
+    limiter, depth = asyncio.run(main())
+    assert order == [Priority.CHAT, Priority.EMBEDDING, Priority.BACKFILL, Priority.BACKFILL]
+    assert depth == 2 and limiter.queue_depth() == 0
+    assert limiter.stats[Priority.BACKFILL].acquired == 2 and limiter.stats[Priority.BACKFILL].max_wait > limiter.stats[Priority.CHAT].max_wait
+
+
+def test_RateLimiter_enforces_tokens_per_minute():
+    async def main():
+        limiter = RateLimiter(rpm=1000, tpm=6000)   # 100 tokens per second
+        limiter.tokens.level = 0
+        return await limiter.acquire(20)
+    assert 0.15 < asyncio.run(main()) < 0.4
+
+
+def test_RateLimiter_cancelled_waiter_does_not_block_queue():
+    async def main():
+        limiter = RateLimiter(rpm=600, tpm=10**6)
+        limiter.requests.level = 0
+        first = asyncio.create_task(limiter.acquire(1, Priority.CHAT))
+        second = asyncio.create_task(limiter.acquire(1, Priority.BACKFILL))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        return limiter
+    assert asyncio.run(main()).stats[Priority.BACKFILL].acquired == 1
@@ -0,0 +1,57 @@
+import pytest
+from retrieval import HybridRetriever, similarity_from_distance
+from structure import Message, SearchHit
+
+
+NOW = 1_700_000_000     # Epoch seconds
+DAY = 86400
+
+
+def message(id: int, content: str, seconds_ago: float) -> Message:
+    return Message.view(id, None, "Bob", content, int((NOW - seconds_ago) * 1_000_000))
+
+
+def hit(id: int, content: str, seconds_ago: float, distance: float) -> SearchHit:
+    return SearchHit(message(id, content, seconds_ago), distance)
+
+
+def retriever(limit: int=3, **kwargs) -> HybridRetriever:
+    return HybridRetriever(limit, clock=lambda: NOW, **kwargs)
+
+
+def test_HybridRetriever_drops_hits_in_stm():
+    stm = [message(1, "hello there", 10), message(2, "Nice  Weather", 20)]
+    hits = [hit(1, "hello there", 10, 0.1), hit(3, "nice weather", 100 * DAY, 0.2), hit(4, "pizza tonight?", 50 * DAY, 0.3)]
+    ranked = retriever().rank(hits, stm)
+    assert [m.id for m in ranked] == [4]
+
+
+def test_HybridRetriever_diversifies_bursts():
+    # Three hits from one burst, one a bit further away but from another day
+    hits = [hit(1, "we went to the lake", 30 * DAY, 0.20),
+            hit(2, "the lake was cold", 30 * DAY + 20, 0.21),
+            hit(3, "swimming in the lake", 30 * DAY + 40, 0.22),
+            hit(4, "lake trip next year?", 60 * DAY, 0.35)]
+    ranked = retriever(limit=2).rank(hits, [])
+    assert [m.id for m in ranked] == [1, 4]
+
+
+def test_HybridRetriever_returns_fewer_when_redundant():
+    hits = [hit(1, "lol", 10 * DAY, 0.1), hit(2, "lol", 40 * DAY, 0.1), hit(3, "lol", 80 * DAY, 0.1)]
+    r = retriever()
+    assert len(r.rank(hits, [])) == 1
+    assert r.stats.redundant == 2
+    assert r.stats.returned == 1
+
+
+def test_HybridRetriever_time_decay():
+    hits = [hit(1, "old but close", 3 * 365 * DAY, 0.20), hit(2, "recent and a bit further", 1 * DAY, 0.25)]
+    assert [m.id for m in retriever(limit=1).rank(hits, [])] == [2]
+    assert [m.id for m in retriever(limit=1, decay_weight=0).rank(hits, [])] == [1]
+
+
+def test_HybridRetriever_relevance():
+    r = retriever(half_life=10, decay_weight=0.5)
+    assert r.relevance(hit(1, "a", 0, 0.4), NOW * 1_000_000) == pytest.approx(similarity_from_distance(0.4))
+    assert r.relevance(hit(1, "a", 10 * DAY, 0.4), NOW * 1_000_000) == pytest.approx(0.8 * 0.75)
+    assert r.fetch_limit == 12
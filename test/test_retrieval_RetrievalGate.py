@@ -0,0 +1,76 @@
+import asyncio
+from retrieval import RetrievalGate
+from structure import Message
+from utility import Result
+
+
+def message(id: int, content: str) -> Message:
+    return Message(id, "2021-01-01 00:00:00.000000", "Bob", content)
+
+
+class FakeEmbeddings:
+    '''Embeds known strings, counts the calls which would have gone to the API'''
+    def __init__(self, vectors: dict[str, list[float]], cached: set[str]) -> None:
+        self.vectors = vectors
+        self.cached = cached
+        self.calls = 0
+
+    def lookup(self, strings: list[str]) -> list[list[float] | None]:
+        return [self.vectors[string] if string in self.cached else None for string in strings]
+
+    async def embed(self, strings: list[str]) -> Result[list[list[float]]]:
+        self.calls += 1
+        return Result.ok([self.vectors[string] for string in strings])
+
+
+def create_gate(embeddings: FakeEmbeddings) -> RetrievalGate:
+    return RetrievalGate(embeddings.lookup, embeddings.embed)
+
+
+def test_RetrievalGate_skips_short_queries():
+    embeddings = FakeEmbeddings({}, set())
+    gate = create_gate(embeddings)
+    assert asyncio.run(gate.filter(["ok", "lol", "  k  "], [])) == []
+    assert gate.stats.skipped == 1
+    assert gate.stats.short == 3
+    assert embeddings.calls == 0
+
+
+def test_RetrievalGate_skips_queries_repeating_context():
+    gate = create_gate(FakeEmbeddings({}, set()))
+    context = [message(1, "Are we still going to the cinema on Friday?")]
+    queries = ["are we still going to the cinema friday", "What did Alice say about her new job?"]
+    assert asyncio.run(gate.filter(queries, context)) == ["What did Alice say about her new job?"]
+    assert gate.stats.overlapping == 1
+    assert gate.stats.searches == 1
+
+
+def test_RetrievalGate_skips_queries_similar_to_context():
+    vectors = {
+        "the movie was great"          : [1.0, 0.0, 0.0],
+        "honestly loved that film"     : [0.99, 0.1, 0.0],
+        "when is the next exam again?" : [0.0, 1.0, 0.0],
+    }
+    embeddings = FakeEmbeddings(vectors, {"the movie was great"})
+    gate = create_gate(embeddings)
+    context = [message(1, "the movie was great")]
+    assert asyncio.run(gate.filter(["honestly loved that film", "when is the next exam again?"], context)) == ["when is the next exam again?"]
+    assert gate.stats.similar == 1
+    assert embeddings.calls == 1
+
+
+def test_RetrievalGate_no_embedding_without_cached_context():
+    embeddings = FakeEmbeddings({}, set())
+    gate = create_gate(embeddings)
+    queries = ["when is the next exam again?"]
+    assert asyncio.run(gate.filter(queries, [message(1, "the movie was great")])) == queries
+    assert embeddings.calls == 0
+
+
+def test_RetrievalGate_saved_seconds():
+    gate = create_gate(FakeEmbeddings({}, set()))
+    asyncio.run(gate.filter(["when is the next exam again?"], []))
+    gate.stats.search_seconds += 0.3
+    asyncio.run(gate.filter(["lol"], []))
+    asyncio.run(gate.filter(["ok"], []))
+    assert gate.stats.saved_seconds() == 0.6
@@ -0,0 +1,66 @@
+import pytest, asyncio
+from scheduler import ChannelActor, Scheduler
+
+
+def test_ChannelActor_batches_items_posted_while_busy():
+    batches: list[list[int]] = []
+    async def main():
+        async def handler(items: list[int]):
+            batches.append(items)
+            await asyncio.sleep(0.01)
+        actor = ChannelActor(1, handler)
+        actor.post(1)
+        await asyncio.sleep(0)
+        for i in range(2, 6): actor.post(i)
+        while actor.is_busy(): await asyncio.sleep(0.005)
+    asyncio.run(main())
+    assert batches == [[1], [2, 3, 4, 5]]
+
+
+def test_ChannelActor_restarts_after_failure():
+    batches: list[list[int]] = []
+    async def main():
+        async def handler(items: list[int]):
+            batches.append(items)
+            if items == [1]: raise ValueError("Handler failed")
+        actor = ChannelActor(1, handler)
+        actor.post(1)
+        while actor.is_busy(): await asyncio.sleep(0.005)
+        actor.post(2)
+        while actor.is_busy(): await asyncio.sleep(0.005)
+    asyncio.run(main())
+    assert batches == [[1], [2]]
+
+
+def test_ChannelActor_close_cancels_tasks():
+    async def main():
+        async def handler(items: list[int]): ...
+        actor = ChannelActor(1, handler)
+        task = actor.start_task(asyncio.sleep(10))
+        await actor.close()
+        return task, actor
+    task, actor = asyncio.run(main())
+    assert task.cancelled() and not actor.is_busy()
+
+
+def test_Scheduler_caps_concurrency():
+    running: list[int] = [0]
+    peak   : list[int] = [0]
+    async def main():
+        scheduler = Scheduler(max_pipelines=2)
+        async def pipeline():
+            async with scheduler.pipeline():
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                await asyncio.sleep(0.005)
+                running[0] -= 1
+        await asyncio.gather(*[pipeline() for _ in range(6)])
+        return scheduler
+    scheduler = asyncio.run(main())
+    assert peak[0] == 2
+    assert scheduler.stats.pipelines == 6 and scheduler.stats.pipelines_queued == 4
+
+
+def test_Scheduler_invalid_concurrency():
+    with pytest.raises(ValueError):
+        Scheduler(max_pipelines=0)
@@ -0,0 +1,46 @@
+import pytest
+from storage import AppendOnlyLog
+
+
+@pytest.fixture()
+def log_file(tmp_path) -> AppendOnlyLog:
+    return AppendOnlyLog(str(tmp_path / "memory.jsonl"))
+
+
+def test_AppendOnlyLog_read_missing(log_file: AppendOnlyLog):
+    assert not log_file.exists()
+    assert log_file.read() == []
+
+
+def test_AppendOnlyLog_append_and_read(log_file: AppendOnlyLog):
+    log_file.append([["add", 1, [[1, "date", "Bob", "Hi"]]]])
+    log_file.append([["remove", 1, 0], ["add", 2, []]])
+    assert log_file.read() == [["add", 1, [[1, "date", "Bob", "Hi"]]], ["remove", 1, 0], ["add", 2, []]]
+
+
+def test_AppendOnlyLog_append_empty(log_file: AppendOnlyLog):
+    assert log_file.append([]) == 0
+    assert not log_file.exists()
+
+
+def test_AppendOnlyLog_torn_record_is_cut(log_file: AppendOnlyLog):
+    log_file.append([["add", 1, []]])
+    size: int = log_file.size()
+    with open(log_file.file_path, 'a', encoding="utf-8") as file:
+        file.write('["add", 2, [[2, "da')
+    assert log_file.read() == [["add", 1, []]]
+    assert log_file.size() == size
+    log_file.append([["add", 3, []]])
+    assert log_file.read() == [["add", 1, []], ["add", 3, []]]
+
+
+def test_AppendOnlyLog_compact(log_file: AppendOnlyLog):
+    log_file.append([["add", 1, []], ["remove", 1, 0]])
+    log_file.compact([["snapshot", {"tokens": 0, "messages": []}]])
+    assert log_file.read() == [["snapshot", {"tokens": 0, "messages": []}]]
+
+
+def test_AppendOnlyLog_remove(log_file: AppendOnlyLog):
+    log_file.append([["add", 1, []]])
+    assert log_file.remove()
+    assert not log_file.remove()
@@ -0,0 +1,16 @@
+from structure import Message, parse_timestamp
+
+
+def test_parse_timestamp_timezone_and_fraction():
+    assert parse_timestamp("1970-01-01 00:00:01") == 1_000_000
+    assert parse_timestamp("1970-01-01 00:00:01.5+00:00") == 1_500_000
+    assert parse_timestamp("1970-01-01 01:00:00+01:00") == 0
+    assert parse_timestamp("not a date") == 0
+
+
+def test_Message_timestamp_is_parsed_once_and_date_kept():
+    message = Message(1, "2023-05-01 12:00:00.250000+00:00", "Bob", "Hello")
+    assert message.date == "2023-05-01 12:00:00.250000+00:00"
+    assert message.display_date == "2023-05-01 12:00:00"
+    assert message.created_at.microsecond == 250000
+    assert message == Message.list_to_object(message.object_to_list())
@@ -0,0 +1,30 @@
+from structure import Message, MessageStore
+
+
+def create_messages(amount: int) -> list[Message]:
+    messages: list[Message] = [Message(i, f"2023-05-01 12:{i // 60 % 60:02}:{i % 60:02}+00:00", ["Bob", "Mike"][i % 2], f"Hëllo {i}") for i in range(amount)]
+    messages.append(Message(amount, "2023-05-01 13:00:00.500000", "Bob", ""))     # Date without a timezone is kept as is
+    return messages
+
+
+def test_MessageStore_behaves_like_list():
+    messages = create_messages(10)
+    store = MessageStore(messages)
+    assert len(store) == len(messages)
+    assert store == messages
+    assert store[-1] == messages[-1]
+    assert store[2:5] == messages[2:5]
+    assert store.to_lists() == [message.object_to_list() for message in messages]
+    assert MessageStore.from_lists(store.to_lists()) == messages
+
+
+def test_MessageStore_remove_oldest_with_compaction():
+    messages = create_messages(200)
+    store = MessageStore(messages)
+    store.remove_oldest(150)
+    assert store == messages[150:]
+    store.append(Message(500, "2023-05-01 14:00:00+00:00", "Alice", "new"))
+    assert store[-1].author == "Alice"
+    assert store.id_at(0) == 150
+    store.remove_oldest(1000)
+    assert len(store) == 0
@@ -0,0 +1,51 @@
+import pytest, asyncio
+from tokenizer import TokenizerService, tokens_from_string
+
+
+def test_TokenizerService_matches_tokens_from_string():
+    strings = ["Hello, World!", "", "lol ok yeah " * 300, "(2021-01-01 00:00:00) Bob:\nwhat"]
+    tokenizer = TokenizerService(inline_chars=100, chunk_chars=1000)
+    counts = asyncio.run(tokenizer.count_tokens_batch(strings))
+    encoded = asyncio.run(tokenizer.encode_batch(strings))
+    tokenizer.close()
+    assert counts == [tokens_from_string(string) for string in strings]
+    assert [len(tokens) for tokens in encoded] == counts
+
+
+def test_TokenizerService_short_batches_stay_inline():
+    tokenizer = TokenizerService(inline_chars=100)
+    asyncio.run(tokenizer.count_tokens("Hello, World!"))
+    assert tokenizer.stats.inline == 1 and tokenizer.stats.offloaded == 0
+    assert tokenizer._executor is None
+    asyncio.run(tokenizer.count_tokens_batch(["Hello, World!"] * 10))
+    assert tokenizer.stats.offloaded == 1
+    tokenizer.close()
+
+
+def test_TokenizerService_keeps_order_across_chunks():
+    strings = [' '.join(["word"] * i) for i in range(200)]
+    tokenizer = TokenizerService(workers=4, inline_chars=0, chunk_chars=50)
+    counts = asyncio.run(tokenizer.count_tokens_batch(strings))
+    tokenizer.close()
+    assert counts == [tokens_from_string(string) for string in strings]
+
+
+def test_TokenizerService_invalid_workers():
+    with pytest.raises(ValueError):
+        TokenizerService(workers=0)
+
+
+def test_TokenizerService_special_tokens_are_text(monkeypatch):
+    import tokenizer
+    class StrictEncoding:
+        '''Raises on special tokens like tiktoken's encode does'''
+        def encode(self, string):
+            if "<|endoftext|>" in string: raise ValueError("special token")
+            return self.encode_ordinary(string)
+        def encode_ordinary(self, string): return string.split()
+    monkeypatch.setattr(tokenizer, "enc", StrictEncoding())
+    strings = ["what does <|endoftext|> mean", "hi"]
+    service = TokenizerService(inline_chars=100)
+    counts = asyncio.run(service.count_tokens_batch(strings))
+    service.close()
+    assert counts == [tokens_from_string(string) for string in strings] == [4, 1]
@@ -0,0 +1,42 @@
+import pytest
+from utility import LRUCache, TTLCache
+
+def test_LRUCache_least_recently_used_is_dropped():
+    cache: LRUCache[int, str] = LRUCache(2)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"
+    cache.put(3, "c")
+    assert 2 not in cache
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert len(cache) == 2
+
+def test_LRUCache_put_replaces_value():
+    cache: LRUCache[int, str] = LRUCache(2)
+    cache.put(1, "a")
+    cache.put(1, "b")
+    assert cache.get(1) == "b"
+    assert len(cache) == 1
+
+def test_LRUCache_lessThan1capacity():
+    with pytest.raises(ValueError):
+        LRUCache(0)
+
+def test_TTLCache_values_expire():
+    now: list[float] = [0]
+    cache: TTLCache[int, str] = TTLCache(2, ttl=10, clock=lambda: now[0])
+    cache.put(1, "a")
+    now[0] = 9
+    assert cache.get(1) == "a"
+    now[0] = 10
+    assert cache.get(1) is None and 1 not in cache
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_LRUCache_dict_style():
+    cache: LRUCache[int, str] = LRUCache(2)
+    cache[1] = "a"
+    cache[2] = "b"
+    cache[3] = "c"
+    assert 1 not in cache and cache.get(3) == "c"
+    assert cache.pop(2) == "b" and cache.pop(2, "missing") == "missing"
@@ -11,6 +11,7 @@ from vector_database import (
     connect_to_database,
     disconnect_from_database,
     create_connection_to_collection,
+    choose_nlist,
     DROP_ALL_MEMORY)
 
 
@@ -111,3 +112,14 @@ def test_channel_creation_check_and_removal(connection : MilvusConnection):
     connection.remove_channel_memory_if_exists(1)
     assert connection.has_channel(1) == False
     assert connection.has_channel(2) == True
+
+
+
+def test_choose_nlist():
+    assert choose_nlist(0) == 16
+    assert choose_nlist(1000) == 128
+    assert choose_nlist(1_000_000) == 4096
+    assert choose_nlist(10**12) == 65536
+    for rows in [10, 5000, 70000, 3_000_000]:
+        nlist: int = choose_nlist(rows)
+        assert nlist & (nlist - 1) == 0
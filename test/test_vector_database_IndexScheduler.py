@@ -0,0 +1,89 @@
+import pytest, asyncio, time
+from pymilvus import MilvusException
+from vector_database import IndexScheduler, PartitionResidency, choose_nlist
+
+
+class FakeIndex:
+    def __init__(self, nlist: int) -> None:
+        self.params = {"params": {"nlist": nlist}}
+
+
+class FakePartition:
+    def __init__(self, collection: 'FakeCollection', name: str) -> None:
+        self.collection = collection
+        self.name = name
+        self.num_entities = 10
+
+    def load(self) -> None:
+        if self.collection.index_nlist is None: raise MilvusException(message="No index")
+        self.collection.loaded.add(self.name)
+
+    def release(self) -> None:
+        self.collection.loaded.discard(self.name)
+
+
+class FakeCollection:
+    '''Like Milvus, indexes of loaded partitions can't be dropped. Dropping and creating the index take a while'''
+    def __init__(self, rows: int, nlist: int | None, fail_create: bool=False) -> None:
+        self.num_entities = rows
+        self.index_nlist = nlist
+        self.fail_create = fail_create
+        self.loaded: set[str] = set()
+
+    def partition(self, name: str) -> FakePartition: return FakePartition(self, name)
+    def flush(self) -> None: ...
+    def has_index(self) -> bool: return self.index_nlist is not None
+    def index(self) -> FakeIndex: return FakeIndex(self.index_nlist)    # type: ignore
+
+    def drop_index(self) -> None:
+        if len(self.loaded): raise MilvusException(message="Partitions are loaded")
+        time.sleep(0.05)
+        self.index_nlist = None
+
+    def create_index(self, field: str, index: dict) -> None:
+        time.sleep(0.05)
+        if self.fail_create: raise MilvusException(message="Out of memory")
+        self.index_nlist = index["params"]["nlist"]
+
+
+def create_scheduler(collection: FakeCollection) -> tuple[IndexScheduler, PartitionResidency]:
+    residency = PartitionResidency(collection, 4, 2**30)     # type: ignore
+    return IndexScheduler(collection, residency, min_new_rows=100, idle_seconds=60), residency     # type: ignore
+
+
+def test_IndexScheduler_searches_wait_for_rebuild():
+    collection = FakeCollection(100000, nlist=16)
+    async def main():
+        scheduler, residency = create_scheduler(collection)
+        await residency.ensure_loaded("1")
+        rebuild = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        # Would be loaded between the eviction and the dropped index if it didn't wait
+        await residency.ensure_loaded("1")
+        assert collection.index_nlist == choose_nlist(100000)
+        return await rebuild, scheduler
+    succeeded, scheduler = asyncio.run(main())
+    assert succeeded and scheduler.stats.builds == 1
+    assert collection.loaded == {"1"}
+
+
+def test_IndexScheduler_failed_rebuild_stays_pending():
+    collection = FakeCollection(100000, nlist=16, fail_create=True)
+    async def main():
+        scheduler, _ = create_scheduler(collection)
+        scheduler.pending_rows = 50
+        succeeded = await scheduler.run()
+        retry = scheduler._timer is not None
+        if scheduler._timer is not None: scheduler._timer.cancel()
+        return succeeded, scheduler, retry
+    succeeded, scheduler, retry = asyncio.run(main())
+    assert not succeeded and retry
+    assert scheduler.pending_rows == 50 and scheduler.stats.builds == 0
+
+
+def test_IndexScheduler_same_nlist_not_rebuilt():
+    collection = FakeCollection(100000, nlist=choose_nlist(100000))
+    scheduler, _ = create_scheduler(collection)
+    assert asyncio.run(scheduler.ensure_index())
+    assert asyncio.run(scheduler.run())
+    assert scheduler.stats.builds == 0 and scheduler.stats.nlist == choose_nlist(100000)
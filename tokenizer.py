@@ -0,0 +1,105 @@
+import asyncio, tiktoken
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+enc = tiktoken.get_encoding("cl100k_base")
+
+TOKENIZER_WORKERS     : int = 2
+TOKENIZER_INLINE_CHARS: int = 2048     # Batches with fewer characters than this are encoded on the event loop, a thread hop costs more
+TOKENIZER_CHUNK_CHARS : int = 64 * 1024 # Characters of a batch handed to one worker at once
+
+
+# Messages are text, special tokens like <|endoftext|> in them are counted as text (encode would raise)
+def tokens_from_string(string: str) -> int:
+    return len(enc.encode_ordinary(string))
+
+
+# encode_ordinary_batch would start a thread pool of its own on every call
+def _count_tokens(strings: list[str]) -> list[int]:
+    return [len(enc.encode_ordinary(string)) for string in strings]
+
+
+def _encode(strings: list[str]) -> list[list[int]]:
+    return [enc.encode_ordinary(string) for string in strings]
+
+
+def _chunks(strings: list[str], max_chars: int) -> list[list[str]]:
+    chunks: list[list[str]] = [[]]
+    chars: int = 0
+    for string in strings:
+        if chars >= max_chars:
+            chunks.append([])
+            chars = 0
+        chunks[-1].append(string)
+        chars += len(string)
+    return chunks
+
+
+
+@dataclass
+class TokenizerStats:
+    inline   : int = 0      # Batches encoded on the event loop
+    offloaded: int = 0      # Batches encoded by the worker pool
+    strings  : int = 0
+
+
+
+class TokenizerService:
+    '''
+    Encodes strings in a thread pool so large batches don't block the event loop (tiktoken releases the GIL while encoding).
+    Batches shorter than inline_chars are encoded directly, as most messages are only a few tokens long.
+    '''
+    workers     : int
+    inline_chars: int
+    stats       : TokenizerStats
+
+    def __init__(self, workers: int=TOKENIZER_WORKERS, inline_chars: int=TOKENIZER_INLINE_CHARS, chunk_chars: int=TOKENIZER_CHUNK_CHARS) -> None:
+        if workers <= 0:
+            raise ValueError("Workers cannot be less than 1")
+        self.workers = workers
+        self.inline_chars = inline_chars
+        self.chunk_chars = chunk_chars
+        self.stats = TokenizerStats()
+        self._executor: ThreadPoolExecutor | None = None
+
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tokenizer")
+        return self._executor
+
+
+    async def _run(self, function, strings: list[str]) -> list:
+        self.stats.strings += len(strings)
+        if sum(len(string) for string in strings) < self.inline_chars:
+            self.stats.inline += 1
+            return function(strings)
+        self.stats.offloaded += 1
+        loop = asyncio.get_running_loop()
+        executor: ThreadPoolExecutor = self._get_executor()
+        results: list[list] = await asyncio.gather(*[loop.run_in_executor(executor, function, chunk) for chunk in _chunks(strings, self.chunk_chars)])
+        return [result for chunk in results for result in chunk]
+
+
+    async def encode_batch(self, strings: list[str]) -> list[list[int]]:
+        return await self._run(_encode, strings)
+
+
+    async def count_tokens_batch(self, strings: list[str]) -> list[int]:
+        '''Same as the lengths of encode_batch, without sending the tokens back from the workers'''
+        return await self._run(_count_tokens, strings)
+
+
+    async def count_tokens(self, string: str) -> int:
+        return (await self.count_tokens_batch([string]))[0]
+
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+
+TOKENIZER: TokenizerService = TokenizerService()
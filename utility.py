@@ -1,5 +1,6 @@
-import math, os, json
-from typing import TypeVar, Generic, Optional, Callable, Any
+import math, os, json, time
+from collections import OrderedDict
+from typing import TypeVar, Generic, Optional, Callable, Any, Hashable
 from threading import Thread
 
 
@@ -113,6 +114,70 @@ class Result(Generic[T]):
     
 
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+class LRUCache(Generic[K, V]):
+    '''Keeps the most recently used values, the least recently used one is dropped once the cache is full'''
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError("Capacity cannot be less than 1")
+        self.capacity = capacity
+        self._values: OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._values
+
+    def get(self, key: K) -> Optional[V]:
+        if key not in self._values: return None
+        self._values.move_to_end(key)
+        return self._values[key]
+
+    def put(self, key: K, value: V) -> None:
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.capacity:
+            self._values.popitem(last=False)
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self.put(key, value)
+
+    def pop(self, key: K, default: Optional[V]=None) -> Optional[V]:
+        return self._values.pop(key, default)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+
+
+class TTLCache(LRUCache[K, V]):
+    '''LRUCache whose values expire ttl seconds after they were put'''
+    def __init__(self, capacity: int, ttl: float, clock: Callable[[], float]=time.monotonic):
+        super().__init__(capacity)
+        self.ttl = ttl
+        self.clock = clock
+        self.hits  : int = 0
+        self.misses: int = 0
+
+    def get(self, key: K) -> Optional[V]:
+        entry: Optional[tuple[float, V]] = super().get(key)     # type: ignore
+        if entry is not None and entry[0] <= self.clock():
+            self.pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: K, value: V) -> None:
+        super().put(key, (self.clock() + self.ttl, value))      # type: ignore
+
+
+
 class CustomThread(Thread):
     def __init__(self, group=None, target=None, name=None,
                  args=(), kwargs={}, Verbose=None):
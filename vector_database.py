@@ -13,11 +13,16 @@ from pymilvus import (
     MilvusException
 )
 
+import time, math
 from enum import Enum
+from collections import OrderedDict
 from dataclasses import dataclass
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 from utility import multi_batch_iterator, Result, CustomThread
-from structure import Message, DatabaseEntry
+from structure import Message, DatabaseEntry, SearchHit
+from interface import VectorStoreInterface
 
 from debug import LogHanglerInterface, LogNothing, LogType
 
@@ -43,6 +48,12 @@ _MAX_AUTHOR_LENGTH      : int = 40
 _MAX_CONTENT_LENGTH     : int = 2500
 _MAX_INSERT_BATCH_SIZE  : int = 1000
 
+_PARTITION_MEMORY_BUDGET: int = 2 * 1024**3     # In bytes, loaded partitions are released beyond this
+_ROW_SCALAR_BYTES       : int = 512             # Estimated size of a row's id, date, author and content
+
+_INDEX_MIN_NEW_ROWS     : int   = 2000          # Changed rows after which the collection is flushed and its index checked
+_INDEX_IDLE_SECONDS     : float = 30            # Changed rows are flushed after this long without new changes
+
 _MILVUS = None
 
 # STRUCTS
@@ -61,11 +72,222 @@ class ConnectionInfo:
     max_insert_batch_size  : int
 
 
+@dataclass
+class ResidencyStats:
+    hits        : int = 0
+    loads       : int = 0
+    evictions   : int = 0
+    load_seconds: float = 0
+
+
+
+@dataclass
+class IndexStats:
+    flushes : int = 0
+    builds  : int = 0
+    nlist   : int = 0
+
+
+
+# FUNCTIONS
+
+def choose_nlist(rows: int) -> int:
+    '''IVF cluster amount for the given amount of rows, ~4 * sqrt(rows) rounded to a power of two'''
+    target: float = 4 * math.sqrt(max(rows, 1))
+    return min(max(2 ** round(math.log2(target)), 16), 65536)
+
+
+
 # CLASSES
 
-class MilvusConnection():
+class PartitionResidency():
+    '''
+    Keeps searched partitions loaded between searches. 
+    Once the estimated size of loaded partitions goes over the memory budget, the least recently used ones are released.
+    '''
+    _collection   : Collection
+    _loaded       : OrderedDict[str, int]     # Partition name -> estimated bytes, least recently used first
+    row_bytes     : int
+    memory_budget : int
+    stats         : ResidencyStats
+
+    def __init__(self, collection: Collection, dim: int, memory_budget: int) -> None:
+        self._collection = collection
+        self._loaded = OrderedDict()
+        self._lock: asyncio.Lock | None = None
+        self.row_bytes = dim * 4 + _ROW_SCALAR_BYTES
+        self.memory_budget = memory_budget
+        self.stats = ResidencyStats()
+
+
+    def loaded_bytes(self) -> int:
+        return sum(self._loaded.values())
+
+
+    def loaded_partitions(self) -> list[str]:
+        return list(self._loaded.keys())
+
+
+    async def ensure_loaded(self, partition_name: str, log: LogHanglerInterface=LogNothing()) -> None:
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            if partition_name in self._loaded:
+                self._loaded.move_to_end(partition_name)
+                self.stats.hits += 1
+                return
+
+            partition: Partition = self._collection.partition(partition_name)
+            size: int = await asyncio.get_event_loop().run_in_executor(None, lambda _ : partition.num_entities, "param") * self.row_bytes
+
+            # Make room
+            while len(self._loaded) and self.loaded_bytes() + size > self.memory_budget:
+                await self._release(next(iter(self._loaded)), log=log)
+
+            start: float = time.perf_counter()
+            await asyncio.get_event_loop().run_in_executor(None, lambda _ : partition.load(), "param")
+            self.stats.load_seconds += time.perf_counter() - start
+            self.stats.loads += 1
+            self._loaded[partition_name] = size
+            log.log(LogType.DEBUG, f"Partition loaded\nname: {partition_name}\nsize: {size}\nloaded: {self.loaded_bytes()}/{self.memory_budget}")
+
+
+    async def evict(self, partition_name: str, log: LogHanglerInterface=LogNothing()) -> None:
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            if partition_name in self._loaded:
+                await self._release(partition_name, log=log)
+
+
+    async def evict_all(self, log: LogHanglerInterface=LogNothing()) -> None:
+        async with self.unloaded(log=log): pass
+
+
+    @asynccontextmanager
+    async def unloaded(self, log: LogHanglerInterface=LogNothing()) -> AsyncIterator[None]:
+        '''Releases every partition and keeps them from being loaded again until the block exits (while the index is rebuilt)'''
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            for partition_name in list(self._loaded.keys()):
+                await self._release(partition_name, log=log)
+            yield
+
+
+    async def _release(self, partition_name: str, log: LogHanglerInterface=LogNothing()) -> None:
+        self._loaded.pop(partition_name)
+        partition: Partition = self._collection.partition(partition_name)
+        await asyncio.get_event_loop().run_in_executor(None, lambda _ : partition.release(), "param")
+        self.stats.evictions += 1
+        log.log(LogType.DEBUG, f"Partition released\nname: {partition_name}")
+
+
+
+class IndexScheduler():
+    '''
+    Coalesces flushes and index builds of a collection, so they don't run on every insert and delete.
+    Maintenance runs in the background once enough rows have changed, or after the collection has been idle for a while.
+    The IVF_FLAT index is only rebuilt when the amount of rows calls for a different nlist.
+    '''
+    _collection  : Collection
+    _residency   : PartitionResidency
+    pending_rows : int
+    min_new_rows : int
+    idle_seconds : float
+    stats        : IndexStats
+
+    def __init__(self, collection: Collection, residency: PartitionResidency, min_new_rows: int=_INDEX_MIN_NEW_ROWS, idle_seconds: float=_INDEX_IDLE_SECONDS) -> None:
+        self._collection = collection
+        self._residency = residency
+        self.pending_rows = 0
+        self.min_new_rows = min_new_rows
+        self.idle_seconds = idle_seconds
+        self.stats = IndexStats()
+        self._lock: asyncio.Lock | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+
+
+    def note_changes(self, rows: int, log: LogHanglerInterface=LogNothing()) -> None:
+        '''Registers inserted or deleted rows, schedules maintenance'''
+        self.pending_rows += rows
+        if self._timer is not None: self._timer.cancel()
+        loop = asyncio.get_event_loop()
+        if self.pending_rows >= self.min_new_rows: 
+            self._timer = None
+            self._start(log)
+        else:
+            self._timer = loop.call_later(self.idle_seconds, self._start, log)
+
+
+    def _start(self, log: LogHanglerInterface=LogNothing()) -> None:
+        self._timer = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self.run(log=log))
+
+
+    def _current_nlist(self) -> int:
+        try:
+            return int(self._collection.index().params["params"]["nlist"])
+        except Exception:
+            return 0
+
+
+    async def ensure_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Creates the index if the collection has none. Returns True if the collection has an index'''
+        if await asyncio.to_thread(self._collection.has_index):
+            if not self.stats.nlist: self.stats.nlist = await asyncio.to_thread(self._current_nlist)
+            return True
+        return await self.run(log=log)
+
+
+    async def run(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        '''Flushes pending rows and (re)builds the index if needed. Returns True if succesful'''
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            pending_rows: int = self.pending_rows
+            try:
+                if self.pending_rows:
+                    self.pending_rows = 0
+                    await loop.run_in_executor(None, lambda _ : self._collection.flush(), "param")
+                    self.stats.flushes += 1
+
+                rows : int = await loop.run_in_executor(None, lambda _ : self._collection.num_entities, "param")
+                nlist: int = choose_nlist(rows)
+                has_index: bool = await asyncio.to_thread(self._collection.has_index)
+                if has_index and await asyncio.to_thread(self._current_nlist) == nlist: 
+                    self.stats.nlist = nlist
+                    return True
+
+                index = {
+                    "index_type": "IVF_FLAT",
+                    "metric_type": "L2",
+                    "params": {"nlist": nlist},
+                }
+                if has_index:
+                    # Indexes of loaded collections cannot be dropped. Searches wait until the new index is built
+                    async with self._residency.unloaded(log=log.sub()):
+                        await loop.run_in_executor(None, lambda _ : self._collection.drop_index(), "param")
+                        await loop.run_in_executor(None, lambda _ : self._collection.create_index("embedding", index), "param")
+                else:
+                    await loop.run_in_executor(None, lambda _ : self._collection.create_index("embedding", index), "param")
+                self.stats.builds += 1
+                self.stats.nlist = nlist
+                log.log(LogType.INFO, f"Index built\nrows : {rows}\nnlist: {nlist}")
+            except MilvusException as e:
+                # Kept pending and retried once the collection is idle
+                self.pending_rows += pending_rows
+                if self._timer is None: self._timer = loop.call_later(self.idle_seconds, self._start, log)
+                log.log(LogType.ERROR, f"Failed to maintain index!\nerror: {e}")
+                return False
+        return True
+
+
+
+class MilvusConnection(VectorStoreInterface):
     _collection : Collection
     _collection_info : ConnectionInfo
+    residency : PartitionResidency
+    index_scheduler : IndexScheduler
 
     @staticmethod
     def get_partion_name(channel_id: int) -> str:
@@ -74,9 +296,11 @@ class MilvusConnection():
 
 
 
-    def __init__(self, collection : Collection, collectionInfo : ConnectionInfo) -> None:
+    def __init__(self, collection : Collection, collectionInfo : ConnectionInfo, memory_budget : int = _PARTITION_MEMORY_BUDGET) -> None:
         self._collection      = collection
         self._collection_info = collectionInfo
+        self.residency        = PartitionResidency(collection, collectionInfo.dim, memory_budget)
+        self.index_scheduler  = IndexScheduler(collection, self.residency)
 
 
     def has_channel(self, channel_id : int) -> bool:
@@ -95,6 +319,7 @@ class MilvusConnection():
     async def remove_channel_memory_if_exists(self, channel_id : int, log: LogHanglerInterface=LogNothing()) -> bool:
         '''Returns True if channel was removed, False if channel wasn't removed because it doesn't exist'''
         if self.has_channel(channel_id):
+            await self.residency.evict(MilvusConnection.get_partion_name(channel_id), log=log.sub())
             self._collection.drop_partition(MilvusConnection.get_partion_name(channel_id))
             log.log(LogType.INFO, f"Channel removed\nid: {channel_id}")
             return True
@@ -128,7 +353,7 @@ class MilvusConnection():
         # for result in results:
         #     result.result()
 
-        self._collection.flush()
+        self.index_scheduler.note_changes(len(entries), log=log.sub())
         log.log(LogType.DEBUG, "Insert success!")
         return True
 
@@ -142,34 +367,32 @@ class MilvusConnection():
         except MilvusException as e:
             log.log(LogType.ERROR, f"Failed to remove messages from {self._collection_info.collection_name}!\namount: {len(entry_ids)}\nfirst message id: {entry_ids[0]}")
             return False
+        self.index_scheduler.note_changes(len(entry_ids), log=log.sub())
         return True
 
 
 
     async def create_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
-        """Returns True if index was succesfully created, False if error occurred"""
-        index = {
-            "index_type": "IVF_FLAT",
-            "metric_type": "L2",
-            "params": {"nlist": 128},
-        }
-        try:
-            await asyncio.get_event_loop().run_in_executor(None, lambda _ : self._collection.create_index("embedding", index), "param")
-        except MilvusException as e:
-            log.log(LogType.ERROR, f"Failed to create index for {self._collection_info.collection_name}!")
-            return False
-        return True
+        """Flushes pending rows and (re)builds the index now if needed. Returns True if succesful, False if error occurred"""
+        return await self.index_scheduler.run(log=log)
 
 
-    async def search(self, 
-                     channel_id : int, 
-                     vectors : list[list[float]] | None = None, expr : str | None = None, 
-                     log: LogHanglerInterface=LogNothing()) -> Result[list[list[Message]]]:
+    async def ensure_index(self, log: LogHanglerInterface=LogNothing()) -> bool:
+        """Creates the index only if the collection has none. Returns True if succesful, False if error occurred"""
+        return await self.index_scheduler.ensure_index(log=log)
+
+
+    async def search_hits(self, 
+                          channel_id : int, 
+                          vectors : list[list[float]] | None = None, expr : str | None = None, 
+                          limit : int = 10,
+                          log: LogHanglerInterface=LogNothing()) -> Result[list[list[SearchHit]]]:
+        '''Searches every vector in one call. Returns the hits of each vector, closest first'''
         search_param = {
             "data"              :   vectors,
             "anns_field"        :   "embedding",
             "param"             :   {"metric_type": "L2", "params": {"nprobe": 10}},
-            "limit"             :   10,
+            "limit"             :   limit,
             "expr"              :   expr,
             "partition_names"   :   [MilvusConnection.get_partion_name(channel_id)],
             "output_fields"     :   ["date", "author", "content"]
@@ -179,7 +402,7 @@ class MilvusConnection():
         log.log(LogType.WARNING, partitionName)
 
         try:
-            await asyncio.get_event_loop().run_in_executor(None, lambda _ : self._collection.load([partitionName]), "param")
+            await self.residency.ensure_loaded(partitionName, log=log.sub())
             result = await asyncio.get_event_loop().run_in_executor(None, lambda _ : self._collection.search(**search_param), "param")
         except MilvusException as e:
             log.log(LogType.ERROR, f"Search failed for {self._collection_info.collection_name}!\nvector amount: {len(vectors) if vectors else '0'}\nexpr: {expr}")
@@ -189,19 +412,18 @@ class MilvusConnection():
         if isinstance(result, SearchFuture): res = result.result()
         else                               : res = result
 
-        await asyncio.get_event_loop().run_in_executor(None, lambda _ : self._collection.release(), "param")
         log.log(LogType.DEBUG, "Search success!")
 
-        messages : list[list[Message]] = [
-            [ Message(hit.id, hit.entity.date , hit.entity.author, hit.entity.content) for hit in hits ] 
+        hits : list[list[SearchHit]] = [
+            [ SearchHit(Message(hit.id, hit.entity.date , hit.entity.author, hit.entity.content), hit.distance) for hit in hits ] 
             for hits in res ]
 
-        return Result.ok(messages)
+        return Result.ok(hits)
         # else:
         #     log.log(LogType.ERROR, f"Failed to retreive result from search!\nstatus: {status}")
         #     return Result.err(Exception(f"Failed to retreive result from search!\nstatus: {status}"))
 
-    
+
 
 # MODULE INTERFACE
 
@@ -219,7 +441,7 @@ async def disconnect_from_database() -> None:
 async def create_connection_to_collection(collectionType : CollectionType) -> MilvusConnection:
     global _CONNECTIONS
     if collectionType.value in _CONNECTIONS:
-        return _CONNECTIONS[str(collectionType)]
+        return _CONNECTIONS[collectionType.value]
 
     fields = [
         FieldSchema(name="id",        dtype=DataType.INT64,         is_primary=True,                description="Primary Entry ID"),
@@ -241,8 +463,8 @@ async def create_connection_to_collection(collectionType : CollectionType) -> Mi
         max_content_length      =   _MAX_CONTENT_LENGTH, 
         max_insert_batch_size   =   _MAX_INSERT_BATCH_SIZE)
 
-    _CONNECTIONS[str(collectionType)] = MilvusConnection(collection, connectionInfo)
-    return _CONNECTIONS[str(collectionType)]
+    _CONNECTIONS[collectionType.value] = MilvusConnection(collection, connectionInfo)
+    return _CONNECTIONS[collectionType.value]
 
 
 async def DROP_ALL_MEMORY(collectionType : CollectionType):